@@ -1,33 +1,70 @@
-from fastapi import APIRouter, UploadFile, File, Query, Depends
+import asyncio
+import os
+import re
+import time
+import uuid
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    UploadFile,
+    File,
+    Query,
+    Depends,
+    HTTPException,
+    Header,
+    Request,
+    Response,
+)
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from app.core.config import settings
-from app.core.database import get_db
+from app.core.database import SessionLocal, get_db
 from app.models.chat_analysis import ChatAnalysis
 
 from app.services.parser_service import WhatsAppParser
+from app.services.archive_service import open_chat_stream, spool_chat
+from app.services.parse_cache import ParseCache, hash_upload
+from app.services.chat_state_service import (
+    chat_key,
+    load_chat_state,
+    save_chat_state,
+    snapshot_chat_state,
+)
+from app.services.upload_session_service import UploadSession, UploadSessionStore
+from app.services.message_table import to_epoch
 from app.services.AnalysisService import AnalysisService
 from app.services.ai_service import AIService
-
-from app.engines.metrics_engine import MetricsEngine
-from app.engines.trait_engine import TraitEngine
-from app.engines.universe_engine import UniverseEngine
-from app.engines.behavior_engine import BehaviorEngine
-from app.engines.engagement_engine import EngagementEngine
-from app.engines.linguistic_engine import LinguisticEngine
-from app.engines.trend_engine import TrendEngine
-from app.engines.pair_engine import PairDynamicsEngine
-from app.engines.character_engine import CharacterEngine
-from app.engines.explanation_engine import ExplanationEngine
-from app.engines.group_health_engine import GroupHealthEngine
-from app.engines.risk_engine import RiskEngine
-from app.engines.user_summary_engine import UserSummaryEngine
+from app.services.cancellation import AnalysisCancelled, CancelToken, DeadlineExceeded
+from app.services.analysis_job_service import AnalysisJob, AnalysisJobStore
+from app.services.analysis_pool import (
+    AnalysisPool,
+    PoolBusy,
+    build_analysis_service,
+    index_trends,
+    parse_chat,
+    parse_chat_range,
+    parse_merged_chats,
+    preview_chat,
+    preview_chat_file,
+    resume_chat_file,
+    scan_chat,
+)
 
 from app.services.ai_payload_builder import (
     build_user_payload_from_analysis,
     build_group_payload_from_analysis,
 )
 
-from app.services.analysis_orchestrator import run_full_analysis
+from app.services.analysis_orchestrator import (
+    PendingAnalysis,
+    resume_analyses,
+    run_universe_analyses,
+)
 
 router = APIRouter(prefix="/analysis", tags=["analysis"])
 
@@ -35,24 +72,35 @@ router = APIRouter(prefix="/analysis", tags=["analysis"])
 # ---- Instantiate Core Services Once ----
 parser = WhatsAppParser()
 
-analysis_service = AnalysisService(
-    metrics_engine=MetricsEngine(),
-    trait_engine=TraitEngine(),
-    universe_engine=UniverseEngine(),
-    behavior_engine=BehaviorEngine(),
-    engagement_engine=EngagementEngine(),
-    linguistic_engine=LinguisticEngine(),
-    trend_engine=TrendEngine(),
-    pair_engine=PairDynamicsEngine(),
-    character_engine=CharacterEngine(),
-    explanation_engine=ExplanationEngine(),
-    group_health_engine=GroupHealthEngine(),
-    risk_engine=RiskEngine(),
-    user_summary_engine=UserSummaryEngine(),
+# Parsing and the deterministic engines, in worker processes
+analysis_pool = AnalysisPool(settings.ANALYSIS_WORKERS, settings.ANALYSIS_QUEUE_DEPTH)
+
+# Sections, windows and incremental merges; the heavy work runs in the
+# pool, and so do the chunks of big chats' map-reduced message scans
+analysis_service = build_analysis_service(
+    scan_chunks=max(analysis_pool.workers, 1),
+    scan_executor=analysis_pool.scan_executor(),
+    scan_min_messages=settings.SCAN_MAP_REDUCE_MIN_MESSAGES,
 )
 
 ai_service = AIService(api_key=settings.GROQ_API_KEY)  # Use config internally
 
+upload_sessions = UploadSessionStore(parser)
+
+# Rest of deadline-cut analyses (X-Deadline-Ms), finished in the background
+analysis_jobs = AnalysisJobStore()
+
+parse_cache = ParseCache(settings.PARSE_CACHE_DIR, settings.PARSE_CACHE_MAX_BYTES)
+
+# How often an upload checks whether its client has gone away
+DISCONNECT_POLL_SECONDS = 0.5
+
+# Trend prefix sums of recently windowed chats (by X-Chat-Hash), so
+# repeated from=/to= queries on one chat don't rescan it for trends.
+# Indexes are sized by (sender, hour) buckets, not messages.
+trend_indexes = OrderedDict()
+TREND_INDEX_CACHE_SIZE = 32
+
 
 # ---- Safe AI Wrapper ----
 async def generate_ai_layer_safe(analysis: dict):
@@ -78,32 +126,1161 @@ async def generate_ai_layer_safe(analysis: dict):
         }
 
 
+# ---- Backpressure ----
+async def analysis_slot():
+    """One admitted analysis per request; 503 + Retry-After when the pool is full."""
+
+    try:
+        analysis_pool.admit()
+    except PoolBusy:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many analyses in progress, try again shortly",
+            headers={"Retry-After": str(settings.ANALYSIS_RETRY_AFTER)},
+        )
+
+    try:
+        yield
+    finally:
+        analysis_pool.release()
+
+
 # ---- Main Endpoint ----
-@router.post("/upload")
+@router.post("/upload", dependencies=[Depends(analysis_slot)])
 async def analyze_chat(
+    request: Request,
+    response: Response,
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     universe: str = Query("mcu"),
+    sections: Optional[str] = Query(None),
+    from_: Optional[str] = Query(None, alias="from"),
+    to: Optional[str] = Query(None),
+    mode: str = Query("exact"),
+    exact: bool = Query(False),
+    keep_partial: bool = Query(False),
+    x_deadline_ms: Optional[int] = Header(None),
+    db: Session = Depends(get_db),
+):
+    """
+    ``mode=preview`` answers from a sample of huge chats; with ``exact=true``
+    the exact analysis then runs in the background and replaces the record.
+
+    If the client disconnects, engines stop at the next stage boundary,
+    pending AI calls are dropped and nothing is stored -- unless
+    ``keep_partial=true``, which stores the sections that finished.
+
+    ``X-Deadline-Ms`` bounds an exact analysis, parse and scan included:
+    when it runs out, the sections that finished are returned (and stored),
+    meta.skipped lists the rest and meta.job a job that completes them (GET
+    /jobs/{id}). Out of time before the analysis starts, that's all of them.
+    """
+
+    deadline = _parse_deadline(x_deadline_ms)
+    sections = _parse_sections(sections)
+    window = _parse_window(from_, to)
+
+    if mode not in ("exact", "preview"):
+        raise HTTPException(status_code=400, detail="mode must be exact or preview")
+
+    cancel = CancelToken()
+    watcher = asyncio.create_task(_watch_disconnect(request, cancel))
+
+    try:
+        if mode == "preview":
+            return await _preview_upload(
+                file,
+                response,
+                universe,
+                db,
+                sections,
+                window,
+                background_tasks if exact else None,
+                cancel,
+                keep_partial,
+            )
+
+        if window is not None:
+            # A slice of the chat: analyse it, leave the stored chat state alone
+            chat_hash, parsed, path = await _read_upload(file)
+            response.headers["X-Chat-Hash"] = chat_hash
+
+            prepared = asyncio.create_task(_prepare_window(chat_hash, parsed, path, window))
+
+            if not await _in_time(prepared, deadline, cancel):
+                return _defer(prepared, universe, db, sections, background_tasks)
+
+            parsed, options = prepared.result()
+
+            return await _analyze_and_store(
+                parsed,
+                universe,
+                db,
+                sections,
+                cancel=cancel,
+                keep_partial=keep_partial,
+                deadline=deadline,
+                background_tasks=background_tasks,
+                **options,
+            )
+
+        # Seen this chat before (an older export)? Only the new messages are
+        # parsed and scanned, then merged into the stored aggregates
+        key = chat_key(_open_upload(file))
+        record = load_chat_state(db, key)
+
+        state = None
+        if record is not None:
+            state = snapshot_chat_state(record)
+            # Outlives the session's commit, should the state be saved after it
+            db.expunge(record)
+
+        chat_hash, parsed, path = await _read_upload(file, resume=state is not None)
+        if state is None:
+            response.headers["X-Chat-Hash"] = chat_hash
+
+        # Parse and scan against the deadline: what doesn't fit in it is
+        # finished by the job, with the analysis
+        prepared = asyncio.create_task(_prepare_chat(chat_hash, parsed, path, state, response))
+
+        if not await _in_time(prepared, deadline, cancel):
+            return _defer(
+                prepared,
+                universe,
+                db,
+                sections,
+                background_tasks,
+                then=partial(_save_chat_state, key, record),
+            )
+
+        parsed, scan, resumed = prepared.result()
+        await run_in_threadpool(save_chat_state, db, key, record, parsed, scan, resumed)
+
+        return await _analyze_and_store(
+            parsed,
+            universe,
+            db,
+            sections,
+            scan,
+            cancel=cancel,
+            keep_partial=keep_partial,
+            deadline=deadline,
+            background_tasks=background_tasks,
+        )
+
+    except AnalysisCancelled:
+        # Nobody is left to read this (499: client closed request)
+        return Response(status_code=499)
+
+    finally:
+        watcher.cancel()
+        cancel.close()
+
+
+async def _watch_disconnect(request: Request, cancel: CancelToken) -> None:
+
+    while not await request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+    cancel.cancel()
+
+
+@router.post("/chats/{chat_hash}", dependencies=[Depends(analysis_slot)])
+async def reanalyze_chat(
+    chat_hash: str,
+    background_tasks: BackgroundTasks,
+    universe: str = Query("mcu"),
+    sections: Optional[str] = Query(None),
+    from_: Optional[str] = Query(None, alias="from"),
+    to: Optional[str] = Query(None),
+    x_deadline_ms: Optional[int] = Header(None),
     db: Session = Depends(get_db),
 ):
+    """Re-run a previously uploaded chat (X-Chat-Hash) without re-uploading it."""
 
-    content = (await file.read()).decode("utf-8")
-    parsed = parser.parse(content)
+    deadline = _parse_deadline(x_deadline_ms)
+    sections = _parse_sections(sections)
+    window = _parse_window(from_, to)
 
-    analysis = await run_full_analysis(
-        parsed_data=parsed,
-        universe=universe,
-        analysis_service=analysis_service,
-        ai_service=ai_service,
+    parsed = parse_cache.get(chat_hash)
+    if parsed is None:
+        raise HTTPException(status_code=404, detail="Chat not in cache, upload it again")
+
+    if window is not None:
+        return await _analyze_window(
+            chat_hash,
+            parsed,
+            window,
+            universe,
+            db,
+            sections,
+            deadline=deadline,
+            background_tasks=background_tasks,
+        )
+
+    return await _analyze_and_store(
+        parsed, universe, db, sections, deadline=deadline, background_tasks=background_tasks
     )
 
-    # Save to DB
-    record = ChatAnalysis(
-        universe=universe,
-        participants_count=len(parsed.get("participants", [])),
-        analysis=analysis,
+
+async def _read_upload(
+    file: UploadFile, resume: bool = False
+) -> Tuple[str, Optional[dict], Optional[str]]:
+    """
+    (hash, cached parse, spooled path) of an upload: all that's read from it,
+    while the request still holds it. The path is None for a cached parse;
+    ``resume`` skips the cache and always spools.
+    """
+
+    # Same bytes -> same parse; re-uploads skip the parser entirely
+    file.file.seek(0)
+    chat_hash = await run_in_threadpool(hash_upload, file.file)
+
+    parsed = None if resume else parse_cache.get(chat_hash)
+    path = None if parsed is not None else await _spool_upload(file)
+
+    return chat_hash, parsed, path
+
+
+async def _parse_cached(chat_hash: str, parsed: Optional[dict], path: str) -> dict:
+    """_read_upload()'s parse: the cached one, or the spooled chat's (then cached)."""
+
+    if parsed is None:
+        parsed = await _parse_spooled(path)
+        await run_in_threadpool(parse_cache.put, chat_hash, parsed)
+
+    return parsed
+
+
+async def _prepare_chat(
+    chat_hash: str,
+    parsed: Optional[dict],
+    path: Optional[str],
+    state: Optional[dict],
+    response: Response,
+) -> Tuple[dict, dict, bool]:
+    """
+    (parsed, scan, resumed) of a _read_upload(). With a stored ``state``
+    (snapshot) only the new messages are parsed and scanned; otherwise the
+    whole chat is. Removes the spooled file.
+    """
+
+    try:
+        if state is not None:
+            resumed = await analysis_pool.run(resume_chat_file, state, path)
+            if resumed is not None:
+                parsed, scan = resumed
+                return parsed, scan, True
+
+            # Stored state this version can't read: as a new chat
+            response.headers["X-Chat-Hash"] = chat_hash
+            parsed = parse_cache.get(chat_hash)
+
+        parsed = await _parse_cached(chat_hash, parsed, path)
+    finally:
+        if path is not None:
+            os.remove(path)
+
+    if analysis_service.map_reduces(parsed):
+        # Big chat: its time chunks are scanned across the workers
+        scan = await run_in_threadpool(analysis_service.scan, parsed)
+    else:
+        scan = await analysis_pool.run(scan_chat, parsed)
+
+    return parsed, scan, False
+
+
+async def _save_chat_state(
+    key: Optional[str], record, parsed: dict, scan: dict, resumed: bool
+) -> Tuple[dict, dict]:
+    """
+    Background: a deferred upload's chat state, in its own session;
+    (parsed, analysis options) for the rest of the job.
+    """
+
+    db = SessionLocal()
+    try:
+        await run_in_threadpool(save_chat_state, db, key, record, parsed, scan, resumed)
+        db.commit()
+    finally:
+        db.close()
+
+    return parsed, {"scan": scan}
+
+
+async def _prepare_window(
+    chat_hash: str,
+    parsed: Optional[dict],
+    path: Optional[str],
+    window: Tuple[Optional[int], Optional[int]],
+) -> Tuple[dict, dict]:
+    """(windowed parse, analysis options) of a _read_upload(); removes the spooled file."""
+
+    try:
+        parsed = await _parse_cached(chat_hash, parsed, path)
+    finally:
+        if path is not None:
+            os.remove(path)
+
+    return await _window_chat(chat_hash, parsed, window)
+
+
+def _open_upload(file: UploadFile):
+
+    file.file.seek(0)
+
+    # .txt, or the chat member of a .zip / .gz / .zst export
+    try:
+        return open_chat_stream(file.file)
+    except ValueError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+
+
+async def _parse_spooled(path: str) -> dict:
+    """
+    Columnar parse of a spooled chat text file. Big ones are split at line
+    boundaries and their chunks parsed across the pool's workers.
+    """
+
+    if analysis_pool.workers > 1 and os.path.getsize(path) >= parser.PARALLEL_MIN_BYTES:
+        # Chunks run in the workers; only the column merge runs here
+        return await run_in_threadpool(
+            parser.parse_parallel,
+            path,
+            analysis_pool.workers,
+            True,
+            analysis_pool.scan_executor(),
+        )
+
+    return await analysis_pool.run(parse_chat, path)
+
+
+async def _spool_upload(file: UploadFile) -> str:
+    """
+    Path of a temp file with the upload's chat text, for a worker to parse
+    from disk -- upload bytes are never sent to a worker. Unreadable
+    archives are a 415 before anything is sent.
+    """
+
+    file.file.seek(0)
+
+    try:
+        return await run_in_threadpool(spool_chat, file.file)
+    except ValueError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+
+
+# ---- Merge Overlapping Exports ----
+@router.post("/merge", dependencies=[Depends(analysis_slot)])
+async def merge_chats(
+    background_tasks: BackgroundTasks,
+    files: List[UploadFile] = File(...),
+    universe: str = Query("mcu"),
+    sections: Optional[str] = Query(None),
+    x_deadline_ms: Optional[int] = Header(None),
+    db: Session = Depends(get_db),
+):
+    """Analyze several exports of one chat as a single deduplicated timeline."""
+
+    deadline = _parse_deadline(x_deadline_ms)
+    sections = _parse_sections(sections)
+
+    paths = []
+
+    try:
+        for file in files:
+            paths.append(await _spool_upload(file))
+    except BaseException:
+        for path in paths:
+            os.remove(path)
+        raise
+
+    prepared = asyncio.create_task(_prepare_merged(paths))
+
+    if not await _in_time(prepared, deadline):
+        return _defer(prepared, universe, db, sections, background_tasks)
+
+    parsed, _ = prepared.result()
+
+    return await _analyze_and_store(
+        parsed, universe, db, sections, deadline=deadline, background_tasks=background_tasks
+    )
+
+
+async def _prepare_merged(paths: List[str]) -> Tuple[dict, dict]:
+    """(merged parse, analysis options) of spooled exports; removes them."""
+
+    try:
+        return await analysis_pool.run(parse_merged_chats, paths), {}
+    finally:
+        for path in paths:
+            os.remove(path)
+
+
+# ---- Resumable Upload ----
+CONTENT_RANGE_PATTERN = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+@router.post("/uploads")
+async def create_upload():
+    session = upload_sessions.create()
+    return {"upload_id": session.id, "received": session.received}
+
+
+@router.get("/uploads/{upload_id}")
+async def upload_status(upload_id: str):
+    session = _get_upload_session(upload_id)
+    return {"upload_id": session.id, "received": session.received, "total": session.total}
+
+
+@router.put("/uploads/{upload_id}")
+async def upload_range(
+    upload_id: str,
+    request: Request,
+    content_range: Optional[str] = Header(None),
+):
+    """
+    Append one byte range (Content-Range: bytes start-end/total). Without a
+    Content-Range the body is appended at the current offset. The complete
+    lines received so far are parsed in the analysis pool when it has room;
+    otherwise they're left for finalize.
+    """
+
+    session = _get_upload_session(upload_id)
+    data = await request.body()
+
+    if content_range:
+        match = CONTENT_RANGE_PATTERN.fullmatch(content_range.strip())
+        if not match or int(match.group(2)) - int(match.group(1)) + 1 != len(data):
+            raise HTTPException(status_code=400, detail="Invalid Content-Range header")
+
+        start = int(match.group(1))
+        total = None if match.group(3) == "*" else int(match.group(3))
+    else:
+        start, total = session.received, None
+
+    try:
+        received = await run_in_threadpool(session.append, start, data, total)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": str(e), "received": session.received},
+        )
+
+    # Another request parsing this session picks up these bytes as well
+    if not session.parse_lock.locked():
+        try:
+            analysis_pool.admit()
+        except PoolBusy:
+            pass
+        else:
+            try:
+                async with session.parse_lock:
+                    await _parse_received(session)
+            finally:
+                analysis_pool.release()
+
+    return {"upload_id": session.id, "received": received, "total": session.total}
+
+
+async def _parse_received(session: UploadSession, final: bool = False) -> None:
+    """Parse the session's received text range by range, in the pool (under its parse_lock)."""
+
+    while True:
+        span = session.next_range(final)
+        if span is None:
+            return
+
+        part = await analysis_pool.run(parse_chat_range, session.path, *span)
+        session.add_part(span[0], span[1], part, final)
+
+
+@router.post("/uploads/{upload_id}/finalize", dependencies=[Depends(analysis_slot)])
+async def finalize_upload(
+    upload_id: str,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    universe: str = Query("mcu"),
+    sections: Optional[str] = Query(None),
+    x_deadline_ms: Optional[int] = Header(None),
+    db: Session = Depends(get_db),
+):
+
+    deadline = _parse_deadline(x_deadline_ms)
+    sections = _parse_sections(sections)
+    session = _get_upload_session(upload_id)
+
+    try:
+        await run_in_threadpool(session.finish)
+    except ValueError as e:
+        # Incomplete uploads stay resumable
+        raise HTTPException(
+            status_code=409,
+            detail={"message": str(e), "received": session.received},
+        )
+
+    response.headers["X-Chat-Hash"] = session.sha256
+    prepared = asyncio.create_task(_prepare_session(upload_id, session))
+
+    if not await _in_time(prepared, deadline):
+        return _defer(prepared, universe, db, sections, background_tasks)
+
+    parsed, _ = prepared.result()
+
+    return await _analyze_and_store(
+        parsed, universe, db, sections, deadline=deadline, background_tasks=background_tasks
     )
 
-    db.add(record)
+
+async def _prepare_session(upload_id: str, session: UploadSession) -> Tuple[dict, dict]:
+    """(parse, analysis options) of a finished upload session, then cached; discards it."""
+
+    try:
+        if session.is_archive:
+            # Archive: parsed from the session's file in a worker
+            parsed = await analysis_pool.run(parse_chat, session.path)
+        else:
+            # Whatever the PUTs didn't get to (their last range, or all of
+            # it while the pool was busy)
+            async with session.parse_lock:
+                await _parse_received(session, final=True)
+
+            parsed = await run_in_threadpool(session.result)
+    except ValueError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    finally:
+        upload_sessions.discard(upload_id)
+
+    await run_in_threadpool(parse_cache.put, session.sha256, parsed)
+
+    return parsed, {}
+
+
+# ---- Preview ----
+async def _preview_upload(
+    file: UploadFile,
+    response: Response,
+    universe: str,
+    db: Session,
+    sections: Optional[List[str]],
+    window: Optional[Tuple[Optional[int], Optional[int]]],
+    background_tasks: Optional[BackgroundTasks],
+    cancel: CancelToken,
+    keep_partial: bool,
+) -> dict:
+    """
+    Preview of an upload. An uncached chat is sampled while it's parsed, so
+    the full parse is only built by the exact run (if asked for).
+    """
+
+    file.file.seek(0)
+    chat_hash = await run_in_threadpool(hash_upload, file.file)
+    response.headers["X-Chat-Hash"] = chat_hash
+
+    parsed = parse_cache.get(chat_hash)
+
+    if parsed is not None:
+        if window is not None:
+            parsed = analysis_service.window(parsed, *window)
+
+        cancel.raise_if_cancelled()
+
+        return await _preview(
+            parsed, universe, db, sections, background_tasks, cancel, keep_partial
+        )
+
+    path = await _spool_upload(file)
+
+    try:
+        try:
+            preview = await analysis_pool.run(
+                preview_chat_file, path, settings.PREVIEW_SAMPLE_SIZE, window
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=415, detail=str(e))
+
+        cancel.raise_if_cancelled()
+    except BaseException:
+        os.remove(path)
+        raise
+
+    parsed, scan, _ = preview
+
+    if scan is None:
+        # Small enough to have been kept whole: that's the exact run
+        os.remove(path)
+        if window is None:
+            await run_in_threadpool(parse_cache.put, chat_hash, parsed)
+
+        return await _analyze_and_store(
+            parsed, universe, db, sections, cancel=cancel, keep_partial=keep_partial
+        )
+
+    # The exact run parses (and caches) the spooled chat; parsed has no text
+    return await _serve_preview(
+        parsed,
+        preview,
+        universe,
+        db,
+        sections,
+        background_tasks,
+        cancel,
+        keep_partial,
+        source=(path, chat_hash, window),
+    )
+
+
+async def _preview(
+    parsed: dict,
+    universe: str,
+    db: Session,
+    sections: Optional[List[str]] = None,
+    background_tasks: Optional[BackgroundTasks] = None,
+    cancel: Optional[CancelToken] = None,
+    keep_partial: bool = False,
+) -> dict:
+
+    if len(parsed["messages"]) <= settings.PREVIEW_SAMPLE_SIZE:
+        # Small enough that the exact run is the fast one
+        return await _analyze_and_store(
+            parsed, universe, db, sections, cancel=cancel, keep_partial=keep_partial
+        )
+
+    preview = await analysis_pool.run(preview_chat, parsed, settings.PREVIEW_SAMPLE_SIZE)
+
+    return await _serve_preview(
+        parsed, preview, universe, db, sections, background_tasks, cancel, keep_partial
+    )
+
+
+async def _serve_preview(
+    parsed: dict,
+    preview: tuple,
+    universe: str,
+    db: Session,
+    sections: Optional[List[str]],
+    background_tasks: Optional[BackgroundTasks],
+    cancel: Optional[CancelToken],
+    keep_partial: bool,
+    source: Optional[tuple] = None,
+) -> dict:
+    """
+    Analyse and store a (sample, scan, report) preview of ``parsed``. A
+    ``source`` (spooled path, chat hash, window) goes to the exact run, or
+    is removed here if there isn't one.
+    """
+
+    sample, scan, report = preview
+
+    try:
+        # The AI layer isn't bounded by the sample; only run it when asked for
+        preview_sections = sections
+        if preview_sections is None:
+            preview_sections = list(AnalysisService.SECTION_OUTPUTS)
+
+        analyses = await _run_analyses(
+            sample,
+            universe,
+            db,
+            preview_sections,
+            cancel,
+            keep_partial,
+            scan=scan,
+        )
+
+        record_ids = {name: uuid.uuid4() for name in analyses}
+
+        exact_run = "not_requested"
+        if background_tasks is not None:
+            # The exact run holds its own pool slot until it's done; with the
+            # pool full the preview is still served, just without it
+            try:
+                analysis_pool.admit()
+                exact_run = "pending"
+            except PoolBusy:
+                exact_run = "busy"
+
+        for name, analysis in analyses.items():
+            analysis["meta"]["preview"] = {
+                **report,
+                "record_id": str(record_ids[name]),
+                "exact_run": exact_run,
+            }
+
+        try:
+            _store_analyses(analyses, parsed, db, record_ids)
+        except BaseException:
+            if exact_run == "pending":
+                analysis_pool.release()
+            raise
+
+        if exact_run == "pending":
+            background_tasks.add_task(_finish_exact, parsed, record_ids, sections, source)
+            source = None
+    finally:
+        if source is not None:
+            os.remove(source[0])
+
+    return _single_or_keyed(analyses)
+
+
+async def _finish_exact(
+    parsed: dict, record_ids: Dict[str, uuid.UUID], sections, source: Optional[tuple] = None
+):
+    """
+    Background: replace preview records with the exact analysis. With a
+    ``source`` (spooled path, chat hash, window) the chat is parsed and
+    cached here first, and the spooled file removed.
+    """
+
+    try:
+        if source is not None:
+            path, chat_hash, window = source
+            try:
+                parsed = await _parse_spooled(path)
+            finally:
+                os.remove(path)
+
+            await run_in_threadpool(parse_cache.put, chat_hash, parsed)
+            if window is not None:
+                parsed = analysis_service.window(parsed, *window)
+
+        analyses = await run_universe_analyses(
+            parsed_data=parsed,
+            universes=list(record_ids),
+            analysis_service=analysis_service,
+            ai_service=ai_service,
+            sections=sections,
+            analysis_pool=analysis_pool,
+        )
+    finally:
+        analysis_pool.release()
+
+    _replace_records(record_ids, analyses)
+
+
+def _replace_records(record_ids: Dict[str, uuid.UUID], analyses: Dict[str, dict]) -> None:
+
+    db = SessionLocal()
+    try:
+        for name, record_id in record_ids.items():
+            record = db.get(ChatAnalysis, record_id)
+            if record is not None:
+                record.analysis = analyses[name]
+                record.participants_count = len(analyses[name]["meta"].get("participants", []))
+
+        db.commit()
+    finally:
+        db.close()
+
+
+# ---- Deadlines ----
+def _parse_deadline(deadline_ms: Optional[int]) -> Optional[float]:
+    """X-Deadline-Ms -> the time.monotonic() by which to answer."""
+
+    if deadline_ms is None:
+        return None
+
+    if deadline_ms <= 0:
+        raise HTTPException(status_code=400, detail="X-Deadline-Ms must be a positive integer")
+
+    return time.monotonic() + deadline_ms / 1000
+
+
+def _queue_job(analyses: Dict[str, dict]) -> Optional[AnalysisJob]:
+    """
+    Job for the rest of a deadline-cut analysis, noted in meta.job. It holds
+    its own pool slot until it's done; with the pool full there is none.
+    """
+
+    try:
+        analysis_pool.admit()
+        job = analysis_jobs.create()
+    except PoolBusy:
+        job = None
+
+    for analysis in analyses.values():
+        analysis["meta"]["job"] = {
+            "id": job.id if job else None,
+            "status": job.status if job else "busy",
+        }
+
+    return job
+
+
+async def _finish_job(
+    job: AnalysisJob,
+    parsed: dict,
+    pending: PendingAnalysis,
+    record_ids: Dict[str, uuid.UUID],
+):
+    """Background: complete a deadline-cut analysis and its records."""
+
+    try:
+        analyses = await resume_analyses(
+            parsed, pending, analysis_service, ai_service, analysis_pool
+        )
+        _replace_records(record_ids, analyses)
+    except BaseException:
+        job.fail()
+        raise
+    finally:
+        analysis_pool.release()
+
+    job.complete(_single_or_keyed(analyses))
+
+
+async def _in_time(
+    prepared: asyncio.Task, deadline: Optional[float], cancel: Optional[CancelToken] = None
+) -> bool:
+    """
+    Wait for ``prepared`` (the parse / scan ahead of an analysis) until
+    ``deadline``; False if it's still running then. Its errors are raised
+    here, and it's cancelled with the request.
+    """
+
+    timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+
+    try:
+        await asyncio.wait({prepared}, timeout=timeout)
+        if cancel is not None:
+            cancel.raise_if_cancelled()
+    except BaseException:
+        prepared.cancel()
+        raise
+
+    if not prepared.done():
+        return False
+
+    prepared.result()
+    return True
+
+
+def _defer(
+    prepared: asyncio.Task,
+    universe: str,
+    db: Session,
+    sections: Optional[List[str]],
+    background_tasks: BackgroundTasks,
+    then: Optional[Callable] = None,
+) -> dict:
+    """
+    Out of time before the analysis could start: meta-only records (every
+    section in meta.skipped) are stored and returned, and a job finishes
+    ``prepared`` -- then ``then`` on its result, if given -- and the analysis.
+    With the pool full there's no job, and ``prepared`` is cancelled.
+    """
+
+    universes = _universe_list(universe)
+    record_ids = {name: uuid.uuid4() for name in universes}
+
+    skipped = [
+        section
+        for section in AnalysisService.SECTION_OUTPUTS
+        if sections is None or section in sections
+    ]
+    if sections is None or "ai_insights" in sections:
+        skipped.append("ai_insights")
+
+    analyses = {name: {"meta": {"universe": name, "skipped": list(skipped)}} for name in universes}
+
+    job = _queue_job(analyses)
+    if job is None:
+        prepared.cancel()
+
+    try:
+        _store_analyses(analyses, {}, db, record_ids)
+    except BaseException:
+        if job is not None:
+            job.fail()
+            analysis_pool.release()
+            prepared.cancel()
+        raise
+
+    if job is not None:
+        background_tasks.add_task(_finish_upload, job, prepared, sections, record_ids, then)
+
+    return _single_or_keyed(analyses)
+
+
+async def _finish_upload(
+    job: AnalysisJob,
+    prepared: asyncio.Task,
+    sections: Optional[List[str]],
+    record_ids: Dict[str, uuid.UUID],
+    then: Optional[Callable] = None,
+):
+    """Background: complete a _defer()'d upload and its records."""
+
+    try:
+        result = await prepared
+        parsed, options = await then(*result) if then is not None else result
+
+        analyses = await run_universe_analyses(
+            parsed_data=parsed,
+            universes=list(record_ids),
+            analysis_service=analysis_service,
+            ai_service=ai_service,
+            sections=sections,
+            analysis_pool=analysis_pool,
+            **options,
+        )
+        _replace_records(record_ids, analyses)
+    except BaseException:
+        job.fail()
+        raise
+    finally:
+        analysis_pool.release()
+
+    job.complete(_single_or_keyed(analyses))
+
+
+@router.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+
+    job = analysis_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+
+    return {"job_id": job.id, "status": job.status, "result": job.result}
+
+
+# ---- Time Windows ----
+async def _analyze_window(
+    chat_hash: str,
+    parsed: dict,
+    window: Tuple[Optional[int], Optional[int]],
+    universe: str,
+    db: Session,
+    sections: Optional[List[str]] = None,
+    cancel: Optional[CancelToken] = None,
+    keep_partial: bool = False,
+    deadline: Optional[float] = None,
+    background_tasks: Optional[BackgroundTasks] = None,
+) -> dict:
+    """
+    Analyse only [from, to) of a chat. Messages are binary-searched views;
+    trends come from the chat's cached prefix sums.
+    """
+
+    parsed, options = await _window_chat(chat_hash, parsed, window)
+
+    return await _analyze_and_store(
+        parsed,
+        universe,
+        db,
+        sections,
+        cancel=cancel,
+        keep_partial=keep_partial,
+        deadline=deadline,
+        background_tasks=background_tasks,
+        **options,
+    )
+
+
+async def _window_chat(
+    chat_hash: str, parsed: dict, window: Tuple[Optional[int], Optional[int]]
+) -> Tuple[dict, dict]:
+    """(windowed parse, analysis options): the chat's trend index comes along."""
+
+    trend_index = trend_indexes.pop(chat_hash, None)
+    if trend_index is None:
+        trend_index = await analysis_pool.run(index_trends, parsed["messages"])
+
+    trend_indexes[chat_hash] = trend_index
+    while len(trend_indexes) > TREND_INDEX_CACHE_SIZE:
+        trend_indexes.popitem(last=False)
+
+    return analysis_service.window(parsed, *window), {"trend_index": trend_index}
+
+
+def _parse_window(
+    start: Optional[str], end: Optional[str]
+) -> Optional[Tuple[Optional[int], Optional[int]]]:
+    """
+    ``from`` / ``to`` as ISO dates or datetimes -> epoch-second bounds
+    [from, to). A date-only ``to`` includes that whole day.
+    """
+
+    if start is None and end is None:
+        return None
+
+    try:
+        start = None if start is None else to_epoch(_parse_bound(start))
+        end = None if end is None else to_epoch(_parse_bound(end, end_of_day=True))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="from / to must be ISO dates or datetimes")
+
+    if start is not None and end is not None and start >= end:
+        raise HTTPException(status_code=400, detail="from must be before to")
+
+    return start, end
+
+
+def _parse_bound(value: str, end_of_day: bool = False) -> datetime:
+
+    try:
+        day = date.fromisoformat(value)
+    except ValueError:
+        return datetime.fromisoformat(value).replace(tzinfo=None)
+
+    bound = datetime.combine(day, datetime.min.time())
+    return bound + timedelta(days=1) if end_of_day else bound
+
+
+def _get_upload_session(upload_id: str):
+
+    session = upload_sessions.get(upload_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Unknown or expired upload")
+
+    return session
+
+
+def _parse_sections(sections: Optional[str]) -> Optional[List[str]]:
+    """``sections=traits,group_health`` -> list; None means every section."""
+
+    if sections is None:
+        return None
+
+    names = [name.strip() for name in sections.split(",") if name.strip()]
+
+    try:
+        analysis_service.resolve_sections(names)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return names
+
+
+async def _analyze_and_store(
+    parsed: dict,
+    universe: str,
+    db: Session,
+    sections: Optional[List[str]] = None,
+    scan: Optional[dict] = None,
+    trend_index=None,
+    cancel: Optional[CancelToken] = None,
+    keep_partial: bool = False,
+    deadline: Optional[float] = None,
+    background_tasks: Optional[BackgroundTasks] = None,
+) -> dict:
+    """
+    ``universe`` may list several universes (``mcu,dc``): shared engines run
+    once, the response is keyed by universe and each gets its own record.
+
+    Past ``deadline`` (time.monotonic()) the finished sections are stored and
+    returned, and a background job (``background_tasks``) completes them.
+    """
+
+    record_ids = {name: uuid.uuid4() for name in _universe_list(universe)}
+    job = pending = None
+
+    try:
+        analyses = await _run_analyses(
+            parsed,
+            universe,
+            db,
+            sections,
+            cancel,
+            keep_partial,
+            scan=scan,
+            trend_index=trend_index,
+            deadline=None if deadline is None else max(deadline - time.monotonic(), 0),
+        )
+    except DeadlineExceeded as e:
+        analyses, pending = e.partial, e.pending
+        job = _queue_job(analyses)
+
+    try:
+        _store_analyses(analyses, parsed, db, record_ids)
+    except BaseException:
+        if job is not None:
+            job.fail()
+            analysis_pool.release()
+        raise
+
+    if job is not None:
+        background_tasks.add_task(_finish_job, job, parsed, pending, record_ids)
+
+    return _single_or_keyed(analyses)
+
+
+async def _run_analyses(
+    parsed: dict,
+    universe: str,
+    db: Session,
+    sections: Optional[List[str]],
+    cancel: Optional[CancelToken],
+    keep_partial: bool,
+    **options,
+) -> Dict[str, dict]:
+    """
+    run_universe_analyses() for a request. If it's cancelled nothing is
+    stored, unless ``keep_partial``: then the finished sections are, marked
+    meta.cancelled. AnalysisCancelled is re-raised either way (and
+    DeadlineExceeded passed up as is).
+    """
+
+    try:
+        analyses = await run_universe_analyses(
+            parsed_data=parsed,
+            universes=_universe_list(universe),
+            analysis_service=analysis_service,
+            ai_service=ai_service,
+            sections=sections,
+            analysis_pool=analysis_pool,
+            cancel=cancel,
+            **options,
+        )
+
+        if cancel is not None:
+            # Gone while the AI layer ran: skip the write as well
+            cancel.raise_if_cancelled(analyses)
+
+    except DeadlineExceeded:
+        raise
+
+    except AnalysisCancelled as e:
+        if keep_partial and e.partial:
+            for analysis in e.partial.values():
+                analysis["meta"]["cancelled"] = True
+
+            _store_analyses(e.partial, parsed, db)
+
+        raise
+
+    return analyses
+
+
+def _universe_list(universe: str) -> List[str]:
+    return [name.strip() for name in universe.split(",") if name.strip()] or ["mcu"]
+
+
+def _store_analyses(
+    analyses: Dict[str, dict],
+    parsed: dict,
+    db: Session,
+    record_ids: Optional[Dict[str, uuid.UUID]] = None,
+) -> None:
+
+    # Save to DB
+    for name, analysis in analyses.items():
+        record = ChatAnalysis(
+            universe=name,
+            participants_count=len(parsed.get("participants", [])),
+            analysis=analysis,
+        )
+        if record_ids:
+            record.id = record_ids[name]
+        db.add(record)
+
     db.commit()
 
-    return analysis
+
+def _single_or_keyed(analyses: Dict[str, dict]) -> dict:
+
+    if len(analyses) == 1:
+        return next(iter(analyses.values()))
+
+    return analyses
@@ -8,6 +8,24 @@ class Settings(BaseSettings):
     DATABASE_URL: str
     GROQ_API_KEY: str
 
+    # Parsed-chat cache; defaults to <tmp>/chat-parse-cache
+    PARSE_CACHE_DIR: Optional[str] = None
+    PARSE_CACHE_MAX_BYTES: int = 512 * 1024 * 1024
+
+    # mode=preview analyses about this many sampled messages
+    PREVIEW_SAMPLE_SIZE: int = 20000
+
+    # Worker processes for parsing + analysis (0 = in the server process);
+    # past workers + queue depth admitted analyses, requests get a 503
+    ANALYSIS_WORKERS: int = 2
+    ANALYSIS_QUEUE_DEPTH: int = 8
+    ANALYSIS_RETRY_AFTER: int = 10
+
+    # Chats with at least this many messages have their message scan split
+    # across the analysis workers (with 2+ workers); smaller ones are
+    # scanned by one worker, where splitting costs more than it saves
+    SCAN_MAP_REDUCE_MIN_MESSAGES: int = 200000
+
     class Config:
         env_file = ".env"
 
@@ -49,7 +49,7 @@ class BehaviorEngine:
                 m.get("message_share_ratio", 0), share_min, share_max
             )
             reply_norm = 1 - normalize(
-                m.get("median_reply_time", 0), reply_min, reply_max
+                m.get("median_reply_time", 0) or 0, reply_min, reply_max
             )
             variance_norm = normalize(m.get("reply_time_variance", 0), var_min, var_max)
             length_norm = normalize(m.get("avg_message_length", 0), len_min, len_max)
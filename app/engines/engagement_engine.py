@@ -1,5 +1,6 @@
 from collections import defaultdict
-from datetime import timedelta
+
+from app.engines.message_scan import scan_messages
 
 
 class EngagementEngine:
@@ -11,79 +12,237 @@ class EngagementEngine:
         forward_message_check: int = 8,
     ) -> dict:
 
-        messages = parsed_data.get("messages", [])
-        if not messages:
-            return {}
-
-        # Sort safely
-        messages = sorted(messages, key=lambda x: x.get("timestamp"))
+        accumulator = self.accumulator(reply_window_minutes, forward_message_check)
+        scan_messages(parsed_data, [accumulator])
 
-        ignored_count = defaultdict(int)
-        total_messages = defaultdict(int)
+        return self.finalize(accumulator)
 
-        reply_window = timedelta(minutes=reply_window_minutes)
+    def accumulator(
+        self,
+        reply_window_minutes: int = 20,
+        forward_message_check: int = 8,
+    ) -> "EngagementAccumulator":
+        return EngagementAccumulator(reply_window_minutes, forward_message_check)
 
-        participants = set(msg.get("sender") for msg in messages)
-        group_size = len(participants)
+    def finalize(self, accumulator: "EngagementAccumulator") -> dict:
 
         # Dynamic threshold
+        group_size = len(accumulator.senders)
         required_other_speakers = 1 if group_size <= 2 else 2
 
-        for i in range(len(messages)):
+        ignored_count = defaultdict(int)
 
-            current = messages[i]
-            sender = current.get("sender")
-            timestamp = current.get("timestamp")
+        for sender, by_speakers in accumulator.resolved_candidates().items():
+            ignored_count[sender] = sum(by_speakers[required_other_speakers:])
 
-            if not sender or not timestamp:
-                continue
+        return self._results(accumulator.total_messages, ignored_count)
 
-            total_messages[sender] += 1
+    def _results(self, total_messages: dict, ignored_count: dict) -> dict:
 
-            # Skip last message (can't evaluate reply)
-            if i == len(messages) - 1:
-                continue
+        results = {}
+
+        for person, total in total_messages.items():
+            ignored = ignored_count[person]
+            ignored_ratio = ignored / total if total > 0 else 0
+
+            results[person] = {
+                "ignored_count": ignored,
+                "ignored_ratio": round(min(max(ignored_ratio, 0), 1), 3),
+            }
 
-            window_end = timestamp + reply_window
-            replied = False
+        return results
 
-            j = i + 1
 
-            while j < len(messages) and messages[j].get("timestamp") <= window_end:
-                if messages[j].get("sender") != sender:
-                    replied = True
-                    break
-                j += 1
+class EngagementAccumulator:
+    """
+    Streaming "ignored message" detection.
 
-            if replied:
-                continue
+    A message is ignored when nobody else writes within the reply window
+    and its next ``forward_message_check`` messages (at least 3) come from
+    enough other speakers. A message is judged once that many messages have
+    followed it, so only the last ``forward_message_check`` rows are carried
+    from one block to the next. "Enough" depends on the final group size,
+    so unreplied messages are tallied by their number of other speakers
+    (0, 1, 2+) and the threshold is applied in finalize().
+
+    The first ``forward_message_check`` rows are kept as well, so merge()
+    can finish the open tail of the chunk before this one.
+    """
+
+    def __init__(self, reply_window_minutes: int = 20, forward_message_check: int = 8):
+        self.reply_window = reply_window_minutes * 60
+        self.forward_message_check = forward_message_check
+
+        self.senders = set()
+        self.total_messages = defaultdict(int)
+        self.candidates = defaultdict(self._no_candidates)
+
+        self.message_count = 0
+
+        # Leading rows, for judging an earlier chunk's tail in merge()
+        self.head_timestamps = []
+        self.head_senders = []
+
+        # Rows whose forward window is still open
+        self.tail_timestamps = []
+        self.tail_senders = []
+
+    def update(self, timestamps, senders, texts, kinds) -> None:
+
+        self.message_count += len(senders)
+        self.senders.update(senders)
+
+        missing = self.forward_message_check - len(self.head_senders)
+        if missing > 0:
+            self.head_timestamps.extend(timestamps[:missing])
+            self.head_senders.extend(senders[:missing])
+
+        for sender in senders:
+            if sender:
+                self.total_messages[sender] += 1
+
+        timestamps = self.tail_timestamps + list(timestamps)
+        senders = self.tail_senders + list(senders)
+
+        decided = max(len(senders) - self.forward_message_check, 0)
+        self._judge(timestamps, senders, decided, self.candidates)
+
+        self.tail_timestamps = timestamps[decided:]
+        self.tail_senders = senders[decided:]
+
+    def merge(self, other: "EngagementAccumulator") -> "EngagementAccumulator":
+        """Fold in the accumulator of the messages that come right after these."""
+
+        # Our open tail can now see other's leading rows
+        timestamps = self.tail_timestamps + other.head_timestamps
+        senders = self.tail_senders + other.head_senders
 
-            forward_messages = messages[i + 1 : i + 1 + forward_message_check]
+        decided = max(len(senders) - self.forward_message_check, 0)
+        self._judge(timestamps, senders, decided, self.candidates)
 
-            if len(forward_messages) < 3:
+        if other.message_count >= self.forward_message_check:
+            self.tail_timestamps = list(other.tail_timestamps)
+            self.tail_senders = list(other.tail_senders)
+        else:
+            # other is all head: what's left open is the end of the seam
+            self.tail_timestamps = timestamps[decided:]
+            self.tail_senders = senders[decided:]
+
+        missing = self.forward_message_check - len(self.head_senders)
+        if missing > 0:
+            self.head_timestamps.extend(other.head_timestamps[:missing])
+            self.head_senders.extend(other.head_senders[:missing])
+
+        self.message_count += other.message_count
+        self.senders.update(other.senders)
+
+        for sender, total in other.total_messages.items():
+            self.total_messages[sender] += total
+
+        for sender, by_speakers in other.candidates.items():
+            own = self.candidates[sender]
+            for speakers, count in enumerate(by_speakers):
+                own[speakers] += count
+
+        return self
+
+    def to_state(self) -> dict:
+        """Tallies and open rows as plain JSON-safe data, for load_state()."""
+
+        return {
+            "senders": sorted(self.senders, key=lambda sender: (sender is None, sender or "")),
+            "total_messages": dict(self.total_messages),
+            "candidates": dict(self.candidates),
+            "message_count": self.message_count,
+            "head_timestamps": self.head_timestamps,
+            "head_senders": self.head_senders,
+            "tail_timestamps": self.tail_timestamps,
+            "tail_senders": self.tail_senders,
+        }
+
+    def load_state(self, state: dict) -> "EngagementAccumulator":
+
+        self.senders = set(state["senders"])
+        self.total_messages.update(state["total_messages"])
+
+        for sender, by_speakers in state["candidates"].items():
+            self.candidates[sender] = list(by_speakers)
+
+        self.message_count = state["message_count"]
+        self.head_timestamps = list(state["head_timestamps"])
+        self.head_senders = list(state["head_senders"])
+        self.tail_timestamps = list(state["tail_timestamps"])
+        self.tail_senders = list(state["tail_senders"])
+
+        return self
+
+    def resolved_candidates(self) -> dict:
+        """Candidates with the open tail judged as if the chat ended there."""
+
+        candidates = defaultdict(self._no_candidates)
+
+        for sender, by_speakers in self.candidates.items():
+            candidates[sender] = list(by_speakers)
+
+        self._judge(
+            self.tail_timestamps, self.tail_senders, len(self.tail_senders), candidates
+        )
+
+        return candidates
+
+    def judge_row(self, timestamps: list, senders: list) -> None:
+        """
+        Tally only the first row, given it and the rows that followed it in
+        the full chat (preview sampling judges sampled rows in context).
+        """
+
+        self._judge(
+            timestamps[: self.forward_message_check + 1],
+            senders[: self.forward_message_check + 1],
+            1,
+            self.candidates,
+        )
+
+    def _judge(self, timestamps: list, senders: list, stop: int, candidates: dict) -> None:
+
+        count = len(senders)
+        reply_window = self.reply_window
+        forward_message_check = self.forward_message_check
+
+        # next_other[i]: first index after i written by someone else, so the
+        # reply-window check is one comparison instead of a forward scan
+        next_other = [count] * count
+        for i in range(count - 2, -1, -1):
+            if senders[i + 1] != senders[i]:
+                next_other[i] = i + 1
+            else:
+                next_other[i] = next_other[i + 1]
+
+        for i in range(stop):
+
+            sender = senders[i]
+            if not sender:
                 continue
 
-            other_speakers = {
-                msg.get("sender")
-                for msg in forward_messages
-                if msg.get("sender") != sender
-            }
+            end = min(i + 1 + forward_message_check, count)
 
-            if len(other_speakers) >= required_other_speakers:
-                ignored_count[sender] += 1
+            if end - (i + 1) < 3:
+                continue
 
-        results = {}
+            # Nobody else in the forward window -> can't count as ignored;
+            # otherwise the first other speaker decides the reply
+            j = next_other[i]
+            if j >= end or timestamps[j] <= timestamps[i] + reply_window:
+                continue
 
-        for person, total in total_messages.items():
-            ignored = ignored_count[person]
-            ignored_ratio = ignored / total if total > 0 else 0
+            other_speakers = set(senders[i + 1 : end])
+            other_speakers.discard(sender)
 
-            results[person] = {
-                "ignored_count": ignored,
-                "ignored_ratio": round(min(max(ignored_ratio, 0), 1), 3),
-            }
+            candidates[sender][min(len(other_speakers), 2)] += 1
 
-        return results
+    @staticmethod
+    def _no_candidates():
+        return [0, 0, 0]
 
 
 # from collections import defaultdict
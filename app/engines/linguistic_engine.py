@@ -1,6 +1,9 @@
 from collections import Counter, defaultdict
 import re
 
+from app.engines.message_scan import scan_messages
+from app.services.message_table import NON_TEXT_KINDS
+
 
 class LinguisticEngine:
 
@@ -61,20 +64,6 @@ class LinguisticEngine:
         "ok",
     }
 
-    SYSTEM_WORDS = {
-        "media",
-        "omitted",
-        "message",
-        "deleted",
-        "sticker",
-        "image",
-        "video",
-        "audio",
-        "gif",
-        "document",
-        "edited",
-    }
-
     EMOJI_PATTERN = re.compile(
         r"[\U0001f600-\U0001f64f"
         r"\U0001f300-\U0001f5ff"
@@ -85,41 +74,29 @@ class LinguisticEngine:
     WORD_PATTERN = re.compile(r"\b[a-zA-Z']+\b")
 
     def run(self, parsed_data: dict) -> dict:
+        (accumulator,) = scan_messages(parsed_data, [self.accumulator()])
+        return self.finalize(accumulator)
 
-        messages = parsed_data.get("messages", [])
-        if not messages:
-            return {"participants": {}, "group": {}, "signatures": {}}
+    def accumulator(self) -> "LinguisticAccumulator":
+        return LinguisticAccumulator(self)
 
-        participant_words = defaultdict(list)
-        participant_emojis = defaultdict(list)
+    def finalize(self, accumulator: "LinguisticAccumulator") -> dict:
 
-        group_words = []
-        group_emojis = []
-
-        # ---- Single pass over messages ----
-        for msg in messages:
-            sender = msg.get("sender", "Unknown")
-            text = msg.get("text", "").lower()
-
-            words = self._extract_words(text)
-            emojis = self.EMOJI_PATTERN.findall(text)
-
-            participant_words[sender].extend(words)
-            participant_emojis[sender].extend(emojis)
+        if not accumulator.message_count:
+            return {"participants": {}, "group": {}, "signatures": {}}
 
-            group_words.extend(words)
-            group_emojis.extend(emojis)
+        participant_words = accumulator.participant_words
+        participant_emojis = accumulator.participant_emojis
 
         results = {"participants": {}, "group": {}, "signatures": {}}
 
         # ---- Participant stats ----
-        for sender, words in participant_words.items():
+        for sender, word_counter in participant_words.items():
 
-            word_counter = Counter(words)
-            emoji_counter = Counter(participant_emojis[sender])
+            emoji_counter = participant_emojis[sender]
 
-            vocab_size = len(set(words))
-            total_words = len(words)
+            vocab_size = len(word_counter)
+            total_words = sum(word_counter.values())
             unique_ratio = vocab_size / total_words if total_words else 0
 
             results["participants"][sender] = {
@@ -130,13 +107,13 @@ class LinguisticEngine:
             }
 
         # ---- Group stats ----
-        group_word_counter = Counter(group_words)
-        group_emoji_counter = Counter(group_emojis)
+        group_word_counter = accumulator.group_words
+        group_emoji_counter = accumulator.group_emojis
 
         results["group"] = {
             "top_words": group_word_counter.most_common(15),
             "top_emojis": group_emoji_counter.most_common(15),
-            "total_unique_words": len(set(group_words)),
+            "total_unique_words": len(group_word_counter),
         }
 
         # ---- Signature detection ----
@@ -151,17 +128,16 @@ class LinguisticEngine:
         return [
             w
             for w in words
-            if len(w) > 2 and w not in self.STOPWORDS and w not in self.SYSTEM_WORDS
+            if len(w) > 2 and w not in self.STOPWORDS
         ]
 
     def _compute_signatures(self, participant_words, group_word_counter):
 
         signature_results = {}
 
-        for sender, words in participant_words.items():
+        for sender, personal_counter in participant_words.items():
 
-            personal_counter = Counter(words)
-            total_user_words = len(words)
+            total_user_words = sum(personal_counter.values())
 
             if total_user_words == 0:
                 signature_results[sender] = []
@@ -188,6 +164,102 @@ class LinguisticEngine:
         return signature_results
 
 
+class LinguisticAccumulator:
+    """Word and emoji counters per participant and for the whole group."""
+
+    def __init__(self, engine: LinguisticEngine):
+        self.engine = engine
+
+        self.message_count = 0
+        self.participant_words = defaultdict(Counter)
+        self.participant_emojis = defaultdict(Counter)
+        self.group_words = Counter()
+        self.group_emojis = Counter()
+
+    def update(self, timestamps, senders, texts, kinds) -> None:
+
+        self.message_count += len(senders)
+
+        extract_words = self.engine._extract_words
+        find_emojis = self.engine.EMOJI_PATTERN.findall
+
+        # Gather the block per sender (and in order for the group), then
+        # count each list in one go
+        block_words = defaultdict(list)
+        block_emojis = defaultdict(list)
+        group_words = []
+        group_emojis = []
+
+        for sender, text, kind in zip(senders, texts, kinds):
+
+            # Every sender gets an entry, even with only media / deleted messages
+            words = block_words[sender]
+            emojis = block_emojis[sender]
+
+            # Media / deleted placeholders were tagged by the parser
+            if kind in NON_TEXT_KINDS:
+                continue
+
+            text = text.lower()
+
+            message_words = extract_words(text)
+            message_emojis = find_emojis(text)
+
+            words.extend(message_words)
+            emojis.extend(message_emojis)
+
+            group_words.extend(message_words)
+            group_emojis.extend(message_emojis)
+
+        for sender, words in block_words.items():
+            self.participant_words[sender].update(words)
+            self.participant_emojis[sender].update(block_emojis[sender])
+
+        self.group_words.update(group_words)
+        self.group_emojis.update(group_emojis)
+
+    def merge(self, other: "LinguisticAccumulator") -> "LinguisticAccumulator":
+        """Fold in the accumulator of the messages that come right after these."""
+
+        self.message_count += other.message_count
+
+        for sender, words in other.participant_words.items():
+            self.participant_words[sender].update(words)
+            self.participant_emojis[sender].update(other.participant_emojis[sender])
+
+        self.group_words.update(other.group_words)
+        self.group_emojis.update(other.group_emojis)
+
+        return self
+
+    def to_state(self) -> dict:
+        """Counters as plain JSON-safe data, for load_state()."""
+
+        return {
+            "message_count": self.message_count,
+            "participant_words": {sender: dict(words) for sender, words in self.participant_words.items()},
+            "participant_emojis": {
+                sender: dict(emojis) for sender, emojis in self.participant_emojis.items()
+            },
+            "group_words": dict(self.group_words),
+            "group_emojis": dict(self.group_emojis),
+        }
+
+    def load_state(self, state: dict) -> "LinguisticAccumulator":
+
+        self.message_count = state["message_count"]
+
+        for sender, words in state["participant_words"].items():
+            self.participant_words[sender].update(words)
+        for sender, emojis in state["participant_emojis"].items():
+            self.participant_emojis[sender].update(emojis)
+
+        self.group_words.update(state["group_words"])
+        self.group_emojis.update(state["group_emojis"])
+
+        return self
+
+
 # from collections import Counter, defaultdict
 # import re
 
@@ -287,7 +359,7 @@ class LinguisticEngine:
 #             filtered_words = [
 #                 w
 #                 for w in words
-#                 if len(w) > 2 and w not in self.STOPWORDS and w not in self.SYSTEM_WORDS
+#                 if len(w) > 2 and w not in self.STOPWORDS
 #             ]
 
 #             emojis = self.EMOJI_PATTERN.findall(text)
@@ -337,7 +409,7 @@ class LinguisticEngine:
 #             words = [
 #                 w
 #                 for w in words
-#                 if len(w) > 2 and w not in self.STOPWORDS and w not in self.SYSTEM_WORDS
+#                 if len(w) > 2 and w not in self.STOPWORDS
 #             ]
 #             all_group_words.extend(words)
 
@@ -0,0 +1,172 @@
+from bisect import bisect_left
+from concurrent.futures import Executor
+from functools import reduce
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from app.services.message_table import MessageTable, sort_messages, to_epoch
+
+
+# Messages handed to the accumulators per update() call
+BLOCK_SIZE = 4096
+
+Block = Tuple[Sequence[int], List[str], List[str], Sequence[int]]
+
+
+def scan_messages(parsed_data: dict, accumulators: Iterable) -> list:
+    """
+    Feed every message to every accumulator in one pass.
+
+    Messages are cut into blocks of consecutive rows -- epoch-second
+    timestamps, sender names, texts and kinds -- and each block goes to
+    every accumulator's update() while it is fresh, so fields are read and
+    text is decoded once however many engines are listening. Working on a
+    block at a time also lets accumulators count with C-level builtins
+    (Counter, set, zip) instead of a Python call per message. The engine's
+    finalize() turns its accumulator into the engine's result.
+    """
+
+    accumulators = list(accumulators)
+
+    messages = parsed_data.get("messages", [])
+    if not messages or not accumulators:
+        return accumulators
+
+    # The parser marks its output sorted; anything else is ordered here
+    if not parsed_data.get("sorted"):
+        messages = sort_messages(messages)
+
+    updates = [accumulator.update for accumulator in accumulators]
+
+    for block in iter_blocks(messages):
+        for update in updates:
+            update(*block)
+
+    return accumulators
+
+
+def map_reduce_scan(
+    parsed_data: dict,
+    factories: Dict[str, Callable],
+    chunks: int,
+    executor: Optional[Executor] = None,
+) -> Dict:
+    """
+    scan_messages() split over time chunks, then merged.
+
+    ``factories`` maps a name to an engine's accumulator factory (init).
+    The timeline is cut into ``chunks`` equal time ranges; each range is
+    scanned into fresh accumulators (on ``executor`` if given, which may be
+    a process pool -- tables pickle as compact arrays), and the per-chunk
+    accumulators are merged left to right. Results equal a single scan.
+    """
+
+    messages = parsed_data.get("messages", [])
+
+    if not parsed_data.get("sorted"):
+        messages = sort_messages(messages)
+
+    parts = split_by_time(messages, chunks)
+    names = list(factories)
+    factory_list = [factories[name] for name in names]
+
+    if executor is None or len(parts) < 2:
+        results = [_scan_chunk(factory_list, part) for part in parts]
+    else:
+        results = list(executor.map(_scan_chunk, [factory_list] * len(parts), parts))
+
+    if not results:
+        results = [_scan_chunk(factory_list, messages)]
+
+    merged = reduce(
+        lambda left, right: [a.merge(b) for a, b in zip(left, right)], results
+    )
+
+    return dict(zip(names, merged))
+
+
+def split_by_time(messages, chunks: int) -> list:
+    """Cut sorted messages into up to ``chunks`` runs covering equal time spans."""
+
+    count = len(messages)
+    if count == 0 or chunks < 2:
+        return [messages] if count else []
+
+    if isinstance(messages, MessageTable):
+        timestamps = messages.timestamps
+    else:
+        messages = [msg for msg in messages if msg.timestamp]
+        timestamps = [to_epoch(msg.timestamp) for msg in messages]
+        count = len(messages)
+
+        if not count:
+            return []
+
+    first, last = timestamps[0], timestamps[-1]
+    bounds = [0]
+
+    for part in range(1, chunks):
+        cut = bisect_left(timestamps, first + (last - first) * part // chunks)
+        if bounds[-1] < cut < count:
+            bounds.append(cut)
+
+    bounds.append(count)
+
+    if isinstance(messages, MessageTable):
+        return [messages.slice(start, end) for start, end in zip(bounds, bounds[1:])]
+
+    return [messages[start:end] for start, end in zip(bounds, bounds[1:])]
+
+
+def _scan_chunk(factories: List[Callable], messages) -> list:
+    """Worker for map_reduce_scan (module level so it pickles)."""
+    return scan_messages(
+        {"messages": messages, "sorted": True}, [factory() for factory in factories]
+    )
+
+
+def iter_blocks(messages, size: int = BLOCK_SIZE) -> Iterator[Block]:
+    """(timestamps, senders, texts, kinds) for consecutive runs of messages."""
+
+    if isinstance(messages, MessageTable):
+        names = messages.senders
+        text = messages.text
+        offsets = messages.offsets
+
+        for start in range(0, len(messages), size):
+            end = min(start + size, len(messages))
+            bounds = offsets[start : end + 1]
+
+            yield (
+                messages.timestamps[start:end],
+                [names[sender_id] for sender_id in messages.sender_ids[start:end]],
+                [
+                    str(text[bounds[i] : bounds[i + 1]], "utf-8")
+                    for i in range(end - start)
+                ],
+                messages.kinds[start:end],
+            )
+
+        return
+
+    # Undated rows can't be placed on the timeline
+    messages = [msg for msg in messages if msg.timestamp]
+    last_timestamp = None
+    epoch = 0
+
+    for start in range(0, len(messages), size):
+        rows = messages[start : start + size]
+        timestamps = []
+
+        for msg in rows:
+            # Same-minute messages share one datetime object
+            if msg.timestamp is not last_timestamp:
+                last_timestamp = msg.timestamp
+                epoch = to_epoch(msg.timestamp)
+            timestamps.append(epoch)
+
+        yield (
+            timestamps,
+            [msg.sender for msg in rows],
+            [msg.text for msg in rows],
+            [msg.kind for msg in rows],
+        )
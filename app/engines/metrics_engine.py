@@ -1,8 +1,13 @@
-from collections import defaultdict
+from bisect import bisect_right
+from collections import Counter, defaultdict
+from fractions import Fraction
+from itertools import accumulate
 from typing import Dict
-import statistics
 import re
 
+from app.engines.message_scan import scan_messages
+from app.services.message_table import MessageKind, from_epoch
+
 
 class MetricsEngine:
 
@@ -15,68 +20,35 @@ class MetricsEngine:
     )
 
     def run(self, parsed_data: Dict) -> Dict:
+        (accumulator,) = scan_messages(parsed_data, [self.accumulator()])
+        return self.finalize(accumulator)
+
+    def accumulator(self) -> "MetricsAccumulator":
+        return MetricsAccumulator(self)
 
-        messages = parsed_data.get("messages", [])
-        if not messages:
+    def finalize(self, accumulator: "MetricsAccumulator") -> Dict:
+
+        total_messages = accumulator.total_messages
+        if not total_messages:
             return {
                 "participant_metrics": {},
                 "chat_metrics": {"total_messages": 0, "time_span_days": 0},
             }
 
-        # Safe sort
-        messages = sorted(messages, key=lambda x: x.get("timestamp"))
-
-        participant_metrics = defaultdict(self._default_metrics)
-
-        total_messages = len(messages)
-        previous_message = None
-
-        for msg in messages:
-
-            sender = msg.get("sender")
-            text = msg.get("text", "")
-            timestamp = msg.get("timestamp")
-
-            if not sender or not timestamp:
-                continue
-
-            metrics = participant_metrics[sender]
-
-            # ---- Basic counts ----
-            metrics["message_count"] += 1
-            metrics["total_characters"] += len(text)
-            metrics["total_words"] += len(text.split())
-
-            emojis = self.EMOJI_PATTERN.findall(text)
-            metrics["emoji_count"] += len(emojis)
+        # Copies, so the accumulator can keep taking messages afterwards
+        participant_metrics = {}
 
-            metrics["question_count"] += text.count("?")
-            metrics["exclamation_count"] += text.count("!")
-            metrics["uppercase_characters"] += sum(1 for c in text if c.isupper())
+        for sender, counts in accumulator.participant_metrics.items():
+            metrics = dict(counts)
+            metrics["reply_delays"] = Counter(counts["reply_delays"])
+            metrics["first_message_time"] = from_epoch(accumulator.first_seen[sender])
+            metrics["last_message_time"] = from_epoch(accumulator.last_seen[sender])
+            participant_metrics[sender] = metrics
 
-            # ---- Night activity (10PM–4AM) ----
-            hour = timestamp.hour
-            if 22 <= hour or hour <= 4:
-                metrics["night_messages"] += 1
-
-            # ---- First & Last Message ----
-            if metrics["first_message_time"] is None:
-                metrics["first_message_time"] = timestamp
-
-            metrics["last_message_time"] = timestamp
-
-            # ---- Reply delay modeling ----
-            if previous_message:
-                prev_sender = previous_message.get("sender")
-                prev_timestamp = previous_message.get("timestamp")
-
-                if prev_sender != sender and prev_timestamp:
-                    delay = (timestamp - prev_timestamp).total_seconds()
-
-                    if 5 <= delay < 86400:
-                        metrics["reply_delays"].append(delay)
-
-            previous_message = msg
+        # ---- Chat-level metrics ----
+        time_span_days = 0
+        if total_messages > 1:
+            time_span_days = (accumulator.last_timestamp - accumulator.first_timestamp) // 86400
 
         # ---- Derived metrics ----
         for sender, metrics in participant_metrics.items():
@@ -104,9 +76,9 @@ class MetricsEngine:
             delays = metrics["reply_delays"]
 
             if delays:
-                metrics["median_reply_time"] = statistics.median(delays)
+                metrics["median_reply_time"] = self._median(delays)
                 metrics["reply_time_variance"] = (
-                    statistics.pvariance(delays) if len(delays) > 1 else 0
+                    self._pvariance(delays) if delays.total() > 1 else 0
                 )
             else:
                 metrics["median_reply_time"] = None
@@ -118,24 +90,229 @@ class MetricsEngine:
                 metrics["message_count"] / total_messages if total_messages > 0 else 0
             )
 
-        # ---- Chat-level metrics ----
-        time_span_days = 0
-        if len(messages) > 1:
-            first = messages[0].get("timestamp")
-            last = messages[-1].get("timestamp")
-
-            if first and last:
-                time_span_days = (last - first).days
-
         return {
-            "participant_metrics": dict(participant_metrics),
+            "participant_metrics": participant_metrics,
             "chat_metrics": {
                 "total_messages": total_messages,
                 "time_span_days": time_span_days,
             },
         }
 
-    def _default_metrics(self):
+    def _clamp(self, value: float) -> float:
+        return max(0.0, min(value, 1.0))
+
+    @staticmethod
+    def _median(delays: Counter) -> float:
+        """statistics.median() of the delays a histogram (seconds -> replies) counts."""
+
+        ordered = sorted(delays)
+        # Replies up to and including each delay
+        cumulative = list(accumulate(delays[delay] for delay in ordered))
+
+        def nth(index: int) -> float:
+            return float(ordered[bisect_right(cumulative, index)])
+
+        count = cumulative[-1]
+        if count % 2:
+            return nth(count // 2)
+
+        return (nth(count // 2 - 1) + nth(count // 2)) / 2
+
+    @staticmethod
+    def _pvariance(delays: Counter) -> float:
+        """statistics.pvariance() of a histogram's delays, exact like it."""
+
+        count = delays.total()
+        total = sum(delay * replies for delay, replies in delays.items())
+        squares = sum(delay * delay * replies for delay, replies in delays.items())
+
+        return float(Fraction(count * squares - total * total, count * count))
+
+
+class MetricsAccumulator:
+    """
+    Per-participant counters for MetricsEngine, fed a block of messages at a
+    time. Reply delays are kept as a histogram (whole seconds -> replies):
+    they lie in [5, 86400), so it stays bounded however long the chat, and
+    the median / variance come out as from the full list.
+    """
+
+    def __init__(self, engine: MetricsEngine):
+        self.engine = engine
+
+        self.total_messages = 0
+        self.first_timestamp = None
+        self.last_timestamp = None
+
+        self.participant_metrics = defaultdict(self._default_metrics)
+        self.first_seen = {}
+        self.last_seen = {}
+
+        self.previous_sender = None
+        self.previous_timestamp = 0
+
+    def update(self, timestamps, senders, texts, kinds) -> None:
+
+        if not timestamps:
+            return
+
+        self.total_messages += len(timestamps)
+
+        if self.first_timestamp is None:
+            self.first_timestamp = timestamps[0]
+        self.last_timestamp = timestamps[-1]
+
+        participant_metrics = self.participant_metrics
+        first_seen = self.first_seen
+        last_seen = self.last_seen
+        previous_sender = self.previous_sender
+        previous_timestamp = self.previous_timestamp
+
+        for timestamp, sender, text, kind in zip(timestamps, senders, texts, kinds):
+
+            if not sender:
+                continue
+
+            metrics = participant_metrics[sender]
+
+            self._count_message(metrics, text, kind)
+
+            # ---- Night activity (10PM–4AM), straight from epoch seconds ----
+            hour = timestamp % 86400 // 3600
+            if 22 <= hour or hour <= 4:
+                metrics["night_messages"] += 1
+
+            # ---- First & Last Message ----
+            if sender not in first_seen:
+                first_seen[sender] = timestamp
+            last_seen[sender] = timestamp
+
+            # ---- Reply delay modeling ----
+            if previous_sender is not None and previous_sender != sender:
+                delay = timestamp - previous_timestamp
+
+                if 5 <= delay < 86400:
+                    metrics["reply_delays"][delay] += 1
+
+            previous_sender = sender
+            previous_timestamp = timestamp
+
+        self.previous_sender = previous_sender
+        self.previous_timestamp = previous_timestamp
+
+    def merge(self, other: "MetricsAccumulator") -> "MetricsAccumulator":
+        """Fold in the accumulator of the messages that come right after these."""
+
+        if not other.total_messages:
+            return self
+
+        self.total_messages += other.total_messages
+
+        if self.first_timestamp is None:
+            self.first_timestamp = other.first_timestamp
+        self.last_timestamp = other.last_timestamp
+
+        # The reply delay across the seam: other's first sender vs our last
+        boundary_sender, boundary_delay = None, None
+
+        if other.first_seen:
+            sender = next(iter(other.first_seen))
+
+            if self.previous_sender is not None and self.previous_sender != sender:
+                delay = other.first_seen[sender] - self.previous_timestamp
+
+                if 5 <= delay < 86400:
+                    boundary_sender, boundary_delay = sender, delay
+
+            self.previous_sender = other.previous_sender
+            self.previous_timestamp = other.previous_timestamp
+
+        for sender, counts in other.participant_metrics.items():
+            metrics = self.participant_metrics[sender]
+
+            for key, value in counts.items():
+                if key == "reply_delays":
+                    if sender == boundary_sender:
+                        metrics[key][boundary_delay] += 1
+                    metrics[key].update(value)
+                elif value is not None:
+                    metrics[key] += value
+
+        for sender, timestamp in other.first_seen.items():
+            self.first_seen.setdefault(sender, timestamp)
+        self.last_seen.update(other.last_seen)
+
+        return self
+
+    def to_state(self) -> Dict:
+        """
+        Counters as plain JSON-safe data (reply delays as [seconds, replies]
+        pairs), for load_state().
+        """
+
+        return {
+            "total_messages": self.total_messages,
+            "first_timestamp": self.first_timestamp,
+            "last_timestamp": self.last_timestamp,
+            "participant_metrics": {
+                sender: {**counts, "reply_delays": sorted(counts["reply_delays"].items())}
+                for sender, counts in self.participant_metrics.items()
+            },
+            "first_seen": self.first_seen,
+            "last_seen": self.last_seen,
+            "previous_sender": self.previous_sender,
+            "previous_timestamp": self.previous_timestamp,
+        }
+
+    def load_state(self, state: Dict) -> "MetricsAccumulator":
+
+        self.total_messages = state["total_messages"]
+        self.first_timestamp = state["first_timestamp"]
+        self.last_timestamp = state["last_timestamp"]
+
+        for sender, counts in state["participant_metrics"].items():
+            metrics = self.participant_metrics[sender]
+            metrics.update(counts)
+            metrics["reply_delays"] = Counter(dict(counts["reply_delays"]))
+
+        self.first_seen = dict(state["first_seen"])
+        self.last_seen = dict(state["last_seen"])
+        self.previous_sender = state["previous_sender"]
+        self.previous_timestamp = state["previous_timestamp"]
+
+        return self
+
+    def _count_message(self, metrics: Dict, text: str, kind: int) -> None:
+
+        metrics["message_count"] += 1
+
+        # ---- Placeholders: counted, never measured as text ----
+        if kind == MessageKind.MEDIA:
+            metrics["media_count"] += 1
+            return
+
+        if kind == MessageKind.DELETED:
+            metrics["deleted_count"] += 1
+            return
+
+        if kind == MessageKind.EDITED:
+            metrics["edited_count"] += 1
+        elif kind == MessageKind.LINK:
+            metrics["link_count"] += 1
+
+        # ---- Basic counts ----
+        metrics["total_characters"] += len(text)
+        metrics["total_words"] += len(text.split())
+
+        emojis = self.engine.EMOJI_PATTERN.findall(text)
+        metrics["emoji_count"] += len(emojis)
+
+        metrics["question_count"] += text.count("?")
+        metrics["exclamation_count"] += text.count("!")
+        metrics["uppercase_characters"] += sum(1 for c in text if c.isupper())
+
+    @staticmethod
+    def _default_metrics():
         return {
             "message_count": 0,
             "total_characters": 0,
@@ -144,15 +321,16 @@ class MetricsEngine:
             "question_count": 0,
             "exclamation_count": 0,
             "uppercase_characters": 0,
-            "reply_delays": [],
+            "media_count": 0,
+            "deleted_count": 0,
+            "edited_count": 0,
+            "link_count": 0,
+            "reply_delays": Counter(),
             "first_message_time": None,
             "last_message_time": None,
             "night_messages": 0,
         }
 
-    def _clamp(self, value: float) -> float:
-        return max(0.0, min(value, 1.0))
-
 
 # from collections import defaultdict
 # from typing import Dict
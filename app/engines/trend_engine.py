@@ -1,38 +1,31 @@
-from collections import defaultdict
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from itertools import accumulate
 from statistics import mean, stdev
+from typing import Optional
+
+from app.engines.message_scan import scan_messages
+from app.services.message_table import MessageTable, from_epoch, to_epoch
 
 
 class TrendEngine:
 
     def run(self, parsed_data: dict):
+        (accumulator,) = scan_messages(parsed_data, [self.accumulator()])
+        return self.finalize(accumulator)
 
-        messages = parsed_data.get("messages", [])
-        if not messages:
-            return self._empty_result()
-
-        messages = sorted(messages, key=lambda x: x.get("timestamp"))
-
-        daily_counts = defaultdict(int)
-        weekly_counts = defaultdict(int)
-        hourly_counts = defaultdict(int)
-        participant_daily = defaultdict(lambda: defaultdict(int))
-
-        for msg in messages:
+    def accumulator(self) -> "TrendAccumulator":
+        return TrendAccumulator()
 
-            ts = msg.get("timestamp")
-            sender = msg.get("sender")
+    def index(self, messages) -> "TrendIndex":
+        return TrendIndex(messages)
 
-            if not ts or not sender:
-                continue
+    def finalize(self, accumulator: "TrendAccumulator"):
 
-            day_key = ts.date().isoformat()
-            week_key = f"{ts.year}-W{ts.isocalendar()[1]:02d}"
-            hour_key = ts.hour
-
-            daily_counts[day_key] += 1
-            weekly_counts[week_key] += 1
-            hourly_counts[hour_key] += 1
-            participant_daily[sender][day_key] += 1
+        daily_counts, weekly_counts, hourly_counts, participant_daily = (
+            self._buckets(accumulator)
+        )
 
         if not daily_counts:
             return self._empty_result()
@@ -108,6 +101,27 @@ class TrendEngine:
             "most_consistent_member": most_consistent_member,
         }
 
+    def _buckets(self, accumulator: "TrendAccumulator"):
+
+        # Calendar work (ISO dates and weeks) happens once per distinct day
+        day_keys = {}
+        daily_counts = {}
+        weekly_counts = defaultdict(int)
+
+        for day, count in accumulator.day_totals.items():
+            date = from_epoch(day * 86400)
+            day_keys[day] = date.date().isoformat()
+
+            daily_counts[day_keys[day]] = count
+            weekly_counts[f"{date.year}-W{date.isocalendar()[1]:02d}"] += count
+
+        participant_daily = defaultdict(dict)
+
+        for (sender, day), count in accumulator.sender_days.items():
+            participant_daily[sender][day_keys[day]] = count
+
+        return daily_counts, weekly_counts, dict(accumulator.hourly_counts), participant_daily
+
     def _empty_result(self):
         return {
             "daily_counts": {},
@@ -125,6 +139,182 @@ class TrendEngine:
         }
 
 
+class TrendAccumulator:
+    """Integer day / hour message counts for TrendEngine."""
+
+    def __init__(self):
+        self.day_totals = Counter()
+        self.hourly_counts = Counter()
+        self.sender_days = Counter()
+
+    def update(self, timestamps, senders, texts, kinds) -> None:
+
+        if not all(senders):
+            rows = [(ts, sender) for ts, sender in zip(timestamps, senders) if sender]
+            timestamps = [ts for ts, _ in rows]
+            senders = [sender for _, sender in rows]
+
+        days = [ts // 86400 for ts in timestamps]
+
+        self.day_totals.update(days)
+        self.hourly_counts.update([ts % 86400 // 3600 for ts in timestamps])
+        self.sender_days.update(zip(senders, days))
+
+    def merge(self, other: "TrendAccumulator") -> "TrendAccumulator":
+        """Fold in the accumulator of the messages that come right after these."""
+
+        self.day_totals.update(other.day_totals)
+        self.hourly_counts.update(other.hourly_counts)
+        self.sender_days.update(other.sender_days)
+
+        return self
+
+    def to_state(self) -> dict:
+        """
+        Counts as plain JSON-safe data (pairs / triples, as JSON object keys
+        can't be ints or tuples), for load_state().
+        """
+
+        return {
+            "day_totals": list(self.day_totals.items()),
+            "hourly_counts": list(self.hourly_counts.items()),
+            "sender_days": [[sender, day, count] for (sender, day), count in self.sender_days.items()],
+        }
+
+    def load_state(self, state: dict) -> "TrendAccumulator":
+
+        self.day_totals.update(dict(state["day_totals"]))
+        self.hourly_counts.update(dict(state["hourly_counts"]))
+        self.sender_days.update({(sender, day): count for sender, day, count in state["sender_days"]})
+
+        return self
+
+
+class TrendIndex:
+    """
+    Prefix sums of a whole chat's message counts per clock hour (overall,
+    per hour of day and per sender). The TrendAccumulator of any
+    hour-aligned window is rebuilt from two bisects per bucket -- days,
+    hours of day, sender-days -- without touching a single message, so
+    windows over an indexed chat cost the same however many messages they
+    cover. Nothing is kept per message either: the index grows with the
+    chat's (sender, hour) buckets, so the route can cache a few of them.
+    """
+
+    HOUR = 3600
+
+    def __init__(self, messages):
+
+        if isinstance(messages, MessageTable):
+            names = messages.senders
+            rows = zip(messages.timestamps, (names[i] for i in messages.sender_ids))
+        else:
+            rows = ((to_epoch(msg.timestamp), msg.sender) for msg in messages if msg.timestamp)
+
+        hour_counts = Counter()
+        sender_hours = Counter()
+
+        # Row positions settle first-appearance order within an hour; one
+        # per (sender, hour) keeps the index O(buckets), not O(messages)
+        first_rows = {}
+
+        for row, (timestamp, sender) in enumerate(rows):
+            if sender:
+                hour = timestamp // self.HOUR
+                hour_counts[hour] += 1
+                sender_hours[(sender, hour)] += 1
+
+                first_rows.setdefault((sender, hour), row)
+
+        self.totals = self._prefix(hour_counts)
+
+        by_hour_of_day = defaultdict(Counter)
+        for hour, count in hour_counts.items():
+            by_hour_of_day[hour % 24][hour] = count
+        self.hours_of_day = {
+            hour_of_day: self._prefix(counts) for hour_of_day, counts in by_hour_of_day.items()
+        }
+
+        # Senders in first-seen order, as a scan would meet them
+        by_sender = defaultdict(Counter)
+        for (sender, hour), count in sender_hours.items():
+            by_sender[sender][hour] = count
+        self.senders = {sender: self._prefix(counts) for sender, counts in by_sender.items()}
+        self.sender_first_rows = {
+            sender: array("q", (first_rows[(sender, hour)] for hour in prefix[0]))
+            for sender, prefix in self.senders.items()
+        }
+
+    @staticmethod
+    def _prefix(counts: Counter):
+        hours = sorted(counts)
+        return hours, [0] + list(accumulate(counts[hour] for hour in hours))
+
+    @staticmethod
+    def _count(prefix, low: int, high: int) -> int:
+        hours, sums = prefix
+        return sums[bisect_left(hours, high)] - sums[bisect_left(hours, low)]
+
+    @staticmethod
+    def _first(prefix, low: int, high: int) -> Optional[int]:
+        hours, _ = prefix
+        position = bisect_left(hours, low)
+        return hours[position] if position < len(hours) and hours[position] < high else None
+
+    def covers(self, start: Optional[int], end: Optional[int]) -> bool:
+        """Whether [start, end) (epoch seconds, None = open) is hour-aligned."""
+        return all(bound is None or bound % self.HOUR == 0 for bound in (start, end))
+
+    def accumulator(self, start: Optional[int], end: Optional[int]) -> "TrendAccumulator":
+        """TrendAccumulator of the messages in [start, end); see covers()."""
+
+        accumulator = TrendAccumulator()
+        hours, _ = self.totals
+
+        if not hours:
+            return accumulator
+
+        low = hours[0] if start is None else start // self.HOUR
+        high = hours[-1] + 1 if end is None else end // self.HOUR
+        days = range(low // 24, (high - 1) // 24 + 1)
+
+        def day_span(day):
+            return max(low, day * 24), min(high, day * 24 + 24)
+
+        for day in days:
+            count = self._count(self.totals, *day_span(day))
+            if count:
+                accumulator.day_totals[day] = count
+
+        # Hours of day / senders in the order the window first meets them
+        firsts = {
+            hour_of_day: self._first(prefix, low, high)
+            for hour_of_day, prefix in self.hours_of_day.items()
+        }
+        for hour_of_day in sorted(
+            (key for key, first in firsts.items() if first is not None), key=firsts.get
+        ):
+            accumulator.hourly_counts[hour_of_day] = self._count(
+                self.hours_of_day[hour_of_day], low, high
+            )
+
+        firsts = {sender: self._first(prefix, low, high) for sender, prefix in self.senders.items()}
+        order = {
+            sender: self.sender_first_rows[sender][bisect_left(self.senders[sender][0], first)]
+            for sender, first in firsts.items()
+            if first is not None
+        }
+
+        for sender in sorted(order, key=order.get):
+            prefix = self.senders[sender]
+            for day in range(firsts[sender] // 24, days.stop):
+                count = self._count(prefix, *day_span(day))
+                if count:
+                    accumulator.sender_days[(sender, day)] = count
+
+        return accumulator
+
+
 # from collections import defaultdict
 # from statistics import mean, stdev
 # from datetime import timedelta
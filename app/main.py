@@ -1,7 +1,8 @@
 from fastapi import FastAPI
-from app.api.routes.analysis import router as analysis_router
+from app.api.routes.analysis import router as analysis_router, analysis_pool
 from app.core.database import engine, Base
 from app.models.chat_analysis import ChatAnalysis  # IMPORTANT import model
+from app.models.chat_state import ChatState  # IMPORTANT import model
 
 app = FastAPI(title="WhatsApp Multiverse Analyzer", version="1.0.0")
 
@@ -11,4 +12,9 @@ def on_startup():
     Base.metadata.create_all(bind=engine)
 
 
+@app.on_event("shutdown")
+def on_shutdown():
+    analysis_pool.shutdown()
+
+
 app.include_router(analysis_router)
@@ -0,0 +1,32 @@
+from sqlalchemy import Column, String, Integer, DateTime, LargeBinary
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+from sqlalchemy.sql import func
+import uuid
+
+from app.core.database import Base
+
+
+class ChatState(Base):
+    """
+    Aggregate state of a chat seen before, so a newer export only has to
+    parse and scan the messages added since.
+    """
+
+    __tablename__ = "chat_states"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    chat_key = Column(String(64), nullable=False, unique=True, index=True)
+
+    # Newest message folded in, and how many messages share that minute
+    last_timestamp = Column(DateTime, nullable=False)
+    messages_at_last_timestamp = Column(Integer, nullable=False)
+
+    senders = Column(JSONB, nullable=False)
+    meta = Column(JSONB, nullable=False)
+
+    # Message-scan accumulators (metrics, engagement, linguistics, trends) as
+    # versioned, zlib-compressed JSON; see chat_state_service.dump_partials()
+    partials = Column(LargeBinary, nullable=False)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -1,8 +1,65 @@
 # app/services/analysis_service.py
 
+import functools
+from concurrent.futures import Executor
+from typing import Dict, Iterable, List, Optional, Set
+
+from app.engines.message_scan import map_reduce_scan, scan_messages
+from app.services.cancellation import AnalysisCancelled
+from app.services.message_table import MessageTable, from_epoch, sort_messages, time_window
+from app.services.stage_scheduler import Stage, fan_out, prune_stages, run_stages
+
 
 class AnalysisService:
 
+    # Response section -> graph value it comes from (response key order)
+    SECTION_OUTPUTS = {
+        "chat_metrics": "metrics",
+        "traits": "traits",
+        "behavior": "behavior",
+        "engagement": "engagement",
+        "pair_dynamics": "pair_dynamics",
+        "group_health": "group_health",
+        "risk_analysis": "risk_analysis",
+        "trends": "trends",
+        "linguistics": "linguistics",
+        "character_matches": "character_matches",
+        "user_summaries": "user_summaries",
+        "explanations": "explanations",
+    }
+
+    # What the AI payload builders read
+    AI_INSIGHTS_SECTIONS = (
+        "traits",
+        "behavior",
+        "user_summaries",
+        "character_matches",
+        "group_health",
+        "risk_analysis",
+        "trends",
+    )
+
+    SECTIONS = tuple(SECTION_OUTPUTS) + ("ai_insights",)
+
+    # Most wanted first: when time is short, these are computed first
+    SECTION_PRIORITY = (
+        "chat_metrics",
+        "traits",
+        "character_matches",
+        "behavior",
+        "user_summaries",
+        "group_health",
+        "risk_analysis",
+        "pair_dynamics",
+        "engagement",
+        "trends",
+        "linguistics",
+        "explanations",
+    )
+
+    # Stages finalised from the shared message scan
+    SCAN_STAGES = ("metrics", "engagement", "linguistics", "trends")
+
     def __init__(
         self,
         metrics_engine,
@@ -18,6 +75,9 @@ class AnalysisService:
         group_health_engine,
         risk_engine,
         user_summary_engine,
+        scan_chunks: int = 1,
+        scan_executor: Optional[Executor] = None,
+        scan_min_messages: int = 0,
     ):
         self.metrics_engine = metrics_engine
         self.trait_engine = trait_engine
@@ -33,40 +93,346 @@ class AnalysisService:
         self.risk_engine = risk_engine
         self.user_summary_engine = user_summary_engine
 
-    def run(self, parsed_data: dict, universe: str = "mcu") -> dict:
+        # scan_chunks > 1 map-reduces the message scan of chats with at
+        # least scan_min_messages messages over time chunks, on
+        # scan_executor (e.g. a process pool) if given
+        self.scan_chunks = scan_chunks
+        self.scan_executor = scan_executor
+        self.scan_min_messages = scan_min_messages
+
+    def run(
+        self,
+        parsed_data: dict,
+        universe: str = "mcu",
+        sections: Optional[Iterable[str]] = None,
+        scan: Optional[dict] = None,
+    ) -> dict:
+        """
+        Run the engines behind ``sections`` (default: everything) and return
+        those response sections. Engines nothing asked for are skipped.
+        """
+
+        return self.run_universes(parsed_data, [universe], sections, scan)[universe]
+
+    def run_universes(
+        self,
+        parsed_data: dict,
+        universes: List[str],
+        sections: Optional[Iterable[str]] = None,
+        scan: Optional[dict] = None,
+        trend_index=None,
+        cancel=None,
+        done: Optional[dict] = None,
+    ) -> Dict[str, dict]:
+        """
+        One analysis per universe from a single pass: stages that don't
+        depend on the universe (metrics, base traits, engagement,
+        linguistics, trends) run once and are shared by every view.
+
+        ``scan`` is a ready message scan (see scan(), e.g. stored state with
+        new messages merged in); the messages themselves aren't read then.
+        ``trend_index`` (TrendEngine.index() of the whole chat) answers
+        trends for an hour-aligned window() from prefix sums instead.
+
+        Engines run in SECTION_PRIORITY order. Once ``cancel`` (a
+        CancelToken) is set no further engine starts; AnalysisCancelled then
+        carries each universe's analysis with the sections that finished
+        (the others listed in meta["skipped"]) and, as ``state``, the stage
+        values the rest still needs -- pass it back as ``done`` to carry on.
+        """
+
+        universes = list(dict.fromkeys(universes))
 
-        metrics = self.metrics_engine.run(parsed_data)
-        base_traits = self.trait_engine.run(metrics)
+        sections = self.resolve_sections(sections)
+        if sections is None:
+            sections = set(self.SECTION_OUTPUTS)
 
-        adjusted_traits = self.universe_engine.run(
-            base_traits,
-            universe=universe,
+        stages = fan_out(
+            prune_stages(self.stages(), [self.SECTION_OUTPUTS[section] for section in sections]),
+            "universe",
+            universes,
         )
+        targets = self._targets(stages, sections, universes)
 
-        behavior = self.behavior_engine.run(metrics, adjusted_traits)
-        engagement = self.engagement_engine.run(parsed_data)
+        initial = {"parsed_data": parsed_data}
+        initial.update({f"universe@{universe}": universe for universe in universes})
 
-        pairs = self.pair_engine.run(adjusted_traits, behavior)
-        linguistics = self.linguistic_engine.run(parsed_data)
-        trends = self.trend_engine.run(parsed_data)
+        if scan is not None:
+            initial["scan"] = scan
 
-        character_matches = self.character_engine.run(adjusted_traits)
+        if done:
+            initial.update(done)
 
-        group_health = self.group_health_engine.run(behavior, pairs)
+        start, end = parsed_data.get("window", (None, None))
+        if (
+            trend_index is not None
+            and "trends" not in initial
+            and any(stage.name == "trends" for stage in stages)
+            and trend_index.covers(start, end)
+        ):
+            initial["trends"] = self.trend_engine.finalize(trend_index.accumulator(start, end))
 
-        risk_analysis = self.risk_engine.run(
-            behavior,
-            pairs,
-            adjusted_traits,
+        # Values already in hand replace their stages (and whatever fed them)
+        stages = prune_stages(
+            [stage for stage in stages if stage.output not in initial], targets
         )
 
-        user_summaries = self.user_summary_engine.run(
-            behavior,
-            pairs,
-            adjusted_traits,
+        # The message scan only feeds the accumulators that are still needed
+        kept = {stage.name for stage in stages}
+        initial["scan_stages"] = [name for name in self.SCAN_STAGES if name in kept]
+
+        try:
+            values = run_stages(
+                stages,
+                initial,
+                cancel,
+                self._priorities(stages, sections, universes),
+            )
+        except AnalysisCancelled as e:
+            # What the stages that never ran would read (request inputs aside)
+            unfinished = [stage for stage in stages if stage.output not in e.partial]
+            needed = {name for stage in unfinished for name in stage.inputs}
+            needed.difference_update(("parsed_data", "scan_stages"))
+            needed.difference_update(f"universe@{universe}" for universe in universes)
+
+            raise AnalysisCancelled(
+                {
+                    universe: self._assemble(e.partial, parsed_data, universe, sections)
+                    for universe in universes
+                },
+                {name: e.partial[name] for name in needed if name in e.partial},
+            ) from None
+
+        return {
+            universe: self._assemble(values, parsed_data, universe, sections)
+            for universe in universes
+        }
+
+    def _targets(self, stages: List[Stage], sections: Set[str], universes: List[str]) -> List[str]:
+        """Graph values behind ``sections``, per universe where fanned out."""
+
+        outputs = {stage.output for stage in stages}
+        targets = []
+
+        for section in sections:
+            output = self.SECTION_OUTPUTS[section]
+            scoped = [f"{output}@{universe}" for universe in universes]
+            targets.extend(scoped if scoped[0] in outputs else [output])
+
+        return targets
+
+    def _priorities(
+        self, stages: List[Stage], sections: Set[str], universes: List[str]
+    ) -> Dict[str, int]:
+        """Stage name -> rank of the most important requested section it feeds."""
+
+        producers = {stage.output: stage for stage in stages}
+        ranks = {}
+
+        ordered = [section for section in self.SECTION_PRIORITY if section in sections]
+
+        for rank, section in enumerate(ordered):
+            queue = self._targets(stages, {section}, universes)
+
+            while queue:
+                stage = producers.get(queue.pop())
+                if stage is None or stage.name in ranks:
+                    continue
+
+                ranks[stage.name] = rank
+                queue.extend(stage.inputs)
+
+        return ranks
+
+    def window(self, parsed_data: dict, start: Optional[int] = None, end: Optional[int] = None) -> dict:
+        """
+        ``parsed_data`` narrowed to start <= epoch seconds < end (None =
+        open) by binary search; messages are views, not copies.
+        """
+
+        messages = parsed_data.get("messages", [])
+        if not parsed_data.get("sorted"):
+            messages = sort_messages(messages)
+
+        messages = time_window(messages, start, end)
+
+        if isinstance(messages, MessageTable):
+            active = {messages.senders[sender_id] for sender_id in set(messages.sender_ids)}
+        else:
+            active = {msg.sender for msg in messages}
+
+        return {
+            **parsed_data,
+            "participants": sorted(active),
+            "messages": messages,
+            "sorted": True,
+            "window": (start, end),
+        }
+
+    def _assemble(self, values: dict, parsed_data: dict, universe: str, sections: Set[str]) -> dict:
+
+        analysis = {
+            "meta": {
+                "universe": universe,
+                "participants": parsed_data.get("participants", []),
+                "dialect": parsed_data.get("meta", {}).get("dialect"),
+            },
+        }
+
+        if "window" in parsed_data:
+            start, end = parsed_data["window"]
+            analysis["meta"]["window"] = {
+                "from": None if start is None else from_epoch(start).isoformat(),
+                "to": None if end is None else from_epoch(end).isoformat(),
+                "messages": len(parsed_data["messages"]),
+            }
+
+        skipped = []
+
+        for section, output in self.SECTION_OUTPUTS.items():
+            if section not in sections:
+                continue
+
+            # Universe-specific copy if the stage was fanned out
+            key = f"{output}@{universe}" if f"{output}@{universe}" in values else output
+
+            if key in values:
+                analysis[section] = values[key]
+            else:
+                # Stage never ran (cancelled)
+                skipped.append(section)
+
+        if skipped:
+            analysis["meta"]["skipped"] = skipped
+
+        if "chat_metrics" in analysis:
+            analysis["chat_metrics"] = analysis["chat_metrics"].get("chat_metrics", {})
+
+        return analysis
+
+    def resolve_sections(self, sections: Optional[Iterable[str]]) -> Optional[Set[str]]:
+        """
+        Deterministic sections needed to serve ``sections`` (None = all).
+        ai_insights pulls in what its payload builders read.
+
+        Raises ValueError for unknown section names.
+        """
+
+        if sections is None:
+            return None
+
+        sections = set(sections)
+        unknown = sections - set(self.SECTIONS)
+
+        if unknown:
+            raise ValueError(f"Unknown sections: {', '.join(sorted(unknown))}")
+
+        if "ai_insights" in sections:
+            sections.discard("ai_insights")
+            sections.update(self.AI_INSIGHTS_SECTIONS)
+
+        return sections
+
+    # ---- Dependency Graph ----
+    def stages(self) -> List[Stage]:
+        """
+        Every engine with the values it reads and the one it produces.
+
+        Metrics, engagement, linguistics and trends share one pass over the
+        messages ("message_scan") and each finalise from their accumulator.
+        """
+
+        return [
+            Stage("message_scan", self.scan, ["parsed_data", "scan_stages"], "scan"),
+            Stage("metrics", self._finalizer("metrics"), ["scan"]),
+            Stage("base_traits", self.trait_engine.run, ["metrics"]),
+            Stage(
+                "traits",
+                functools.partial(_universe_traits, self.universe_engine),
+                ["base_traits", "universe"],
+            ),
+            Stage("behavior", self.behavior_engine.run, ["metrics", "traits"]),
+            Stage("engagement", self._finalizer("engagement"), ["scan"]),
+            Stage("pair_dynamics", self.pair_engine.run, ["traits", "behavior"]),
+            Stage("linguistics", self._finalizer("linguistics"), ["scan"]),
+            Stage("trends", self._finalizer("trends"), ["scan"]),
+            Stage("character_matches", self.character_engine.run, ["traits"]),
+            Stage("group_health", self.group_health_engine.run, ["behavior", "pair_dynamics"]),
+            Stage(
+                "risk_analysis",
+                self.risk_engine.run,
+                ["behavior", "pair_dynamics", "traits"],
+            ),
+            Stage(
+                "user_summaries",
+                self.user_summary_engine.run,
+                ["behavior", "pair_dynamics", "traits"],
+            ),
+            Stage("explanations", self._explain, ["traits", "character_matches"]),
+        ]
+
+    def _scan_engines(self) -> dict:
+        return {
+            "metrics": self.metrics_engine,
+            "engagement": self.engagement_engine,
+            "linguistics": self.linguistic_engine,
+            "trends": self.trend_engine,
+        }
+
+    def scan(self, parsed_data: dict, names: Iterable[str] = SCAN_STAGES) -> dict:
+        """Scan accumulators for ``names``, keyed by name; finalised by the graph."""
+
+        engines = self._scan_engines()
+
+        if self.map_reduces(parsed_data):
+            return map_reduce_scan(
+                parsed_data,
+                {name: engines[name].accumulator for name in names},
+                self.scan_chunks,
+                self.scan_executor,
+            )
+
+        accumulators = self.accumulators(names)
+
+        scan_messages(parsed_data, accumulators.values())
+
+        return accumulators
+
+    def map_reduces(self, parsed_data: dict) -> bool:
+        """Whether scan() splits this chat over scan_chunks time chunks."""
+
+        return (
+            self.scan_chunks > 1
+            and len(parsed_data.get("messages", [])) >= self.scan_min_messages
         )
 
-        explanations = {
+    def scan_stages(self, sections: Optional[Iterable[str]] = None) -> List[str]:
+        """Scan accumulators the engines behind ``sections`` (None = all) read."""
+
+        sections = self.resolve_sections(sections)
+        if sections is None:
+            sections = set(self.SECTION_OUTPUTS)
+
+        kept = {
+            stage.name
+            for stage in prune_stages(
+                self.stages(), [self.SECTION_OUTPUTS[section] for section in sections]
+            )
+        }
+
+        return [name for name in self.SCAN_STAGES if name in kept]
+
+    def accumulators(self, names: Iterable[str] = SCAN_STAGES) -> dict:
+        """Empty scan accumulators for ``names``, keyed by name."""
+
+        engines = self._scan_engines()
+        return {name: engines[name].accumulator() for name in names}
+
+    def _finalizer(self, name: str):
+        return functools.partial(_finalize, name, self._scan_engines()[name])
+
+    def _explain(self, adjusted_traits: dict, character_matches: dict) -> dict:
+        return {
             name: self.explanation_engine.run(
                 name=name,
                 traits=adjusted_traits.get(name, {}),
@@ -76,21 +442,12 @@ class AnalysisService:
             for name, match in character_matches.items()
         }
 
-        return {
-            "meta": {
-                "universe": universe,
-                "participants": parsed_data.get("participants", []),
-            },
-            "chat_metrics": metrics.get("chat_metrics", {}),
-            "traits": adjusted_traits,
-            "behavior": behavior,
-            "engagement": engagement,
-            "pair_dynamics": pairs,
-            "group_health": group_health,
-            "risk_analysis": risk_analysis,
-            "trends": trends,
-            "linguistics": linguistics,
-            "character_matches": character_matches,
-            "user_summaries": user_summaries,
-            "explanations": explanations,
-        }
+
+def _universe_traits(universe_engine, traits: dict, universe: str) -> dict:
+    """Stage for "traits": base traits adjusted for one universe."""
+    return universe_engine.run(traits, universe=universe)
+
+
+def _finalize(name: str, engine, scan: dict) -> dict:
+    """Stage finalising one scan accumulator."""
+    return engine.finalize(scan[name])
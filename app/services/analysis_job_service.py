@@ -0,0 +1,69 @@
+import threading
+import time
+import uuid
+from typing import Dict, Optional
+
+
+class AnalysisJob:
+    """
+    The rest of a deadline-bounded analysis, finished in the background.
+
+    ``status`` goes pending -> complete (``result`` holds the full analyses,
+    by universe) or failed.
+    """
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = "pending"
+        self.result: Optional[Dict] = None
+        self.updated_at = time.monotonic()
+
+    def complete(self, result: Dict) -> None:
+        self.result = result
+        self.status = "complete"
+        self.updated_at = time.monotonic()
+
+    def fail(self) -> None:
+        self.status = "failed"
+        self.updated_at = time.monotonic()
+
+
+class AnalysisJobStore:
+    """
+    In-process registry of background analysis jobs.
+
+    Like upload sessions, jobs live in this worker's memory, so polling
+    them needs sticky routing when the API runs more than one worker
+    process.
+    """
+
+    # Jobs are forgotten this long after their last change
+    TTL_SECONDS = 60 * 60
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self) -> AnalysisJob:
+
+        self._expire()
+        job = AnalysisJob()
+
+        with self._lock:
+            self._jobs[job.id] = job
+
+        return job
+
+    def get(self, job_id: str) -> Optional[AnalysisJob]:
+        self._expire()
+        return self._jobs.get(job_id)
+
+    def _expire(self) -> None:
+
+        cutoff = time.monotonic() - self.TTL_SECONDS
+
+        with self._lock:
+            for job_id in [
+                job_id for job_id, job in self._jobs.items() if job.updated_at < cutoff
+            ]:
+                del self._jobs[job_id]
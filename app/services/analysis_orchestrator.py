@@ -1,8 +1,37 @@
+import asyncio
 import traceback
+from typing import Dict, List, Optional
+
 from app.services.ai_payload_builder import (
     build_user_payload_from_analysis,
     build_group_payload_from_analysis,
 )
+from app.services.analysis_pool import analyze_chat
+from app.services.cancellation import AnalysisCancelled, CancelToken, DeadlineExceeded
+
+
+class PendingAnalysis:
+    """
+    The unfinished part of a deadline-bounded run: analyses so far (with
+    the sections only computed for ai_insights still in) and the stage
+    values the missing sections need. resume_analyses() completes it.
+    """
+
+    def __init__(
+        self,
+        universes: List[str],
+        sections: Optional[List[str]],
+        analyses: Dict[str, dict],
+        state: dict,
+        scan: Optional[dict] = None,
+        trend_index=None,
+    ):
+        self.universes = universes
+        self.sections = sections
+        self.analyses = analyses
+        self.state = state
+        self.scan = scan
+        self.trend_index = trend_index
 
 
 async def run_full_analysis(
@@ -10,16 +39,247 @@ async def run_full_analysis(
     universe: str,
     analysis_service,
     ai_service,
+    sections: Optional[List[str]] = None,
+    scan: Optional[dict] = None,
+    trend_index=None,
+    analysis_pool=None,
+    cancel=None,
+    deadline: Optional[float] = None,
 ) -> dict:
 
+    analyses = await run_universe_analyses(
+        parsed_data,
+        [universe],
+        analysis_service,
+        ai_service,
+        sections,
+        scan,
+        trend_index,
+        analysis_pool,
+        cancel,
+        deadline,
+    )
+
+    return analyses[universe]
+
+
+async def run_universe_analyses(
+    parsed_data: dict,
+    universes: List[str],
+    analysis_service,
+    ai_service,
+    sections: Optional[List[str]] = None,
+    scan: Optional[dict] = None,
+    trend_index=None,
+    analysis_pool=None,
+    cancel=None,
+    deadline: Optional[float] = None,
+) -> Dict[str, dict]:
+    """
+    ``cancel`` (a CancelToken) stops the engines at the next stage boundary
+    and drops pending AI calls; AnalysisCancelled then carries whatever
+    sections had finished.
+
+    ``deadline`` (seconds from now) stops the run the same way when time is
+    up; engines run most wanted section first, and DeadlineExceeded carries
+    the sections that made it plus a PendingAnalysis for the rest.
+    """
+
+    stop, timer = _arm_deadline(cancel, deadline)
+
+    try:
+        analyses = await _deterministic_layer(
+            parsed_data, universes, analysis_service, sections, scan, trend_index, analysis_pool, stop
+        )
+
+        if sections is None or "ai_insights" in sections:
+            await _ai_layer(analyses, ai_service, stop)
+
+    except AnalysisCancelled as e:
+        if deadline is None or (cancel is not None and cancel.cancelled):
+            raise AnalysisCancelled(_requested(e.partial, sections)) from None
+
+        # Own copies of the meta: the partial response is annotated on its way out
+        analyses = {
+            universe: {**analysis, "meta": dict(analysis["meta"])}
+            for universe, analysis in e.partial.items()
+        }
+
+        pending = PendingAnalysis(universes, sections, analyses, e.state, scan, trend_index)
+        raise DeadlineExceeded(_requested(e.partial, sections), pending) from None
+
+    finally:
+        if timer is not None:
+            timer.cancel()
+            stop.close()
+
+    return _requested(analyses, sections)
+
+
+async def resume_analyses(
+    parsed_data: dict,
+    pending: PendingAnalysis,
+    analysis_service,
+    ai_service,
+    analysis_pool=None,
+) -> Dict[str, dict]:
+    """Finish a PendingAnalysis: only its missing sections are computed."""
+
+    analyses = pending.analyses
+
+    wanted = analysis_service.resolve_sections(pending.sections)
+    if wanted is None:
+        wanted = set(analysis_service.SECTION_OUTPUTS)
+
+    missing = sorted(
+        {section for analysis in analyses.values() for section in wanted if section not in analysis}
+    )
+
+    if missing:
+        rest = await _deterministic_layer(
+            parsed_data,
+            pending.universes,
+            analysis_service,
+            missing,
+            pending.scan,
+            pending.trend_index,
+            analysis_pool,
+            done=pending.state,
+        )
+
+        for universe, analysis in analyses.items():
+            for section in missing:
+                analysis.setdefault(section, rest[universe][section])
+
+    for analysis in analyses.values():
+        analysis["meta"].pop("skipped", None)
+
+    if pending.sections is None or "ai_insights" in pending.sections:
+        await _ai_layer(analyses, ai_service)
+
+    return _requested(analyses, pending.sections)
+
+
+def _arm_deadline(cancel, deadline: Optional[float]):
+    """(token the engines watch, deadline timer or None)."""
+
+    if deadline is None:
+        return cancel, None
+
+    # Its own token: running out of time isn't the client going away
+    stop = CancelToken()
+
+    if cancel is not None:
+        cancel.on_cancel(stop.cancel)
+        if cancel.cancelled:
+            stop.cancel()
+
+    timer = asyncio.get_running_loop().call_later(max(deadline, 0), stop.cancel)
+
+    return stop, timer
+
+
+async def _deterministic_layer(
+    parsed_data: dict,
+    universes: List[str],
+    analysis_service,
+    sections,
+    scan,
+    trend_index,
+    analysis_pool,
+    cancel=None,
+    done: Optional[dict] = None,
+) -> Dict[str, dict]:
+
     # -------------------------
     # 1️⃣ Deterministic Layer
     # -------------------------
-    analysis = analysis_service.run(parsed_data, universe)
+    # Only the engines behind the requested sections (+ ai_insights inputs);
+    # universe-independent engines run once for all universes
+    # A ready scan (incremental upload) skips the pass over the messages
+    try:
+        if analysis_pool is not None:
+            if scan is None and done is None and analysis_service.map_reduces(parsed_data):
+                # Big chat: scan its time chunks across the workers first
+                scan = await asyncio.to_thread(
+                    analysis_service.scan, parsed_data, analysis_service.scan_stages(sections)
+                )
+
+            # In a worker process, off the event loop
+            return await analysis_pool.run(
+                analyze_chat, parsed_data, universes, sections, scan, trend_index, cancel, done
+            )
+
+        return analysis_service.run_universes(
+            parsed_data, universes, sections, scan, trend_index, cancel, done
+        )
+
+    except AnalysisCancelled as e:
+        if sections is None or "ai_insights" in sections:
+            _skip_ai_insights(e.partial)
+        raise
+
+
+async def _ai_layer(analyses: Dict[str, dict], ai_service, cancel=None) -> None:
 
     # -------------------------
     # 2️⃣ AI Layer (Safe)
     # -------------------------
+    ai_layer = asyncio.gather(
+        *(_add_ai_insights(analysis, ai_service) for analysis in analyses.values())
+    )
+
+    if cancel is not None:
+        # Nobody left to read them (or out of time): drop the Groq requests
+        cancel.on_cancel(ai_layer.cancel)
+        if cancel.cancelled:
+            ai_layer.cancel()
+
+    try:
+        await ai_layer
+    except asyncio.CancelledError:
+        if cancel is None or not cancel.cancelled:
+            raise
+
+        _skip_ai_insights(analyses)
+        raise AnalysisCancelled(analyses) from None
+
+
+def _requested(analyses: Dict[str, dict], sections: Optional[List[str]]) -> Dict[str, dict]:
+
+    if sections is None:
+        return analyses
+
+    # Drop sections that were only computed to feed ai_insights
+    requested = {}
+
+    for universe, analysis in analyses.items():
+        requested[universe] = {
+            key: value
+            for key, value in analysis.items()
+            if key == "meta" or key in sections
+        }
+
+        if "skipped" in analysis["meta"]:
+            requested[universe]["meta"] = {
+                **analysis["meta"],
+                "skipped": [
+                    section for section in analysis["meta"]["skipped"] if section in sections
+                ],
+            }
+
+    return requested
+
+
+def _skip_ai_insights(analyses: Dict[str, dict]) -> None:
+
+    for analysis in analyses.values():
+        analysis.pop("ai_insights", None)
+        analysis["meta"].setdefault("skipped", []).append("ai_insights")
+
+
+async def _add_ai_insights(analysis: dict, ai_service) -> None:
+
     try:
         user_payload = build_user_payload_from_analysis(analysis)
         group_payload = build_group_payload_from_analysis(analysis)
@@ -43,5 +303,3 @@ async def run_full_analysis(
             "group_summary": None,
             "users": {},
         }
-
-    return analysis
@@ -0,0 +1,307 @@
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from contextlib import ExitStack
+from typing import Callable, List, Optional
+
+from app.services.AnalysisService import AnalysisService
+from app.services.archive_service import open_chat_stream
+from app.services.chat_state_service import resume_chat
+from app.services.message_table import MessageTable
+from app.services.parser_service import WhatsAppParser
+from app.services.preview_service import preview_file, preview_scan
+from app.services.shared_table import SharedTableRef, SharedTables
+
+from app.engines.metrics_engine import MetricsEngine
+from app.engines.trait_engine import TraitEngine
+from app.engines.universe_engine import UniverseEngine
+from app.engines.behavior_engine import BehaviorEngine
+from app.engines.engagement_engine import EngagementEngine
+from app.engines.linguistic_engine import LinguisticEngine
+from app.engines.trend_engine import TrendEngine
+from app.engines.pair_engine import PairDynamicsEngine
+from app.engines.character_engine import CharacterEngine
+from app.engines.explanation_engine import ExplanationEngine
+from app.engines.group_health_engine import GroupHealthEngine
+from app.engines.risk_engine import RiskEngine
+from app.engines.user_summary_engine import UserSummaryEngine
+
+
+def build_analysis_service(
+    scan_chunks: int = 1, scan_executor=None, scan_min_messages: int = 0
+) -> AnalysisService:
+
+    return AnalysisService(
+        metrics_engine=MetricsEngine(),
+        trait_engine=TraitEngine(),
+        universe_engine=UniverseEngine(),
+        behavior_engine=BehaviorEngine(),
+        engagement_engine=EngagementEngine(),
+        linguistic_engine=LinguisticEngine(),
+        trend_engine=TrendEngine(),
+        pair_engine=PairDynamicsEngine(),
+        character_engine=CharacterEngine(),
+        explanation_engine=ExplanationEngine(),
+        group_health_engine=GroupHealthEngine(),
+        risk_engine=RiskEngine(),
+        user_summary_engine=UserSummaryEngine(),
+        scan_chunks=scan_chunks,
+        scan_executor=scan_executor,
+        scan_min_messages=scan_min_messages,
+    )
+
+
+class PoolBusy(Exception):
+    """Every worker is busy and the queue is full."""
+
+
+class AnalysisPool:
+    """
+    Worker processes for the CPU-bound part of a request (parsing, the
+    message scan, the deterministic engines), so the event loop stays free
+    while a big chat is analysed.
+
+    Each worker builds its parser and engines once, at start-up. At most
+    ``workers + queue_depth`` requests are admitted at a time (admit() /
+    release()); past that admit() raises PoolBusy instead of queueing
+    without bound. ``workers=0`` runs tasks in the calling process.
+
+    Message tables in task arguments travel through shared memory: the
+    columns are copied into a segment once and workers map them by name,
+    instead of each task pickling the whole chat.
+    """
+
+    def __init__(self, workers: int, queue_depth: int):
+        self.workers = workers
+        self.capacity = max(workers, 1) + queue_depth
+
+        self.admitted = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+        self.tables = SharedTables()
+
+    def admit(self) -> None:
+
+        with self._lock:
+            if self.admitted >= self.capacity:
+                raise PoolBusy(f"{self.admitted} analyses already running or queued")
+            self.admitted += 1
+
+    def release(self) -> None:
+
+        with self._lock:
+            self.admitted -= 1
+
+    async def run(self, task: Callable, *args):
+        """Result of ``task(*args)``, one of this module's worker tasks."""
+
+        if self.workers == 0:
+            if _service is None:
+                _init_worker()
+            return task(*args)
+
+        refs = []
+        args = [self._share(arg, refs) for arg in args]
+
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), _run_task, task, *args)
+        finally:
+            for ref in refs:
+                self.tables.release(ref)
+
+    def _share(self, arg, refs: list):
+
+        if isinstance(arg, MessageTable):
+            refs.append(self.tables.share(arg))
+            return refs[-1]
+
+        if isinstance(arg, dict) and isinstance(arg.get("messages"), MessageTable):
+            refs.append(self.tables.share(arg["messages"]))
+            return {**arg, "messages": refs[-1]}
+
+        return arg
+
+    def shutdown(self) -> None:
+
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def scan_executor(self) -> Optional[Executor]:
+        """
+        The workers as a plain Executor (see PoolExecutor), for
+        AnalysisService's map-reduce scan and WhatsAppParser.parse_parallel;
+        None with ``workers=0``.
+        """
+
+        return PoolExecutor(self) if self.workers else None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+
+        with self._lock:
+            if self._executor is None:
+                # Spawned, not forked: the server process has threads and
+                # open DB connections a fork would copy mid-use
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                )
+
+        return self._executor
+
+
+class PoolExecutor(Executor):
+    """
+    An AnalysisPool's workers behind the Executor interface, for code that
+    maps module-level functions over chunks of one chat (map_reduce_scan,
+    parse_parallel): tables in the arguments travel through shared memory
+    as in run().
+
+    Tasks don't go through admit(); they belong to a request that holds
+    its own slot.
+    """
+
+    def __init__(self, pool: AnalysisPool):
+        self.pool = pool
+
+    def submit(self, fn: Callable, *args) -> Future:
+
+        refs = []
+        args = [self.pool._share(arg, refs) for arg in args]
+
+        try:
+            future = self.pool._get_executor().submit(_run_task, fn, *args)
+        except BaseException:
+            self._release(refs)
+            raise
+
+        future.add_done_callback(lambda _: self._release(refs))
+
+        return future
+
+    def _release(self, refs: list) -> None:
+        for ref in refs:
+            self.pool.tables.release(ref)
+
+
+# ---- Worker Side ----
+# Built once per worker process by _init_worker()
+_parser: Optional[WhatsAppParser] = None
+_service: Optional[AnalysisService] = None
+
+# Segments whose views outlived their task; closed once they're gone
+_lingering: List = []
+
+
+def _init_worker() -> None:
+
+    global _parser, _service
+
+    _parser = WhatsAppParser()
+
+    # Stages run serially (see run_stages); concurrency is across requests,
+    # plus the map-reduced scan of big chats driven from the API process
+    _service = build_analysis_service()
+
+
+def _run_task(task: Callable, *args):
+    """Worker entry point: map shared tables in ``args``, run ``task``, unmap."""
+
+    _close_segments(_lingering)
+
+    segments = []
+    args = [_attach(arg, segments) for arg in args]
+
+    try:
+        return task(*args)
+    finally:
+        del args
+        _close_segments(segments)
+
+
+def _attach(arg, segments: list):
+
+    if isinstance(arg, SharedTableRef):
+        segment, table = arg.attach()
+        segments.append(segment)
+        return table
+
+    if isinstance(arg, dict) and isinstance(arg.get("messages"), SharedTableRef):
+        return {**arg, "messages": _attach(arg["messages"], segments)}
+
+    return arg
+
+
+def _close_segments(segments: list) -> None:
+
+    for segment in list(segments):
+        if segments is _lingering:
+            _lingering.remove(segment)
+
+        try:
+            segment.close()
+        except BufferError:
+            # Something still holds a view; try again after the next task
+            _lingering.append(segment)
+
+
+def parse_chat(path: str) -> dict:
+    """
+    Columnar parse of the chat file at ``path`` (spooled chat text, or a
+    .zip / .gz / .zst export as uploaded), streamed from disk.
+    """
+
+    with open(path, "rb") as f:
+        # Serially: this already is one of a bounded set of worker processes.
+        # Big spooled chats are split across the workers by the caller
+        # instead (parse_parallel with the pool's scan_executor())
+        return _parser.parse_file(open_chat_stream(f), columnar=True)
+
+
+def parse_chat_range(path: str, start: int, end: int, date_order: Optional[str]) -> dict:
+    """WhatsAppParser.parse_range() of a resumable upload's file, as it arrives."""
+    return _parser.parse_range(path, start, end, date_order)
+
+
+def parse_merged_chats(paths: List[str]) -> dict:
+
+    with ExitStack() as stack:
+        streams = [open_chat_stream(stack.enter_context(open(path, "rb"))) for path in paths]
+
+        return _parser.parse_merged(streams, columnar=True)
+
+
+def resume_chat_file(state: dict, path: str) -> tuple:
+    """resume_chat() of the spooled chat text at ``path``; (parsed, scan) or None."""
+
+    with open(path, "rb") as f:
+        # Plain text on disk: resume_chat() seeks instead of decoding history
+        return resume_chat(state, f, _parser, _service, seekable=True)
+
+
+def scan_chat(parsed_data: dict) -> dict:
+    return _service.scan(parsed_data)
+
+
+def preview_chat(parsed_data: dict, budget: int) -> tuple:
+    return preview_scan(parsed_data, _service, budget)
+
+
+def preview_chat_file(path: str, budget: int, window=None) -> tuple:
+    return preview_file(path, _parser, _service, budget, window)
+
+
+def index_trends(messages):
+    return _service.trend_engine.index(messages)
+
+
+def analyze_chat(
+    parsed_data: dict, universes: List[str], sections, scan, trend_index, cancel=None, done=None
+) -> dict:
+    return _service.run_universes(
+        parsed_data, universes, sections, scan, trend_index, cancel, done
+    )
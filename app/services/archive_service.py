@@ -0,0 +1,99 @@
+import gzip
+import os
+import shutil
+import tempfile
+import zipfile
+from typing import BinaryIO, Optional
+
+
+ZIP_MAGIC = b"PK\x03\x04"
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# Bytes copied per read by spool_chat()
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+
+def open_chat_stream(stream: BinaryIO) -> BinaryIO:
+    """
+    Return a binary stream of the chat text inside an upload.
+
+    Plain .txt uploads come back untouched. For "Export chat (with media)"
+    zips only the chat member is stream-decompressed -- media entries are
+    never read. .gz and .zst uploads are decompressed on the fly.
+
+    Raises ValueError for archives that can't be read.
+    """
+
+    magic = stream.read(4)
+    stream.seek(0)
+
+    if magic.startswith(ZIP_MAGIC):
+        return _open_zip_member(stream)
+
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=stream, mode="rb")
+
+    if magic.startswith(ZSTD_MAGIC):
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("zstd uploads need the zstandard package")
+
+        return zstandard.ZstdDecompressor().stream_reader(stream)
+
+    return stream
+
+
+def spool_chat(stream: BinaryIO, directory: Optional[str] = None) -> str:
+    """
+    Copy the chat text of an upload (see open_chat_stream) to a temp file
+    and return its path, so another process can parse it from disk. Only
+    the chat member of a zip is copied; memory use is one copy buffer.
+    The caller removes the file.
+
+    Raises ValueError for archives that can't be read.
+    """
+
+    chat = open_chat_stream(stream)
+    fd, path = tempfile.mkstemp(prefix="chat-", suffix=".txt", dir=directory)
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            shutil.copyfileobj(chat, f, SPOOL_CHUNK_SIZE)
+    except BaseException:
+        os.remove(path)
+        raise
+    finally:
+        if chat is not stream:
+            chat.close()
+
+    return path
+
+
+def _open_zip_member(stream: BinaryIO) -> BinaryIO:
+
+    try:
+        # Reads only the central directory at the end of the file
+        archive = zipfile.ZipFile(stream)
+    except zipfile.BadZipFile:
+        raise ValueError("Upload is not a readable zip archive")
+
+    members = [
+        info
+        for info in archive.infolist()
+        if not info.is_dir()
+        and not info.filename.startswith("__MACOSX/")
+        and info.filename.lower().endswith(".txt")
+    ]
+
+    if not members:
+        raise ValueError("No chat .txt file found in the zip archive")
+
+    # iOS names it _chat.txt, Android "WhatsApp Chat with <name>.txt"
+    chat = next(
+        (info for info in members if info.filename.endswith("_chat.txt")),
+        members[0],
+    )
+
+    return archive.open(chat)
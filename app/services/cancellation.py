@@ -0,0 +1,94 @@
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, Dict, List, Optional
+
+
+class AnalysisCancelled(Exception):
+    """
+    The analysis was cancelled (client gone, deadline reached). ``partial``
+    holds what had finished by then: computed values out of run_stages(),
+    per-universe analyses further up. ``state`` is what the unfinished
+    stages would need to pick up from there (see AnalysisService).
+    """
+
+    def __init__(self, partial: Optional[Dict] = None, state: Optional[Dict] = None):
+        super().__init__(partial, state)
+        self.partial = partial or {}
+        self.state = state or {}
+
+
+class DeadlineExceeded(AnalysisCancelled):
+    """
+    Out of time: ``partial`` holds the sections that finished, ``pending``
+    what resume_analyses() needs for the rest.
+    """
+
+    def __init__(self, partial: Optional[Dict] = None, pending=None):
+        super().__init__(partial)
+        self.args = (partial, pending)
+        self.pending = pending
+
+
+class CancelToken:
+    """
+    Cancellation flag that crosses process boundaries.
+
+    The flag is one byte of shared memory and the token pickles as the
+    segment name, so a token passed to a pool worker sees cancel() called
+    in the server process. Callbacks registered with on_cancel() run in the
+    process that calls cancel() (e.g. cancelling pending AI calls). The
+    creating process close()s the token when the request is over.
+    """
+
+    def __init__(self):
+        self._segment = SharedMemory(create=True, size=1)
+        self._owner = True
+        self._callbacks: List[Callable[[], None]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._segment is None or self._segment.buf[0] == 1
+
+    def cancel(self) -> None:
+
+        if self.cancelled:
+            return
+
+        self._segment.buf[0] = 1
+
+        for callback in self._callbacks:
+            callback()
+
+    def on_cancel(self, callback: Callable[[], None]) -> None:
+        self._callbacks.append(callback)
+
+    def raise_if_cancelled(self, partial: Optional[Dict] = None) -> None:
+        if self.cancelled:
+            raise AnalysisCancelled(partial)
+
+    def close(self) -> None:
+
+        if self._segment is None:
+            return
+
+        self._segment.close()
+        if self._owner:
+            self._segment.unlink()
+
+        self._segment = None
+
+    def __getstate__(self):
+        # A tuple: a bare None state would skip __setstate__
+        return (self._segment.name if self._segment is not None else None,)
+
+    def __setstate__(self, state):
+
+        (name,) = state
+
+        self._owner = False
+        self._callbacks = []
+
+        try:
+            self._segment = None if name is None else SharedMemory(name=name)
+        except FileNotFoundError:
+            # Closed by its request already: nobody is waiting for the result
+            self._segment = None
@@ -0,0 +1,259 @@
+import hashlib
+import json
+import zlib
+from typing import BinaryIO, Dict, Optional, Tuple
+
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import func
+
+from app.models.chat_state import ChatState
+from app.services.message_table import MessageTable, from_epoch, to_epoch
+
+
+# Non-empty lines from the top of an export that identify the chat
+CHAT_KEY_LINES = 25
+CHAT_KEY_BYTES = 64 * 1024
+
+# Layout of ChatState.partials; bump when an accumulator's state changes
+# (2: reply delays as a histogram)
+PARTIALS_VERSION = 2
+
+
+def chat_key(stream: BinaryIO) -> Optional[str]:
+    """
+    Identity of a chat across exports: SHA-256 of its first lines, which a
+    newer export of the same chat repeats verbatim. None for chats too short
+    to tell apart (they're cheap to process in full anyway).
+    """
+
+    head = stream.read(CHAT_KEY_BYTES)
+    lines = head.decode("utf-8", errors="replace").splitlines()
+
+    if len(head) == CHAT_KEY_BYTES:
+        # Last line may be cut off mid-way
+        lines = lines[:-1]
+
+    lines = [
+        line.replace("\u202f", " ").replace("\u00a0", " ").strip() for line in lines
+    ]
+    lines = [line for line in lines if line][:CHAT_KEY_LINES]
+
+    if len(lines) < CHAT_KEY_LINES:
+        return None
+
+    return hashlib.sha256("\n".join(lines).encode("utf-8")).hexdigest()
+
+
+def load_chat_state(db: Session, key: Optional[str]) -> Optional[ChatState]:
+
+    if key is None:
+        return None
+
+    return db.query(ChatState).filter(ChatState.chat_key == key).first()
+
+
+def snapshot_chat_state(record: ChatState) -> Dict:
+    """A ChatState's columns as plain data, for resume_chat() in a worker process."""
+
+    return {
+        "last_timestamp": record.last_timestamp,
+        "messages_at_last_timestamp": record.messages_at_last_timestamp,
+        "senders": list(record.senders),
+        "meta": dict(record.meta),
+        "partials": record.partials,
+    }
+
+
+def resume_chat(
+    state: Dict,
+    stream: BinaryIO,
+    parser,
+    analysis_service,
+    seekable: bool = False,
+) -> Optional[Tuple[Dict, Dict]]:
+    """
+    Parse and scan only what a newer export added to a chat, given its
+    stored state (snapshot_chat_state()).
+
+    Returns (parsed, scan): the stored accumulators with the new messages
+    merged in, and parse output whose participants / meta cover the whole
+    chat but whose "messages" are just the new ones -- nothing downstream of
+    the scan reads messages. None if the stored accumulators can't be read
+    (e.g. an older layout): the chat then needs a full parse.
+    """
+
+    scan = load_partials(state["partials"], analysis_service)
+    if scan is None:
+        return None
+
+    since = state["last_timestamp"]
+    date_order = state["meta"]["date_order"]
+
+    if seekable:
+        # Plain export: jump close to ``since`` instead of decoding history
+        stream.seek(parser.resume_offset(stream, since, date_order))
+
+    tail = parser.parse_after(
+        stream, since, state["messages_at_last_timestamp"], date_order, columnar=True
+    )
+
+    tail_scan = analysis_service.scan(tail, list(scan))
+
+    for name, accumulator in scan.items():
+        accumulator.merge(tail_scan[name])
+
+    # ---- Whole-chat parse output ----
+    senders = list(state["senders"])
+    senders.extend(sender for sender in tail["senders"] if sender not in senders)
+
+    meta = dict(state["meta"])
+    tail_meta = tail["meta"]
+
+    meta["total_messages_parsed"] += tail_meta["total_messages_parsed"]
+    meta["skipped_lines"] += tail_meta["skipped_lines"]
+
+    system_messages = dict(meta["system_messages_dropped"])
+    for category, count in tail_meta["system_messages_dropped"].items():
+        system_messages[category] = system_messages.get(category, 0) + count
+    meta["system_messages_dropped"] = system_messages
+
+    if tail_meta["dialect"] not in ("unknown", meta["dialect"]):
+        meta["dialect"] = "mixed" if meta["dialect"] != "unknown" else tail_meta["dialect"]
+
+    meta["messages_added"] = tail_meta["total_messages_parsed"]
+
+    parsed = {
+        "participants": sorted(senders),
+        "senders": senders,
+        "messages": tail["messages"],
+        "sorted": True,
+        "meta": meta,
+    }
+
+    return parsed, scan
+
+
+def dump_partials(scan: Dict) -> bytes:
+    """Scan accumulators as versioned, compressed JSON for ChatState.partials."""
+
+    payload = {
+        "version": PARTIALS_VERSION,
+        "scan": {name: accumulator.to_state() for name, accumulator in scan.items()},
+    }
+
+    return zlib.compress(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+
+
+def load_partials(data: bytes, analysis_service) -> Optional[Dict]:
+    """
+    Accumulators from dump_partials() output; None for anything this
+    version can't read (other layout, older pickled state, corrupt data).
+    """
+
+    try:
+        payload = json.loads(zlib.decompress(data))
+    except (zlib.error, ValueError):
+        return None
+
+    if not isinstance(payload, dict) or payload.get("version") != PARTIALS_VERSION:
+        return None
+
+    states = payload["scan"]
+    scan = analysis_service.accumulators(list(states))
+
+    try:
+        for name, accumulator in scan.items():
+            accumulator.load_state(states[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+    return scan
+
+
+def save_chat_state(
+    db: Session,
+    key: Optional[str],
+    record: Optional[ChatState],
+    parsed: Dict,
+    scan: Dict,
+    resumed: bool = False,
+) -> None:
+    """
+    Store ``scan`` (all scan accumulators, whole chat) for the next upload.
+    ``parsed`` is the full parse or, with ``resumed``, resume_chat()'s output
+    for ``record``. Runs in the session's transaction; the caller commits.
+
+    Written as an upsert on chat_key, so two first uploads of one chat
+    racing to insert it don't fail: the state reaching further wins.
+    """
+
+    if key is None:
+        return
+
+    values = chat_state_values(parsed, scan, record if resumed else None)
+    if values is None:
+        return
+
+    insert = postgresql.insert(ChatState).values(chat_key=key, **values)
+
+    db.execute(
+        insert.on_conflict_do_update(
+            index_elements=[ChatState.chat_key],
+            set_={
+                **{name: insert.excluded[name] for name in values},
+                "updated_at": func.now(),
+            },
+            where=ChatState.last_timestamp <= insert.excluded.last_timestamp,
+        )
+    )
+
+
+def chat_state_values(
+    parsed: Dict, scan: Dict, resumed_from: Optional[ChatState] = None
+) -> Optional[Dict]:
+    """
+    ChatState columns (bar chat_key) for ``scan``, in snapshot_chat_state()
+    form; None for a chat without messages. ``resumed_from`` is the record
+    resume_chat() continued, if it did.
+    """
+
+    last_epoch = scan["metrics"].last_timestamp
+
+    if last_epoch is None:
+        return None
+
+    last_timestamp = from_epoch(last_epoch)
+    at_last = _count_at_end(parsed["messages"], last_epoch)
+
+    if resumed_from is not None and resumed_from.last_timestamp == last_timestamp:
+        # New messages (if any) share the minute the old state ended on
+        at_last += resumed_from.messages_at_last_timestamp
+
+    meta = dict(parsed.get("meta", {}))
+    meta.pop("messages_added", None)
+
+    return {
+        "last_timestamp": last_timestamp,
+        "messages_at_last_timestamp": at_last,
+        "senders": list(parsed.get("senders", [])),
+        "meta": meta,
+        "partials": dump_partials(scan),
+    }
+
+
+def _count_at_end(messages, epoch: int) -> int:
+    """Messages at the end of a sorted run stamped ``epoch``."""
+
+    if isinstance(messages, MessageTable):
+        timestamps = reversed(messages.timestamps)
+    else:
+        timestamps = (to_epoch(msg.timestamp) for msg in reversed(messages) if msg.timestamp)
+
+    count = 0
+    for timestamp in timestamps:
+        if timestamp != epoch:
+            break
+        count += 1
+
+    return count
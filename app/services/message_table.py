@@ -0,0 +1,366 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from enum import IntEnum
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Sequence
+
+
+# Chat timestamps are naive local times; store them as seconds since this
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_epoch(timestamp: datetime) -> int:
+    return (timestamp - EPOCH) // timedelta(seconds=1)
+
+
+def from_epoch(seconds: int) -> datetime:
+    return EPOCH + timedelta(seconds=seconds)
+
+
+class MessageKind(IntEnum):
+    """What a message is, decided once by the parser."""
+
+    TEXT = 0
+    MEDIA = 1
+    DELETED = 2
+    EDITED = 3
+    LINK = 4
+
+
+# Kinds with no real text to measure or tokenise
+NON_TEXT_KINDS = frozenset({MessageKind.MEDIA, MessageKind.DELETED})
+
+# Stored uint8 value -> MessageKind without an enum lookup per row
+KIND_BY_VALUE = tuple(MessageKind)
+
+
+class Message:
+    """
+    Compact parsed message.
+
+    Senders are interned per parse: ``sender`` is the shared name string and
+    ``sender_id`` its index into the parse result's ``senders`` table.
+    get() / [] mirror the old dict messages for code that still reads them
+    dict-style.
+    """
+
+    __slots__ = ("timestamp", "sender", "sender_id", "text", "kind")
+
+    FIELDS = frozenset(__slots__)
+
+    def __init__(self, timestamp, sender, sender_id, text, kind=MessageKind.TEXT):
+        self.timestamp = timestamp
+        self.sender = sender
+        self.sender_id = sender_id
+        self.text = text
+        self.kind = kind
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self.FIELDS else default
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __repr__(self):
+        return f"Message({self.timestamp!r}, {self.sender!r}, {self.text!r})"
+
+
+class MessageTable:
+    """
+    Columnar form of a parsed chat.
+
+    - timestamps: int64 epoch seconds (naive, see EPOCH)
+    - sender_ids: int32 index into ``senders``
+    - kinds:      uint8 MessageKind values
+    - offsets:    int64, len(table) + 1 byte offsets into ``text``
+    - text:       every message's UTF-8 text concatenated
+
+    Columns may also be memoryviews of the same formats, e.g. over an
+    mmap'd parse cache entry.
+
+    Indexing / iterating yields Message rows, so code written against the
+    list-of-messages shape keeps working. That builds an object per row,
+    so nothing on the analysis path does it: the message scan, windows,
+    trend indexes and chat state read the arrays directly.
+
+    The columns are stdlib arrays, not NumPy (not a dependency here). The
+    engines' per-message work -- regexes, tokenising, counting -- is
+    Python either way, so the table doesn't make analysis faster than a
+    Message list; it makes a parse about 5x smaller to keep, and cheap to
+    hand to a worker (shared memory) or map from the parse cache.
+    """
+
+    def __init__(
+        self,
+        timestamps: array,
+        sender_ids: array,
+        kinds: array,
+        offsets: array,
+        text: bytes,
+        senders: List[str],
+    ):
+        self.timestamps = timestamps
+        self.sender_ids = sender_ids
+        self.kinds = kinds
+        self.offsets = offsets
+        self.text = text
+        self.senders = senders
+
+    @classmethod
+    def from_messages(cls, messages: Iterable[Message], senders: List[str]) -> "MessageTable":
+
+        builder = MessageTableBuilder(senders)
+
+        for msg in messages:
+            builder.append(msg)
+
+        return builder.build()
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def __getitem__(self, index: int) -> Message:
+
+        if index < 0:
+            index += len(self)
+
+        sender_id = self.sender_ids[index]
+
+        return Message(
+            from_epoch(self.timestamps[index]),
+            self.senders[sender_id],
+            sender_id,
+            self.text_at(index),
+            KIND_BY_VALUE[self.kinds[index]],
+        )
+
+    def __iter__(self) -> Iterator[Message]:
+
+        senders = self.senders
+        last_epoch = None
+        timestamp = None
+
+        for index, text in enumerate(self.texts()):
+            epoch = self.timestamps[index]
+            sender_id = self.sender_ids[index]
+
+            # Same-minute neighbours share one datetime, as in the parser
+            if epoch != last_epoch:
+                last_epoch = epoch
+                timestamp = from_epoch(epoch)
+
+            yield Message(
+                timestamp,
+                senders[sender_id],
+                sender_id,
+                text,
+                KIND_BY_VALUE[self.kinds[index]],
+            )
+
+    def text_at(self, index: int) -> str:
+        # str() rather than .decode() so ``text`` may be a memoryview (mmap)
+        return str(self.text[self.offsets[index] : self.offsets[index + 1]], "utf-8")
+
+    def texts(self) -> Iterator[str]:
+
+        text = self.text
+        offsets = self.offsets
+
+        for index in range(len(self)):
+            yield str(text[offsets[index] : offsets[index + 1]], "utf-8")
+
+    def sorted(self) -> "MessageTable":
+        """Return the table in timestamp order (self if already sorted)."""
+
+        timestamps = self.timestamps
+        start = unsorted_from(timestamps)
+
+        if start == len(self):
+            return self
+
+        order = list(range(start))
+        order.extend(sorted(range(start, len(self)), key=timestamps.__getitem__))
+
+        return self.take(order)
+
+    def slice(self, start: int, end: int) -> "MessageTable":
+        """Rows [start, end) as views over this table's columns; nothing is copied."""
+
+        return MessageTable(
+            memoryview(self.timestamps)[start:end],
+            memoryview(self.sender_ids)[start:end],
+            memoryview(self.kinds)[start:end],
+            # Offsets stay absolute, so the text blob is shared as is
+            memoryview(self.offsets)[start : end + 1],
+            self.text,
+            self.senders,
+        )
+
+    def __reduce__(self):
+
+        # Views (slices, mmap'd cache entries) don't pickle: send compact arrays
+        base = self.offsets[0]
+        text = self.text[base : self.offsets[len(self)]]
+
+        return (
+            MessageTable,
+            (
+                array("q", self.timestamps),
+                array("i", self.sender_ids),
+                array("B", self.kinds),
+                array("q", [offset - base for offset in self.offsets]),
+                bytes(text),
+                list(self.senders),
+            ),
+        )
+
+    def take(self, indices: Iterable[int]) -> "MessageTable":
+
+        builder = MessageTableBuilder(self.senders)
+        text = self.text
+        offsets = self.offsets
+
+        for index in indices:
+            builder.append_raw(
+                self.timestamps[index],
+                self.sender_ids[index],
+                text[offsets[index] : offsets[index + 1]],
+                self.kinds[index],
+            )
+
+        return builder.build()
+
+
+def unsorted_from(timestamps: Sequence) -> int:
+    """
+    Index from which a stable sort is needed; len(timestamps) if in order.
+
+    Exports are chronological apart from the odd clock jump, so everything
+    before the first message that belongs after the disorder stays put.
+    """
+
+    count = len(timestamps)
+
+    for first_drop in range(1, count):
+        if timestamps[first_drop] < timestamps[first_drop - 1]:
+            break
+    else:
+        return count
+
+    lowest = min(islice(timestamps, first_drop, None))
+
+    return bisect_right(timestamps, lowest, 0, first_drop)
+
+
+def sort_messages(messages):
+    """
+    Timestamp-order a message list or MessageTable.
+
+    Already-ordered input is returned as is; otherwise only the disordered
+    tail is re-sorted (stably, like sorted(messages, key=timestamp)).
+    """
+
+    if isinstance(messages, MessageTable):
+        return messages.sorted()
+
+    start = unsorted_from([msg.timestamp for msg in messages])
+
+    if start == len(messages):
+        return messages
+
+    return messages[:start] + sorted(messages[start:], key=lambda x: x.timestamp)
+
+
+def time_window(messages, start: Optional[int] = None, end: Optional[int] = None):
+    """
+    Sorted messages with start <= epoch seconds < end (None = open), found
+    by binary search. Tables come back as slice() views, lists as a slice
+    of the same Message objects.
+    """
+
+    if isinstance(messages, MessageTable):
+        timestamps = messages.timestamps
+        low = 0 if start is None else bisect_left(timestamps, start)
+        high = len(messages) if end is None else bisect_left(timestamps, end)
+        return messages.slice(low, max(low, high))
+
+    def epoch(msg):
+        return to_epoch(msg.timestamp)
+
+    low = 0 if start is None else bisect_left(messages, start, key=epoch)
+    high = len(messages) if end is None else bisect_left(messages, end, key=epoch)
+    return messages[low : max(low, high)]
+
+
+class MessageTableBuilder:
+    """Append messages one at a time, e.g. straight off parse_stream()."""
+
+    def __init__(self, senders: List[str]):
+        self.senders = senders
+
+        self._timestamps = array("q")
+        self._sender_ids = array("i")
+        self._kinds = array("B")
+        self._offsets = array("q", [0])
+        self._text = bytearray()
+
+        self._last_timestamp = None
+        self._last_epoch = 0
+
+    def append(self, msg: Message) -> None:
+
+        # The parser shares datetime objects between same-minute messages
+        if msg.timestamp is not self._last_timestamp:
+            self._last_timestamp = msg.timestamp
+            self._last_epoch = to_epoch(msg.timestamp)
+
+        self.append_raw(
+            self._last_epoch, msg.sender_id, msg.text.encode("utf-8"), msg.kind
+        )
+
+    def append_raw(self, epoch: int, sender_id: int, text: bytes, kind: int) -> None:
+        self._timestamps.append(epoch)
+        self._sender_ids.append(sender_id)
+        self._kinds.append(kind)
+        self._text += text
+        self._offsets.append(len(self._text))
+
+    def extend(
+        self, table: MessageTable, sender_ids: Sequence[int], end: Optional[int] = None
+    ) -> None:
+        """
+        Append rows [0, end) of ``table`` column by column, its sender ids
+        mapped through ``sender_ids`` (its id -> this builder's id).
+        """
+
+        end = len(table) if end is None else end
+        if end <= 0:
+            return
+
+        ids = table.sender_ids[:end]
+        if any(old != new for old, new in enumerate(sender_ids)):
+            ids = array("i", map(sender_ids.__getitem__, ids))
+
+        base = len(self._text) - table.offsets[0]
+
+        self._timestamps.extend(table.timestamps[:end])
+        self._sender_ids.extend(ids)
+        self._kinds.extend(table.kinds[:end])
+        self._offsets.extend(array("q", [offset + base for offset in table.offsets[1 : end + 1]]))
+        self._text += table.text[table.offsets[0] : table.offsets[end]]
+
+        # Next append() can't reuse a timestamp from before these rows
+        self._last_timestamp = None
+
+    def build(self) -> MessageTable:
+        return MessageTable(
+            self._timestamps,
+            self._sender_ids,
+            self._kinds,
+            self._offsets,
+            bytes(self._text),
+            self.senders,
+        )
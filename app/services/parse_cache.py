@@ -0,0 +1,208 @@
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+import threading
+from array import array
+from typing import BinaryIO, Dict, Optional
+
+from app.services.message_table import MessageTable
+
+
+def hash_upload(stream: BinaryIO, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 of the raw upload bytes; the stream is rewound afterwards."""
+
+    digest = hashlib.sha256()
+
+    for chunk in iter(lambda: stream.read(chunk_size), b""):
+        digest.update(chunk)
+
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+class ParseCache:
+    """
+    Content-addressed cache of parse results, one file per upload hash.
+
+    Entry layout (native byte order, recorded in the header):
+
+        magic                8 bytes
+        count, header, text  3 x uint64
+        header               JSON (participants, senders, meta), padded to 8
+        timestamps           int64  x count
+        offsets              int64  x count + 1
+        sender_ids           int32  x count
+        kinds                uint8  x count
+        text                 UTF-8 blob
+
+    get() mmaps the file and hands MessageTable memoryviews over it, so a
+    hit costs a header read rather than a parse. Least recently used
+    entries (by mtime, refreshed on every hit) are evicted once the
+    directory grows past ``max_bytes``.
+    """
+
+    MAGIC = b"WAPC\x00\x00\x00\x01"
+    SIZES = struct.Struct("<QQQ")
+
+    KEY_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+    def __init__(self, directory: Optional[str] = None, max_bytes: int = 512 * 1024 * 1024):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), "chat-parse-cache")
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    def get(self, key: str) -> Optional[Dict]:
+
+        if not self.KEY_PATTERN.fullmatch(key):
+            return None
+
+        path = self._path(key)
+
+        try:
+            with open(path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            # ValueError: empty file
+            return None
+
+        try:
+            parsed = self._load(memoryview(mapped))
+        except (ValueError, TypeError, KeyError, struct.error):
+            # Truncated or foreign file
+            parsed = None
+
+        if parsed is None:
+            self._remove(path)
+            return None
+
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+        return parsed
+
+    def put(self, key: str, parsed: Dict) -> None:
+
+        messages = parsed.get("messages", [])
+        if not isinstance(messages, MessageTable):
+            messages = MessageTable.from_messages(messages, parsed.get("senders", []))
+
+        header = json.dumps(
+            {
+                "byteorder": sys.byteorder,
+                "participants": parsed.get("participants", []),
+                "senders": messages.senders,
+                "meta": parsed.get("meta", {}),
+                "sorted": bool(parsed.get("sorted")),
+            }
+        ).encode("utf-8")
+        header += b"\0" * (-len(header) % 8)
+
+        fd, tmp_path = tempfile.mkstemp(prefix=".entry-", dir=self.directory)
+
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(self.MAGIC)
+                f.write(self.SIZES.pack(len(messages), len(header), len(messages.text)))
+                f.write(header)
+
+                for column, typecode in (
+                    (messages.timestamps, "q"),
+                    (messages.offsets, "q"),
+                    (messages.sender_ids, "i"),
+                    (messages.kinds, "B"),
+                ):
+                    f.write(_as_bytes(column, typecode))
+
+                f.write(messages.text)
+
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            self._remove(tmp_path)
+            return
+
+        self.evict()
+
+    def evict(self) -> None:
+
+        with self._lock:
+            entries = []
+
+            for entry in os.scandir(self.directory):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total = sum(size for _, size, _ in entries)
+
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+
+    def _load(self, buffer: memoryview) -> Optional[Dict]:
+
+        if buffer[: len(self.MAGIC)] != self.MAGIC:
+            return None
+
+        position = len(self.MAGIC)
+        count, header_size, text_size = self.SIZES.unpack_from(buffer, position)
+        position += self.SIZES.size
+
+        header = json.loads(bytes(buffer[position : position + header_size]).rstrip(b"\0"))
+        position += header_size
+
+        if header["byteorder"] != sys.byteorder:
+            return None
+
+        columns = []
+        for typecode, length in (("q", count), ("q", count + 1), ("i", count), ("B", count)):
+            size = array(typecode).itemsize * length
+            columns.append(buffer[position : position + size].cast(typecode))
+            position += size
+
+        if len(buffer) != position + text_size:
+            return None
+
+        timestamps, offsets, sender_ids, kinds = columns
+        text = buffer[position:]
+
+        return {
+            "participants": header["participants"],
+            "senders": header["senders"],
+            "messages": MessageTable(
+                timestamps, sender_ids, kinds, offsets, text, header["senders"]
+            ),
+            "sorted": header["sorted"],
+            "meta": header["meta"],
+        }
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.chat")
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _as_bytes(column, typecode: str):
+
+    # arrays from the builder / memoryviews from a cache hit are written as is
+    if getattr(column, "typecode", getattr(column, "format", None)) == typecode:
+        return column
+
+    return array(typecode, column)
@@ -1,6 +1,18 @@
+import codecs
+import heapq
+import os
 import re
+from concurrent.futures import Executor, ProcessPoolExecutor
 from datetime import datetime
-from typing import Dict
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from app.services.message_table import (
+    Message,
+    MessageKind,
+    MessageTable,
+    MessageTableBuilder,
+    sort_messages,
+)
 
 
 class WhatsAppParser:
@@ -10,114 +22,888 @@ class WhatsAppParser:
         re.IGNORECASE,
     )
 
+    # Android writes group events as dated lines with no "sender: " part
+    ANDROID_EVENT_PATTERN = re.compile(
+        r"^(\d{1,2}/\d{1,2}/\d{2,4}),\s+(\d{1,2}:\d{2}\s?[ap]m)\s-\s(.*)",
+        re.IGNORECASE,
+    )
+
     IOS_PATTERN = re.compile(
         r"^\[(\d{1,2}/\d{1,2}/\d{2,4}),\s+(\d{1,2}:\d{2}:\d{2}\s?[APMapm]{2})\]\s(.*?):\s(.*)"
     )
 
-    SYSTEM_MESSAGE_KEYWORDS = [
-        "added",
-        "removed",
-        "changed",
-        "created group",
-        "missed voice call",
-        "video call",
-        "joined using",
-        "left",
-        "security code",
-        "encrypted",
-    ]
+    # One alternation per category, anchored at the start of the message
+    # text so a message costs a single match() call. iOS prefixes system
+    # lines with U+200E, which keeps "I left early", "added you on Insta"
+    # or "Video call, see you at 5" from being mistaken for one; without
+    # it only WhatsApp's exact full-line wording counts. Header-less
+    # Android events are matched as if prefixed (see ParseState.feed_line).
+    SYSTEM_MESSAGE_PATTERN = re.compile(
+        r"(?P<encryption>\u200emessages (?:and calls )?(?:to this group )?are (?:now )?"
+        r"(?:end-to-end encrypted|secured with end-to-end encryption)"
+        r"|messages (?:and calls )?are end-to-end encrypted\. no one outside of this chat, "
+        r"not even whatsapp, can read or listen to them\.(?: tap to learn more\.)?$"
+        r"|messages to this group are now secured with end-to-end encryption\. "
+        r"tap for more info\.$)"
+        r"|(?P<security_code>(?:\u200e.+'s|\u200e?your) security code (?:with .+ )?changed)"
+        r"|(?P<call>\u200e(?:missed )?(?:group )?(?:voice|video) call(?:,.*)?$"
+        r"|missed (?:group )?(?:voice|video) call$)"
+        r"|(?P<membership>\u200e.+ (?:added .+|removed .+|left"
+        r"|joined using this group's invite link|was added|was removed)$)"
+        r"|(?P<group_settings>\u200e.+ (?:created group .+|changed the subject .+"
+        r"|changed this group's icon|deleted this group's icon"
+        r"|changed the group description|deleted the group description"
+        r"|changed (?:this group's|the group) settings.*"
+        r"|changed their phone number.*)$)",
+        re.IGNORECASE,
+    )
 
-    def parse(self, file_content: str) -> Dict:
+    # Whole-message placeholders WhatsApp writes instead of content
+    MEDIA_PATTERN = re.compile(
+        r"\u200e?(?:<media omitted>"
+        r"|(?:image|video|audio|sticker|gif|document|contact card) omitted"
+        r"|<attached: [^>]+>"
+        r"|.+ \(file attached\))$",
+        re.IGNORECASE,
+    )
 
-        file_content = file_content.replace("\u202f", " ")
-        file_content = file_content.replace("\u00a0", " ")
+    DELETED_PATTERN = re.compile(
+        r"\u200e?(?:this message was deleted|you deleted this message)\.?$",
+        re.IGNORECASE,
+    )
 
-        lines = file_content.splitlines()
+    EDITED_MARKER = "<This message was edited>"
 
-        messages = []
-        participants = set()
+    LINK_PATTERN = re.compile(r"https?://|www\.", re.IGNORECASE)
 
-        current_message = None
-        skipped_lines = 0
+    DIALECT_PATTERNS = {
+        "android": ANDROID_PATTERN,
+        "ios": IOS_PATTERN,
+    }
 
-        for line in lines:
+    # Bytes pulled from an upload stream per read in parse_stream()
+    CHUNK_SIZE = 64 * 1024
 
-            line = line.strip()
-            if not line:
-                continue
+    # Below this size process start-up costs more than parallel parsing saves
+    PARALLEL_MIN_BYTES = 8 * 1024 * 1024
+
+    def parse(self, file_content: str, columnar: bool = False) -> Dict:
+
+        state = ParseState(self)
+
+        for line in file_content.splitlines():
+            state.feed_line(line)
 
-            android_match = self.ANDROID_PATTERN.match(line)
-            ios_match = self.IOS_PATTERN.match(line)
+        state.close()
+        messages = state.drain()
 
-            if android_match:
-                parsed = self._extract(android_match)
-            elif ios_match:
-                parsed = self._extract(ios_match)
-            else:
-                if current_message:
-                    current_message["text"] += "\n" + line
-                continue
+        if columnar:
+            messages = MessageTable.from_messages(messages, state.senders)
 
-            if not parsed:
-                skipped_lines += 1
-                continue
+        return state.result(messages)
 
-            timestamp, sender, text = parsed
+    def parse_stream(
+        self,
+        stream: BinaryIO,
+        state: Optional["ParseState"] = None,
+        chunk_size: Optional[int] = None,
+    ) -> Iterator[Message]:
+        """
+        Yield messages one at a time from a binary stream (e.g. UploadFile.file).
 
-            # Skip system messages
-            if self._is_system_message(text):
-                continue
+        Bytes are read in fixed-size chunks and decoded incrementally, so
+        peak memory depends on the chunk size rather than the file size.
+        Pass a ParseState to read participants / meta once the stream is
+        exhausted.
+        """
+
+        state = state or ParseState(self)
+        chunk_size = chunk_size or self.CHUNK_SIZE
+
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+
+            state.feed(chunk)
+            yield from state.drain()
+
+        state.close()
+        yield from state.drain()
+
+    def parse_file(
+        self,
+        stream: BinaryIO,
+        chunk_size: Optional[int] = None,
+        columnar: bool = False,
+    ) -> Dict:
+        """
+        Parse a whole stream. With columnar=True "messages" is a MessageTable
+        built as messages arrive, so no per-message objects are retained.
+        """
+
+        state = ParseState(self)
+        messages = self.parse_stream(stream, state, chunk_size)
+
+        if columnar:
+            messages = MessageTable.from_messages(messages, state.senders)
+        else:
+            messages = list(messages)
+
+        return state.result(messages)
 
-            current_message = {
-                "timestamp": timestamp,
-                "sender": sender,
-                "text": text,
-            }
+    def parse_parallel(
+        self,
+        path: str,
+        workers: Optional[int] = None,
+        columnar: bool = False,
+        executor: Optional[Executor] = None,
+    ) -> Dict:
+        """
+        Parse the plain chat text at ``path`` across processes; output
+        matches parse_file().
 
-            messages.append(current_message)
-            participants.add(sender)
+        The file is split at line boundaries into one byte range per worker
+        and each worker reads its own range from disk. Continuation lines at
+        the start of a range are re-attached to the last message of the
+        range before it when the results are merged.
+        """
+
+        workers = workers or os.cpu_count() or 1
+
+        if workers < 2 or os.path.getsize(path) < self.PARALLEL_MIN_BYTES:
+            with open(path, "rb") as f:
+                return self.parse_file(f, columnar=columnar)
+
+        with open(path, "rb") as f:
+            # Day/month order is a whole-file decision, so settle it up front
+            date_order = self._probe_date_order(f)
+            ranges = self._split_lines(f, workers)
+
+        starts, ends = zip(*ranges)
+        paths = [path] * len(ranges)
+        orders = [date_order] * len(ranges)
+
+        if executor is not None:
+            parts = list(executor.map(_parse_chunk, paths, starts, ends, orders))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                parts = list(pool.map(_parse_chunk, paths, starts, ends, orders))
+
+        return self.merge_chunks(parts, date_order, columnar)
+
+    def _probe_date_order(self, stream: BinaryIO) -> str:
+
+        probe = ParseState(self)
+
+        while True:
+            chunk = stream.read(self.CHUNK_SIZE)
+            if not chunk:
+                break
+
+            probe.feed(chunk)
+
+            if probe.date_order:
+                return probe.date_order
+
+            probe.drain()
+
+        # Never disambiguated -> same default as ParseState.close()
+        return "dmy"
+
+    def _split_lines(self, stream: BinaryIO, parts: int) -> List[Tuple[int, int]]:
+        """[start, end) byte ranges of about 1/parts of the file, ending at line breaks."""
+
+        stream.seek(0, os.SEEK_END)
+        length = stream.tell()
+
+        ranges = []
+        size = length // parts
+        start = 0
+
+        while start < length:
+            # Finish the line that contains the cut point
+            stream.seek(start + size)
+            stream.readline()
+            end = min(stream.tell(), length)
+
+            ranges.append((start, end))
+            start = end
+
+        return ranges
+
+    def parse_range(
+        self, path: str, start: int, end: int, date_order: Optional[str] = None
+    ) -> Dict:
+        """
+        Parse bytes [start, end) of the chat text at ``path``, a range that
+        starts and ends at line breaks, into a part for merge_chunks().
+
+        Without ``date_order`` the range settles it itself; the part's
+        "date_order" is None if nothing in it could, and its timestamps
+        then assume the day-first default.
+        """
+
+        state = ParseState(self, date_order=date_order, keep_leading_lines=True)
+        builder = MessageTableBuilder(state.senders)
+
+        with open(path, "rb") as f:
+            f.seek(start)
+            state.feed(f.read(end - start))
+
+        resolved = state.date_order
+        state.close()
+
+        for msg in state.drain():
+            builder.append(msg)
 
         return {
-            "participants": sorted(list(participants)),
-            "messages": messages,
-            "meta": {
-                "total_messages_parsed": len(messages),
-                "skipped_lines": skipped_lines,
-            },
+            "table": builder.build(),
+            "date_order": resolved,
+            "leading_lines": state.leading_lines,
+            "started": state.started,
+            "last_emitted": state.last_emitted,
+            "last_raw_text": state.last_raw_text,
+            "skipped_lines": state.skipped_lines,
+            "system_messages": state.system_messages,
+            "dialect": state.dialect,
         }
 
-    def _extract(self, match):
+    def merge_chunks(self, parts: List[Dict], date_order: str, columnar: bool = False) -> Dict:
+        """One parse result from parse_range() parts of consecutive ranges, in order."""
+
+        # ---- Boundary repair ----
+        # Leading continuation lines belong to the last message started in an
+        # earlier chunk (or to nothing, if that message was dropped).
+        extra_lines = [[] for _ in parts]
+        target = None
+
+        for index, part in enumerate(parts):
+            if target is not None:
+                extra_lines[target].extend(part["leading_lines"])
+
+            if part["started"]:
+                target = index if part["last_emitted"] else None
+
+        # ---- Concatenate, re-interning sender ids in first-seen order ----
+        state = ParseState(self, date_order=date_order)
+        builder = MessageTableBuilder(state.senders)
+        sender_ids = state._sender_ids
+
+        for index, part in enumerate(parts):
+
+            table = part["table"]
+            remap = []
+
+            for sender in table.senders:
+                if sender not in sender_ids:
+                    sender_ids[sender] = len(state.senders)
+                    state.senders.append(sender)
+                remap.append(sender_ids[sender])
+
+            if not extra_lines[index]:
+                builder.extend(table, remap)
+            else:
+                # Text of the last row grew across the boundary -> classify it again
+                last = len(table) - 1
+                builder.extend(table, remap, last)
+
+                full_text = "\n".join([part["last_raw_text"]] + extra_lines[index])
+                kind, full_text = self._classify(full_text)
+
+                builder.append_raw(
+                    table.timestamps[last],
+                    remap[table.sender_ids[last]],
+                    full_text.encode("utf-8"),
+                    kind,
+                )
+
+            state.skipped_lines += part["skipped_lines"]
+
+            for category, count in part["system_messages"].items():
+                state.system_messages[category] = (
+                    state.system_messages.get(category, 0) + count
+                )
+
+            if part["dialect"] and part["dialect"] != state.dialect:
+                state._lock_dialect(part["dialect"])
+
+        messages = builder.build()
+
+        if not columnar:
+            messages = list(messages)
+
+        return state.result(messages)
+
+    def parse_merged(self, streams: List[BinaryIO], columnar: bool = False) -> Dict:
+        """
+        Parse several exports of the same chat into one deduplicated timeline.
+
+        Each export is parsed into a compact MessageTable and put in
+        timestamp order first -- exports with clock jumps aren't
+        chronological, and the merge below only compares heads -- then the
+        tables are k-way merged on timestamp. A message is dropped when
+        another export already supplied the same (timestamp, sender, text);
+        repeats within one export are kept.
+        """
+
+        states = [ParseState(self) for _ in streams]
+        tables = [
+            MessageTable.from_messages(self.parse_stream(stream, state), state.senders).sorted()
+            for stream, state in zip(streams, states)
+        ]
+
+        state = ParseState(self)
+        stats = {"duplicates": 0}
+        messages = self._dedupe_merged(tables, state, stats)
+
+        if not columnar:
+            messages = list(messages)
+
+        # ---- Combine per-export meta ----
+        for source in states:
+            state.skipped_lines += source.skipped_lines
+
+            for category, count in source.system_messages.items():
+                state.system_messages[category] = (
+                    state.system_messages.get(category, 0) + count
+                )
+
+            if source.dialect and source.dialect != state.dialect:
+                state._lock_dialect(source.dialect)
+
+        date_orders = {source.date_order for source in states}
+        state.date_order = date_orders.pop() if len(date_orders) == 1 else "mixed"
+
+        parsed = state.result(messages)
+        parsed["meta"]["exports_merged"] = len(streams)
+        parsed["meta"]["duplicates_dropped"] = stats["duplicates"]
+
+        return parsed
+
+    @staticmethod
+    def _table_rows(table: MessageTable, index: int):
+        for row, epoch in enumerate(table.timestamps):
+            yield epoch, index, row
+
+    def _dedupe_merged(
+        self, tables: List[MessageTable], state: "ParseState", stats: Dict
+    ) -> MessageTable:
+
+        builder = MessageTableBuilder(state.senders)
+        sender_ids = state._sender_ids
+        current = None
+
+        # Only the current timestamp's keys are kept:
+        # key -> copies emitted, (export, key) -> copies that export had
+        emitted = {}
+        seen = {}
+
+        # Ties go to the earlier export, as in a stable merge
+        heads = heapq.merge(
+            *(self._table_rows(table, index) for index, table in enumerate(tables))
+        )
+
+        for epoch, index, row in heads:
+
+            if epoch != current:
+                current = epoch
+                emitted.clear()
+                seen.clear()
+
+            table = tables[index]
+            sender = table.senders[table.sender_ids[row]]
+            text = bytes(table.text[table.offsets[row] : table.offsets[row + 1]])
+
+            key = (sender, text)
+            copies = seen.get((index, key), 0) + 1
+            seen[(index, key)] = copies
+
+            if copies <= emitted.get(key, 0):
+                stats["duplicates"] += 1
+                continue
+
+            emitted[key] = copies
+
+            # Re-intern against the merged sender table
+            if sender not in sender_ids:
+                sender_ids[sender] = len(state.senders)
+                state.senders.append(sender)
+
+            builder.append_raw(epoch, sender_ids[sender], text, table.kinds[row])
+
+        return builder.build()
+
+    def parse_after(
+        self,
+        stream: BinaryIO,
+        since: datetime,
+        seen_at_since: int,
+        date_order: str,
+        columnar: bool = False,
+    ) -> Dict:
+        """
+        Parse only the messages a newer export of a chat added: those after
+        ``since``, plus any beyond the first ``seen_at_since`` at exactly
+        ``since``. Skipped-line and system-message counts cover the same
+        range. ``date_order`` is the one the earlier parse settled on.
+
+        Seek a plain stream to resume_offset() first to avoid decoding the
+        old history at all.
+        """
+
+        state = ParseState(
+            self, date_order=date_order, since=since, seen_at_since=seen_at_since
+        )
+        messages = self.parse_stream(stream, state)
+
+        if columnar:
+            messages = MessageTable.from_messages(messages, state.senders)
+        else:
+            messages = list(messages)
+
+        return state.result(messages)
+
+    def resume_offset(self, stream: BinaryIO, since: datetime, date_order: str) -> int:
+        """
+        Byte offset of a header line older than ``since`` (or 0) with no
+        message at or after ``since`` before it, found by bisecting a
+        seekable plain export on its header timestamps. Assumes the export
+        is chronological, as WhatsApp writes it.
+        """
+
+        probe = ParseState(self, date_order=date_order)
+
+        stream.seek(0, os.SEEK_END)
+        low, high = 0, stream.tell()
+
+        while high - low > self.CHUNK_SIZE:
+            mid = (low + high) // 2
+            header = self._next_header(stream, mid, high, probe)
+
+            if header is not None and header[1] < since:
+                low = header[0]
+            else:
+                high = mid
+
+        stream.seek(0)
+        return low
+
+    def _next_header(self, stream: BinaryIO, start: int, end: int, probe: "ParseState"):
+        """(offset, timestamp) of the first dated header line starting in [start, end)."""
+
+        stream.seek(start)
+        # Mid-line start -> the line belongs to the header search before us
+        stream.readline()
+        offset = stream.tell()
+
+        while offset < end:
+            line = stream.readline()
+            if not line:
+                break
+
+            text = line.decode("utf-8", errors="replace")
+            text = text.replace("\u202f", " ").replace("\u00a0", " ").strip()
+            match = probe._match_header(text) if text else None
+
+            if match:
+                timestamp = probe._decode_timestamp(match.group(1), match.group(2))
+                if timestamp is not None:
+                    return offset, timestamp
+
+            offset += len(line)
+
+        return None
+
+    def _date_components(self, date_str: str):
+
+        # "d/m/yy" or "m/d/yyyy" -> (first, second, year) as ints
+        first, second, year = date_str.split("/")
+
+        if len(year) == 2:
+            # Same pivot as strptime's %y
+            year = int(year)
+            year += 2000 if year < 69 else 1900
+        elif len(year) == 4:
+            year = int(year)
+        else:
+            return None
+
+        return int(first), int(second), year
+
+    def _parse_date(self, date_str: str, day_first: bool):
+
+        components = self._date_components(date_str)
+        if not components:
+            return None
+
+        first, second, year = components
+        day, month = (first, second) if day_first else (second, first)
 
         try:
-            timestamp_str = f"{match.group(1)} {match.group(2)}"
-            sender = match.group(3).strip()
-            text = match.group(4).strip()
+            return datetime(year, month, day)
+        except ValueError:
+            return None
 
-            timestamp = self._parse_datetime(timestamp_str)
+    def _parse_datetime(self, date: datetime, time_str: str) -> Optional[datetime]:
 
-            return timestamp, sender, text
+        # "10:30 pm" / "10:30pm" / "10:30:15 PM"
+        meridiem = time_str[-2:].lower()
+        clock = time_str[:-2].rstrip().split(":")
 
-        except Exception:
+        hour = int(clock[0])
+        minute = int(clock[1])
+        second = int(clock[2]) if len(clock) > 2 else 0
+
+        if not 1 <= hour <= 12 or meridiem not in ("am", "pm"):
+            return None
+
+        hour %= 12
+        if meridiem == "pm":
+            hour += 12
+
+        try:
+            return date.replace(hour=hour, minute=minute, second=second)
+        except ValueError:
             return None
 
-    def _parse_datetime(self, timestamp_str: str) -> datetime:
+    def _classify(self, text: str):
+        """Return (kind, text); edited messages lose the trailing marker."""
+
+        if self.MEDIA_PATTERN.match(text):
+            return MessageKind.MEDIA, text
+
+        if self.DELETED_PATTERN.match(text):
+            return MessageKind.DELETED, text
+
+        if text.endswith(self.EDITED_MARKER):
+            text = text[: -len(self.EDITED_MARKER)].rstrip().rstrip("\u200e").rstrip()
+            return MessageKind.EDITED, text
+
+        if self.LINK_PATTERN.search(text):
+            return MessageKind.LINK, text
+
+        return MessageKind.TEXT, text
+
+    def _system_category(self, text: str) -> Optional[str]:
+        match = self.SYSTEM_MESSAGE_PATTERN.match(text)
+        return match.lastgroup if match else None
+
+
+class ParseState:
+    """
+    Incremental state for WhatsAppParser.
+
+    Accepts raw bytes (feed) or decoded lines (feed_line). A message is only
+    handed out by drain() once the next header line (or close) proves that
+    no more continuation lines can follow it.
+    """
+
+    def __init__(
+        self,
+        parser: WhatsAppParser,
+        date_order: Optional[str] = None,
+        keep_leading_lines: bool = False,
+        since: Optional[datetime] = None,
+        seen_at_since: int = 0,
+        classify: bool = True,
+    ):
+        self.parser = parser
+        self.senders = []
+        self.skipped_lines = 0
+        self.system_messages = {}
+
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._partial_line = ""
+        self._current = None
+        self._ready = []
+
+        self.dialect = None
+        self.date_order = date_order
+
+        # Chunk mode (parse_range): remember lines seen before any message
+        # so they can be re-attached across the chunk boundary
+        self.keep_leading_lines = keep_leading_lines
+        self.leading_lines = []
+        self.started = False
+        self.last_emitted = False
+        self.last_raw_text = None
+
+        # Resume mode (parse_after): drop what an earlier upload already
+        # covered -- everything before ``since`` and the first
+        # ``seen_at_since`` messages at exactly ``since``
+        self.since = since
+        self._skip_at_since = seen_at_since
+        self._resumed = since is None
+
+        # classify=False leaves kind / text untouched (raw text, TEXT) for
+        # callers that only keep a few messages (preview sampling)
+        self.classify = classify
+
+        self._current_stamp = None
+        self._pending = []
+        self._dates = {}
+        self._sender_ids = {}
+        self._last_stamp = None
+        self._last_timestamp = None
+
+    def feed(self, data: bytes) -> None:
+
+        text = self._partial_line + self._decoder.decode(data)
+        lines = text.splitlines(keepends=True)
+
+        # Last piece has no line break yet -> wait for the next chunk
+        if lines and lines[-1].splitlines() == [lines[-1]]:
+            self._partial_line = lines.pop()
+        else:
+            self._partial_line = ""
+
+        for line in lines:
+            self.feed_line(line)
+
+    def feed_line(self, line: str) -> None:
+
+        line = line.replace("\u202f", " ").replace("\u00a0", " ").strip()
+        if not line:
+            return
+
+        match = self._match_header(line)
+
+        if not match:
+            event = self._match_event(line)
+            if event:
+                self._count_event(*event.groups())
+            elif self._current:
+                self._current.text += "\n" + line
+            elif self.keep_leading_lines and not self.started:
+                self.leading_lines.append(line)
+            return
+
+        date_str, time_str, sender, text = match.groups()
+        sender = sender.strip()
+        text = text.strip()
+
+        if self.date_order is None:
+            self._resolve_date_order(date_str)
+
+        # Skip system messages, counted per category
+        category = self.parser._system_category(text)
+        if category:
+            if self._resumed or self._after_since(date_str, time_str):
+                self.system_messages[category] = self.system_messages.get(category, 0) + 1
+            return
+
+        self._finish_current()
+
+        self._current = Message(None, sender, None, text)
+        self._current_stamp = (date_str, time_str)
+        self.started = True
+
+    def _match_event(self, line: str):
+
+        if not line[0].isdigit():
+            return None
+
+        return self.parser.ANDROID_EVENT_PATTERN.match(line)
+
+    def _count_event(self, date_str: str, time_str: str, text: str) -> None:
+
+        if self.date_order is None:
+            self._resolve_date_order(date_str)
+
+        # A dated line without a sender is a system line by position alone
+        category = self.parser._system_category("\u200e" + text.strip()) or "other"
+
+        if self._resumed or self._after_since(date_str, time_str):
+            self.system_messages[category] = self.system_messages.get(category, 0) + 1
+
+    def _match_header(self, line: str):
+
+        # Android headers start with a digit and iOS headers with "[", so the
+        # first character picks the single pattern that can match. Obvious
+        # continuation lines never reach a regex at all.
+        first = line[0]
+
+        if first == "[":
+            dialect = "ios"
+        elif first.isdigit():
+            dialect = "android"
+        else:
+            return None
+
+        match = self.parser.DIALECT_PATTERNS[dialect].match(line)
+
+        if match and dialect != self.dialect:
+            self._lock_dialect(dialect)
+
+        return match
+
+    def _lock_dialect(self, dialect: str) -> None:
+
+        if self.dialect is None:
+            # Leading header lines decide the dialect for the whole file
+            self.dialect = dialect
+        else:
+            # Chat mixes both formats (e.g. concatenated exports)
+            self.dialect = "mixed"
+
+    def _resolve_date_order(self, date_str: str) -> None:
+
+        # Any component above 12 can only be the day
+        components = self.parser._date_components(date_str)
+        if not components:
+            return
+
+        first, second, _ = components
 
-        for fmt in [
-            "%d/%m/%y %I:%M %p",
-            "%d/%m/%Y %I:%M %p",
-            "%d/%m/%y %I:%M:%S %p",
-            "%d/%m/%Y %I:%M:%S %p",
-        ]:
+        if first > 12:
+            self.date_order = "dmy"
+        elif second > 12:
+            self.date_order = "mdy"
+        else:
+            return
+
+        self._flush_pending()
+
+    def _finish_current(self) -> None:
+
+        if not self._current:
+            return
+
+        if self.date_order is None:
+            # Day/month order still ambiguous -> hold until it's known
+            self._pending.append((self._current, self._current_stamp))
+        else:
+            self._emit(self._current, self._current_stamp)
+
+        self._current = None
+        self._current_stamp = None
+
+    def _flush_pending(self) -> None:
+
+        pending, self._pending = self._pending, []
+
+        for message, stamp in pending:
+            self._emit(message, stamp)
+
+    def _emit(self, message: Message, stamp: tuple) -> None:
+
+        # Consecutive messages in the same minute share one datetime object
+        if stamp == self._last_stamp:
+            timestamp = self._last_timestamp
+        else:
+            timestamp = self._decode_timestamp(*stamp)
+            self._last_stamp = stamp
+            self._last_timestamp = timestamp
+
+        self.last_emitted = timestamp is not None
+
+        if not self._resumed and not self._is_new(timestamp):
+            return
+
+        if timestamp is None:
+            self.skipped_lines += 1
+            return
+
+        sender_id = self._sender_ids.get(message.sender)
+
+        if sender_id is None:
+            sender_id = len(self.senders)
+            self._sender_ids[message.sender] = sender_id
+            self.senders.append(message.sender)
+
+        if self.keep_leading_lines:
+            # Chunk mode: the text may still grow across the boundary
+            self.last_raw_text = message.text
+
+        message.timestamp = timestamp
+        message.sender = self.senders[sender_id]
+        message.sender_id = sender_id
+
+        if self.classify:
+            message.kind, message.text = self.parser._classify(message.text)
+
+        self._ready.append(message)
+
+    def _is_new(self, timestamp: Optional[datetime]) -> bool:
+
+        # Undated lines before the resume point were counted last time
+        if timestamp is None or timestamp < self.since:
+            return False
+
+        if timestamp == self.since and self._skip_at_since:
+            self._skip_at_since -= 1
+            return False
+
+        self._resumed = True
+        return True
+
+    def _after_since(self, date_str: str, time_str: str) -> bool:
+        timestamp = self._decode_timestamp(date_str, time_str)
+        return timestamp is not None and timestamp > self.since
+
+    def _decode_timestamp(self, date_str: str, time_str: str) -> Optional[datetime]:
+
+        # Most messages share their day with the previous one -> memoise dates
+        try:
+            date = self._dates[date_str]
+        except KeyError:
             try:
-                return datetime.strptime(timestamp_str, fmt)
+                date = self.parser._parse_date(date_str, self.date_order == "dmy")
             except ValueError:
-                continue
+                date = None
+            self._dates[date_str] = date
+
+        if date is None:
+            return None
+
+        try:
+            return self.parser._parse_datetime(date, time_str)
+        except ValueError:
+            return None
+
+    def close(self) -> None:
+
+        tail = self._partial_line + self._decoder.decode(b"", final=True)
+        self._partial_line = ""
+
+        for line in tail.splitlines():
+            self.feed_line(line)
+
+        self._finish_current()
+
+        if self.date_order is None:
+            # Never disambiguated -> keep the historical day-first reading
+            self.date_order = "dmy"
+            self._flush_pending()
+
+    def drain(self) -> List[Message]:
+        ready, self._ready = self._ready, []
+        return ready
+
+    def result(self, messages) -> Dict:
+
+        # Engines trust "sorted" and skip their own sort + copy
+        messages = sort_messages(messages)
+
+        return {
+            "participants": sorted(self.senders),
+            "senders": list(self.senders),
+            "messages": messages,
+            "sorted": True,
+            "meta": {
+                "total_messages_parsed": len(messages),
+                "skipped_lines": self.skipped_lines,
+                "system_messages_dropped": dict(self.system_messages),
+                "dialect": self.dialect or "unknown",
+                "date_order": self.date_order,
+            },
+        }
 
-        return None  # safer than raising error
 
-    def _is_system_message(self, text: str) -> bool:
-        lower = text.lower()
-        return any(keyword in lower for keyword in self.SYSTEM_MESSAGE_KEYWORDS)
+def _parse_chunk(path: str, start: int, end: int, date_order: str) -> Dict:
+    """Worker for WhatsAppParser.parse_parallel (module level so it pickles)."""
+    return WhatsAppParser().parse_range(path, start, end, date_order)
 
 
 # import re
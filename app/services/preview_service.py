@@ -0,0 +1,904 @@
+import io
+import itertools
+import math
+import os
+import random
+import statistics
+from collections import Counter, defaultdict
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from app.engines.message_scan import BLOCK_SIZE
+from app.services.message_table import (
+    NON_TEXT_KINDS,
+    MessageTable,
+    MessageTableBuilder,
+    sort_messages,
+    to_epoch,
+    unsorted_from,
+)
+from app.services.parser_service import ParseState
+
+
+# Sampling strata: sender x week (epoch seconds // WEEK)
+WEEK = 7 * 86400
+
+# Metrics whose per-sender sampling error is reported
+ERROR_METRICS = (
+    "question_ratio",
+    "exclamation_ratio",
+    "emoji_density",
+    "night_activity_ratio",
+    "avg_message_length",
+)
+
+# Bounded work: past 2 * FRAME_FACTOR * budget messages a chat is only
+# read in segments of SEGMENT_MESSAGES messages, one at the start of each
+# of FRAME_FACTOR * budget / SEGMENT_MESSAGES equal stretches (plus the
+# chat's tail), and the sample is drawn from those (the frame, see
+# _expand_frame())
+FRAME_FACTOR = 2
+SEGMENT_MESSAGES = 64
+
+# Leading bytes of a file parsed to size its messages; also the width a
+# window's byte offsets are bisected down to
+PROBE_BYTES = 64 * 1024
+
+# Evenly spaced probes for a date order the first one couldn't settle
+DATE_ORDER_PROBES = 16
+
+
+def allocate(population: Counter, budget: int) -> Dict:
+    """
+    Rows to sample per stratum: at most ``budget`` in total, and every
+    stratum in the sample (``sample size`` may reach the budget, never
+    exceed it).
+
+    With fewer strata than the budget each gets one row and the rest is
+    split in proportion to stratum size by largest remainder. With more,
+    one row goes to each of the ``budget`` largest strata -- each sender's
+    largest stratum first, so senders outlast their small weeks -- and the
+    smallest strata are dropped.
+    """
+
+    total = sum(population.values())
+
+    if total <= budget:
+        return dict(population)
+
+    if len(population) >= budget:
+        by_size = sorted(population, key=lambda stratum: (-population[stratum], stratum))
+
+        leaders = {}
+        for stratum in by_size:
+            leaders.setdefault(stratum[0], stratum)
+
+        chosen = list(leaders.values())[:budget]
+        taken = set(chosen)
+        chosen.extend(stratum for stratum in by_size if stratum not in taken)
+
+        return {stratum: 1 for stratum in chosen[:budget]}
+
+    # One each, then the remainder in proportion to what's left per stratum
+    remaining = budget - len(population)
+    spare = total - len(population)
+
+    quotas = {stratum: remaining * (size - 1) / spare for stratum, size in population.items()}
+    capacity = {stratum: 1 + int(quota) for stratum, quota in quotas.items()}
+
+    left = budget - sum(capacity.values())
+    by_remainder = sorted(
+        quotas, key=lambda stratum: (-(quotas[stratum] - int(quotas[stratum])), stratum)
+    )
+
+    for stratum in by_remainder[:left]:
+        capacity[stratum] += 1
+
+    return capacity
+
+
+def stratified_sample(
+    table: MessageTable,
+    budget: int,
+    rnd: random.Random,
+    ranges: Optional[List[Tuple[int, int]]] = None,
+) -> Tuple[List[int], Counter, Dict]:
+    """
+    Row indices of a sample of at most ``budget`` messages, reservoir-sampled
+    per (sender id, week) stratum as allocate() shares the budget out.
+    ``ranges`` ([start, end) rows) limits it to those rows. Returns (sorted
+    rows, stratum sizes, sample sizes). Only the integer columns are read.
+    """
+
+    sender_ids = table.sender_ids
+    timestamps = table.timestamps
+
+    def strata():
+        for start, end in ranges or [(0, len(table))]:
+            for row in range(start, end):
+                yield row, (sender_ids[row], timestamps[row] // WEEK)
+
+    population = Counter(stratum for _, stratum in strata())
+
+    capacity = allocate(population, budget)
+
+    seen = dict.fromkeys(capacity, 0)
+    reservoirs = {stratum: [] for stratum in capacity}
+
+    for row, stratum in strata():
+        size = capacity.get(stratum)
+        if size is None:
+            continue
+
+        count = seen[stratum] + 1
+        seen[stratum] = count
+
+        if count <= size:
+            reservoirs[stratum].append(row)
+        elif rnd.random() * count < size:
+            # Algorithm R: keep row with probability size / count
+            reservoirs[stratum][rnd.randrange(size)] = row
+
+    rows = sorted(row for reservoir in reservoirs.values() for row in reservoir)
+
+    return rows, population, capacity
+
+
+def sample_stream(
+    stream: BinaryIO,
+    parser,
+    budget: int,
+    rnd: random.Random,
+    window: Optional[Tuple[Optional[int], Optional[int]]] = None,
+    date_order: Optional[str] = None,
+) -> Tuple[dict, List[int], MessageTable, Counter, Dict]:
+    """
+    stratified_sample() taken while a raw export is parsed, so the full
+    parse is never built: every message leaves its timestamp and sender id,
+    but only candidates keep their text, and only the sample is classified.
+
+    Each message draws a random key; a stratum's sample is its lowest keys.
+    Candidates are the (at least) ``2 * budget`` lowest keys overall plus
+    the lowest of each stratum, which hold every stratum's sample unless
+    its share of the low keys happens to fall short (then the sample is
+    that much smaller), so text is held for O(budget + strata) messages.
+    ``window`` (epoch seconds, None = open) drops messages outside
+    [start, end); ``date_order`` is for a stream that starts mid-chat.
+
+    Returns (parsed, rows, sample, stratum sizes, sample sizes): parsed
+    carries a text-less table of every message, rows index the sampled
+    ones in it and sample holds those rows with their text.
+    """
+
+    state = ParseState(parser, date_order=date_order, classify=False)
+    builder = MessageTableBuilder(state.senders)
+
+    start, end = window or (None, None)
+
+    limit = 2 * budget
+    threshold = 1.0
+    stratum_min = {}
+    candidates = {}
+
+    row = -1
+    last_timestamp = None
+
+    for msg in parser.parse_stream(stream, state):
+        # The parser shares datetime objects between same-minute messages
+        if msg.timestamp is not last_timestamp:
+            last_timestamp = msg.timestamp
+            timestamp = to_epoch(last_timestamp)
+
+        if (start is not None and timestamp < start) or (end is not None and timestamp >= end):
+            continue
+
+        row += 1
+        builder.append_raw(timestamp, msg.sender_id, b"", 0)
+
+        key = rnd.random()
+        stratum = (msg.sender_id, timestamp // WEEK)
+
+        best = stratum_min.get(stratum)
+        if best is None or key < best[0]:
+            stratum_min[stratum] = (key, row, msg.text)
+
+        if key < threshold:
+            candidates[row] = (key, msg.text)
+
+            if len(candidates) > 2 * limit:
+                # Keep the lowest ``limit`` keys; later rows must beat them
+                threshold = sorted(key for key, _ in candidates.values())[limit]
+                candidates = {
+                    row: candidate for row, candidate in candidates.items() if candidate[0] < threshold
+                }
+
+    for key, row, text in stratum_min.values():
+        candidates[row] = (key, text)
+
+    table = builder.build()
+
+    # Exports are chronological bar the odd clock jump; candidates follow
+    # their rows through the sort (as MessageTable.sorted() orders them)
+    timestamps = table.timestamps
+    first = unsorted_from(timestamps)
+    if first < len(table):
+        order = sorted(range(first, len(table)), key=timestamps.__getitem__)
+        moved = {row: candidates.pop(row) for row in order if row in candidates}
+        for index, row in enumerate(order, first):
+            if row in moved:
+                candidates[index] = moved[row]
+
+        table = table.take(itertools.chain(range(first), order))
+
+    parsed = state.result(table)
+    population = Counter(zip(table.sender_ids, (timestamp // WEEK for timestamp in table.timestamps)))
+    capacity = allocate(population, budget)
+
+    by_stratum = defaultdict(list)
+    for row, (key, _) in candidates.items():
+        stratum = (table.sender_ids[row], table.timestamps[row] // WEEK)
+        if stratum in capacity:
+            by_stratum[stratum].append((key, row))
+
+    rows = []
+    sampled = {}
+    for stratum, keyed in by_stratum.items():
+        keyed.sort()
+        chosen = [row for _, row in keyed[: capacity[stratum]]]
+        rows.extend(chosen)
+        sampled[stratum] = len(chosen)
+
+    rows.sort()
+
+    sample = MessageTableBuilder(table.senders)
+    for row in rows:
+        kind, text = parser._classify(candidates[row][1])
+        sample.append_raw(table.timestamps[row], table.sender_ids[row], text.encode("utf-8"), kind)
+
+    if window is not None:
+        parsed["participants"] = sorted({table.senders[sender_id] for sender_id in set(table.sender_ids)})
+        parsed["window"] = (start, end)
+
+    return parsed, rows, sample.build(), population, sampled
+
+
+def preview_scan(
+    parsed_data: dict, analysis_service, budget: int, seed: Optional[int] = None
+) -> Tuple[dict, dict, dict]:
+    """
+    Message scan of a stratified sample of a parsed chat, expanded to
+    whole-chat estimates. Returns (sample parse, scan, report) for
+    AnalysisService.run(scan=...); see preview_file() for raw exports.
+
+    Chats past 2 * FRAME_FACTOR * budget messages are sampled from a frame
+    of row segments, so the work doesn't grow with them.
+    """
+
+    messages = parsed_data.get("messages", [])
+    if not isinstance(messages, MessageTable):
+        messages = MessageTable.from_messages(messages, parsed_data.get("senders", []))
+    elif not parsed_data.get("sorted"):
+        messages = sort_messages(messages)
+
+    rnd = random.Random(seed)
+
+    if len(messages) > 2 * FRAME_FACTOR * budget:
+        tail = len(messages) - SEGMENT_MESSAGES
+        segments = []
+
+        for low, high in _stretches(0, tail, _segment_count(budget)):
+            end = min(low + SEGMENT_MESSAGES, high)
+            segments.append((low, end, (high - low) / (end - low)))
+
+        segments.append((tail, len(messages), 1.0))
+
+        return _expand_frame(parsed_data, messages, segments, budget, rnd, analysis_service)
+
+    rows, population, sampled = stratified_sample(messages, budget, rnd)
+
+    return _expand_sample(
+        parsed_data, messages, rows, messages.take(rows), population, sampled, analysis_service
+    )
+
+
+def preview_stream(
+    stream: BinaryIO,
+    parser,
+    analysis_service,
+    budget: int,
+    window: Optional[Tuple[Optional[int], Optional[int]]] = None,
+    seed: Optional[int] = None,
+    date_order: Optional[str] = None,
+) -> Tuple[dict, Optional[dict], Optional[dict]]:
+    """
+    preview_scan() of a raw export, sampled as it's parsed (sample_stream()).
+    Every message is parsed: preview_file() only streams chats that are
+    small enough for that.
+
+    A chat of at most ``budget`` messages is sampled whole; then the
+    result is (its complete parse, None, None) for an exact analysis.
+    """
+
+    rnd = random.Random(seed)
+    parsed, rows, sample, population, sampled = sample_stream(
+        stream, parser, budget, rnd, window, date_order
+    )
+
+    if len(rows) == len(parsed["messages"]):
+        parsed["messages"] = sample
+        parsed["meta"]["total_messages_parsed"] = len(sample)
+        return parsed, None, None
+
+    return _expand_sample(
+        parsed, parsed["messages"], rows, sample, population, sampled, analysis_service
+    )
+
+
+def preview_file(
+    path: str,
+    parser,
+    analysis_service,
+    budget: int,
+    window: Optional[Tuple[Optional[int], Optional[int]]] = None,
+    seed: Optional[int] = None,
+) -> Tuple[dict, Optional[dict], Optional[dict]]:
+    """
+    preview_stream() of the plain chat text at ``path`` (a spooled upload)
+    in work bounded by ``budget``, not by the chat.
+
+    The first PROBE_BYTES size the chat's messages. Up to 2 * FRAME_FACTOR
+    * budget messages (or as many in ``window``, whose byte offsets are
+    bisected for) are streamed whole. Past that only a frame is parsed:
+    line-aligned byte segments of about SEGMENT_MESSAGES messages, one at
+    the start of each equal stretch -- exports are chronological, so
+    stretches of bytes are stretches of the timeline -- each standing for
+    its stretch (see _expand_frame()), and one for the chat's last bytes.
+    """
+
+    rnd = random.Random(seed)
+    size = os.path.getsize(path)
+
+    with open(path, "rb") as f:
+        probe_end = _line_start(f, min(PROBE_BYTES, size))
+        probe = parser.parse_range(path, 0, probe_end)
+
+        message_bytes = max(probe_end, 1) / max(len(probe["table"]), 1)
+        limit = 2 * FRAME_FACTOR * budget * message_bytes
+
+        start, end = 0, size
+        date_order = None
+
+        if size > limit:
+            date_order = _date_order(parser, path, f, size, probe)
+            if window is not None:
+                start, end = _byte_window(parser, path, f, size, window, date_order)
+
+        if end - start <= limit:
+            f.seek(start)
+            stream = f if end == size else io.BytesIO(f.read(end - start))
+            return preview_stream(stream, parser, analysis_service, budget, window, seed, date_order)
+
+        length = int(SEGMENT_MESSAGES * message_bytes)
+        tail = _line_start(f, end - length)
+        spans = []
+
+        for low, high in _stretches(start, tail, _segment_count(budget)):
+            first = _line_start(f, low)
+            last = _line_start(f, min(first + length, high))
+            if first < last:
+                spans.append((first, last, (high - low) / (last - first)))
+
+        # The tail stands for itself: the chat's last messages are exact
+        if tail < end:
+            spans.append((tail, end, 1.0))
+
+    parsed, segments = _read_frame(parser, path, spans, date_order, window)
+
+    return _expand_frame(parsed, parsed["messages"], segments, budget, rnd, analysis_service)
+
+
+def _segment_count(budget: int) -> int:
+    return max(1, math.ceil(FRAME_FACTOR * budget / SEGMENT_MESSAGES))
+
+
+def _stretches(start: int, end: int, count: int) -> Iterator[Tuple[int, int]]:
+    """``count`` equal [low, high) stretches of [start, end), rows or bytes."""
+
+    step = (end - start) / count
+
+    for index in range(count):
+        low = start + int(index * step)
+        high = start + int((index + 1) * step)
+
+        if low < high:
+            yield low, high
+
+
+def _line_start(f: BinaryIO, offset: int) -> int:
+    """First line start at or after ``offset``."""
+
+    if offset <= 0:
+        return 0
+
+    f.seek(offset - 1)
+    f.readline()
+
+    return f.tell()
+
+
+def _date_order(parser, path: str, f: BinaryIO, size: int, probe: dict) -> str:
+    """
+    The chat's day/month order, from evenly spaced probes when the first
+    one couldn't settle it; the parser's day-first default if none can.
+    """
+
+    if probe["date_order"]:
+        return probe["date_order"]
+
+    for index in range(1, DATE_ORDER_PROBES):
+        start = _line_start(f, size * index // DATE_ORDER_PROBES)
+        date_order = parser.parse_range(path, start, _line_start(f, start + PROBE_BYTES))["date_order"]
+        if date_order:
+            return date_order
+
+    return "dmy"
+
+
+def _byte_window(
+    parser,
+    path: str,
+    f: BinaryIO,
+    size: int,
+    window: Tuple[Optional[int], Optional[int]],
+    date_order: str,
+) -> Tuple[int, int]:
+    """Line-aligned byte range holding ``window``'s messages (and a few around it)."""
+
+    start, end = window
+
+    low = 0 if start is None else _bisect_bytes(parser, path, f, size, start, date_order)[0]
+    high = size if end is None else _bisect_bytes(parser, path, f, size, end, date_order)[1]
+
+    return low, max(low, high)
+
+
+def _bisect_bytes(
+    parser, path: str, f: BinaryIO, size: int, epoch: int, date_order: str
+) -> Tuple[int, int]:
+    """
+    [low, high) line-aligned bytes, at most about PROBE_BYTES wide, in
+    which the chat's first message at or after ``epoch`` starts.
+    """
+
+    low, high = 0, size
+
+    while high - low > PROBE_BYTES:
+        middle = _line_start(f, (low + high) // 2)
+        if middle >= high:
+            break
+
+        timestamp = _timestamp_at(parser, path, f, middle, high, date_order)
+
+        # No message starts in [middle, high) at all: nothing to find there
+        if timestamp is None or timestamp >= epoch:
+            high = middle
+        else:
+            low = middle
+
+    return low, high
+
+
+def _timestamp_at(
+    parser, path: str, f: BinaryIO, offset: int, limit: int, date_order: str
+) -> Optional[int]:
+    """Epoch seconds of the first message starting in [offset, limit), if any."""
+
+    length = 4096
+
+    while True:
+        end = min(_line_start(f, offset + length), limit)
+        table = parser.parse_range(path, offset, end, date_order)["table"]
+
+        if len(table):
+            return table.timestamps[0]
+        if end >= limit:
+            return None
+
+        # A long multi-line message: look further
+        length *= 4
+
+
+def _read_frame(
+    parser,
+    path: str,
+    spans: List[Tuple[int, int, float]],
+    date_order: str,
+    window: Optional[Tuple[Optional[int], Optional[int]]],
+) -> Tuple[dict, List[Tuple[int, int, float]]]:
+    """
+    Parse of the byte ``spans`` (start, end, weight) of a chat, one after
+    the other, and their rows in it as segments (start, end, weight).
+    Counts that don't come per row (system messages, skipped lines) are
+    weighted as they're summed.
+    """
+
+    sender_ids = {}
+    senders = []
+    builder = MessageTableBuilder(senders)
+
+    segments = []
+    rows = 0
+    skipped_lines = 0.0
+    system_messages = defaultdict(float)
+    dialects = set()
+
+    since, until = window or (None, None)
+
+    for first, last, weight in spans:
+        part = parser.parse_range(path, first, last, date_order)
+
+        table = part["table"].sorted()
+        if window is not None:
+            table = table.take(
+                row
+                for row, timestamp in enumerate(table.timestamps)
+                if (since is None or timestamp >= since) and (until is None or timestamp < until)
+            )
+
+        remap = []
+        for sender in table.senders:
+            if sender not in sender_ids:
+                sender_ids[sender] = len(senders)
+                senders.append(sender)
+            remap.append(sender_ids[sender])
+
+        builder.extend(table, remap)
+
+        if len(table):
+            segments.append((rows, rows + len(table), weight))
+            rows += len(table)
+
+        skipped_lines += part["skipped_lines"] * weight
+        for category, count in part["system_messages"].items():
+            system_messages[category] += count * weight
+
+        if part["dialect"]:
+            dialects.add(part["dialect"])
+
+    if len(dialects) > 1:
+        dialect = "mixed"
+    else:
+        dialect = dialects.pop() if dialects else "unknown"
+
+    parsed = {
+        "participants": sorted(senders),
+        "senders": senders,
+        "messages": builder.build(),
+        "meta": {
+            "total_messages_parsed": round(sum((end - start) * weight for start, end, weight in segments)),
+            "skipped_lines": round(skipped_lines),
+            "system_messages_dropped": {
+                category: round(count) for category, count in system_messages.items()
+            },
+            "dialect": dialect,
+            "date_order": date_order,
+        },
+    }
+
+    if window is not None:
+        parsed["window"] = window
+
+    return parsed, segments
+
+
+def _expand_frame(
+    parsed_data: dict,
+    frame: MessageTable,
+    segments: List[Tuple[int, int, float]],
+    budget: int,
+    rnd: random.Random,
+    analysis_service,
+) -> Tuple[dict, dict, dict]:
+    """
+    _expand_sample() of a stratified sample of a frame: ``segments``
+    ([start, end) rows of ``frame``, weight) each stand for ``weight``
+    times as many messages of the chat, so stratum sizes are weighted
+    sums. Rows are drawn only where their neighbours are in the same
+    segment: not a segment's first row (no reply delay to take) nor its
+    last few (no engagement forward window).
+    """
+
+    context = analysis_service.engagement_engine.accumulator().forward_message_check + 1
+    ranges = [(start + 1, end - context + 1) for start, end, _ in segments if end - start > context]
+
+    rows, _, sampled = stratified_sample(frame, budget, rnd, ranges)
+
+    sizes = defaultdict(float)
+    for start, end, weight in segments:
+        for row in range(start, end):
+            sizes[(frame.sender_ids[row], frame.timestamps[row] // WEEK)] += weight
+
+    population = Counter({stratum: round(size) for stratum, size in sizes.items()})
+
+    return _expand_sample(
+        parsed_data,
+        frame,
+        rows,
+        frame.take(rows).sorted(),
+        population,
+        sampled,
+        analysis_service,
+        segments,
+    )
+
+
+def _expand_sample(
+    parsed_data: dict,
+    messages: MessageTable,
+    rows: List[int],
+    sample: MessageTable,
+    population: Counter,
+    sampled: Dict,
+    analysis_service,
+    segments: Optional[List[Tuple[int, int, float]]] = None,
+) -> Tuple[dict, dict, dict]:
+    """
+    Scan ``sample`` (``rows`` of ``messages``) and expand it to whole-chat
+    estimates.
+
+    Per-sender counts are the stratum sizes (exact, or estimated for a
+    frame) and the other metrics counts are scaled to them. Reply delays
+    and ignored-message checks are taken for each sampled row against its
+    real neighbours in ``messages``, so sampling doesn't stretch the gaps
+    between messages. Trends only need timestamps and senders, so they
+    are counted exactly -- or, with ``segments`` (``messages`` is then a
+    frame, see _expand_frame()), scaled up from the frame's segments.
+    Linguistics come from the sample as is. The report carries the
+    sampling standard error of each sender's ratio metrics. Senders with
+    no sampled rows (more strata than budget) are listed as unsampled.
+    """
+
+    sample_parsed = {**parsed_data, "messages": sample, "sorted": True}
+
+    scan = analysis_service.scan(sample_parsed)
+
+    names = messages.senders
+    sender_population = Counter()
+    sender_sample = Counter()
+
+    for stratum, size in population.items():
+        sender = names[stratum[0]]
+        sender_population[sender] += size
+        sender_sample[sender] += sampled.get(stratum, 0)
+
+    factors = {
+        sender: sender_population[sender] / sender_sample[sender]
+        for sender in sender_population
+        if sender_sample[sender]
+    }
+
+    total = sum(population.values())
+
+    _expand_metrics(scan["metrics"], messages, rows, factors, total)
+    scan["engagement"] = _engagement_in_context(
+        analysis_service.engagement_engine.accumulator(),
+        messages,
+        rows,
+        sender_population,
+        factors,
+        total,
+    )
+
+    if segments is None:
+        scan["trends"] = _exact_trends(analysis_service.trend_engine.accumulator(), messages)
+    else:
+        scan["trends"] = _weighted_trends(analysis_service.trend_engine, messages, segments)
+
+    report = {
+        "sample_size": len(rows),
+        "population": total,
+        "segments": None if segments is None else len(segments),
+        "strata": len(population),
+        "strata_sampled": sum(1 for size in sampled.values() if size),
+        "unsampled_senders": sorted(
+            sender for sender in sender_population if sender and sender not in factors
+        ),
+        "approximate": ["linguistics"] if segments is None else ["linguistics", "trends"],
+        "error_estimates": _error_estimates(
+            sample, sender_population, analysis_service.metrics_engine.EMOJI_PATTERN
+        ),
+    }
+
+    return sample_parsed, scan, report
+
+
+def _expand_metrics(
+    accumulator, table: MessageTable, rows: List[int], factors: Dict, total: int
+) -> None:
+
+    timestamps = table.timestamps
+    sender_ids = table.sender_ids
+    names = table.senders
+
+    for metrics in accumulator.participant_metrics.values():
+        metrics["reply_delays"] = Counter()
+
+    # Reply delay of a sampled row: against the message really before it
+    for row in rows:
+        if row == 0:
+            continue
+
+        sender = names[sender_ids[row]]
+        if sender and names[sender_ids[row - 1]] != sender:
+            delay = timestamps[row] - timestamps[row - 1]
+
+            if 5 <= delay < 86400:
+                accumulator.participant_metrics[sender]["reply_delays"][delay] += 1
+
+    for sender, metrics in accumulator.participant_metrics.items():
+        for key, value in metrics.items():
+            if isinstance(value, int):
+                metrics[key] = round(value * factors[sender])
+
+    accumulator.total_messages = total
+    accumulator.first_timestamp = timestamps[0]
+    accumulator.last_timestamp = timestamps[-1]
+
+
+def _engagement_in_context(
+    accumulator,
+    table: MessageTable,
+    rows: List[int],
+    sender_population: Counter,
+    factors: Dict,
+    total: int,
+):
+
+    timestamps = table.timestamps
+    sender_ids = table.sender_ids
+    names = table.senders
+    window = accumulator.forward_message_check + 1
+
+    accumulator.senders.update(sender_population)
+
+    for row in rows:
+        end = min(row + window, len(table))
+        accumulator.judge_row(
+            list(timestamps[row:end]), [names[sender_id] for sender_id in sender_ids[row:end]]
+        )
+
+    for sender, by_speakers in accumulator.candidates.items():
+        accumulator.candidates[sender] = [round(count * factors[sender]) for count in by_speakers]
+
+    for sender, size in sender_population.items():
+        if sender:
+            accumulator.total_messages[sender] = size
+
+    accumulator.message_count = total
+
+    return accumulator
+
+
+def _exact_trends(accumulator, table: MessageTable):
+
+    names = table.senders
+
+    # Integer columns only: no text is decoded
+    for start in range(0, len(table), BLOCK_SIZE):
+        end = min(start + BLOCK_SIZE, len(table))
+        accumulator.update(
+            table.timestamps[start:end],
+            [names[sender_id] for sender_id in table.sender_ids[start:end]],
+            None,
+            None,
+        )
+
+    return accumulator
+
+
+def _weighted_trends(trend_engine, table: MessageTable, segments: List[Tuple[int, int, float]]):
+    """
+    Trend counts of a frame. A segment's own rows count as they are; the
+    rest of its stretch, (weight - 1) times as many messages, is spread
+    evenly over the days between its last row and the next segment, in
+    its own mix of senders and hours of day.
+    """
+
+    names = table.senders
+    timestamps = table.timestamps
+
+    day_totals = defaultdict(float)
+    hourly_counts = defaultdict(float)
+    sender_days = defaultdict(float)
+
+    for index, (start, end, weight) in enumerate(segments):
+        part = trend_engine.accumulator()
+        senders = [names[sender_id] for sender_id in table.sender_ids[start:end]]
+        part.update(timestamps[start:end], senders, None, None)
+
+        for counts, totals in (
+            (part.day_totals, day_totals),
+            (part.hourly_counts, hourly_counts),
+            (part.sender_days, sender_days),
+        ):
+            for key, count in counts.items():
+                totals[key] += count
+
+        extra = (weight - 1) * (end - start)
+        if extra <= 0:
+            continue
+
+        for hour, count in part.hourly_counts.items():
+            hourly_counts[hour] += count * (weight - 1)
+
+        low = timestamps[end - 1]
+        high = timestamps[segments[index + 1][0]] if index + 1 < len(segments) else low
+        shares = Counter(sender for sender in senders if sender)
+
+        for day, fraction in _day_fractions(low, max(low, high)):
+            day_totals[day] += extra * fraction
+            for sender, count in shares.items():
+                sender_days[(sender, day)] += count * (weight - 1) * fraction
+
+    accumulator = trend_engine.accumulator()
+
+    for counts, totals in (
+        (accumulator.day_totals, day_totals),
+        (accumulator.hourly_counts, hourly_counts),
+        (accumulator.sender_days, sender_days),
+    ):
+        counts.update({key: round(count) for key, count in totals.items() if round(count)})
+
+    return accumulator
+
+
+def _day_fractions(low: int, high: int) -> Iterator[Tuple[int, float]]:
+    """(epoch day, share of [low, high] in it); all of it on low's day if empty."""
+
+    if high == low:
+        yield low // 86400, 1.0
+        return
+
+    for day in range(low // 86400, high // 86400 + 1):
+        overlap = min(high, (day + 1) * 86400) - max(low, day * 86400)
+        if overlap > 0:
+            yield day, overlap / (high - low)
+
+
+def _error_estimates(sample: MessageTable, sender_population: Counter, emoji_pattern) -> dict:
+    """Standard error (with finite population correction) per sender and metric."""
+
+    values = defaultdict(lambda: defaultdict(list))
+
+    for index, text in enumerate(sample.texts()):
+        sender = sample.senders[sample.sender_ids[index]]
+        if not sender:
+            continue
+
+        if sample.kinds[index] in NON_TEXT_KINDS:
+            text = ""
+
+        hour = sample.timestamps[index] % 86400 // 3600
+        per_metric = values[sender]
+
+        per_metric["question_ratio"].append(text.count("?"))
+        per_metric["exclamation_ratio"].append(text.count("!"))
+        per_metric["emoji_density"].append(len(emoji_pattern.findall(text)))
+        per_metric["night_activity_ratio"].append(1 if 22 <= hour or hour <= 4 else 0)
+        per_metric["avg_message_length"].append(len(text))
+
+    estimates = {}
+
+    for sender, per_metric in values.items():
+        size = len(per_metric["avg_message_length"])
+        correction = 1 - size / sender_population[sender]
+
+        estimates[sender] = {
+            metric: (
+                round(math.sqrt(statistics.variance(per_metric[metric]) / size * correction), 4)
+                if size > 1
+                else None
+            )
+            for metric in ERROR_METRICS
+        }
+
+    return estimates
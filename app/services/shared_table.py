@@ -0,0 +1,156 @@
+import threading
+from array import array
+from multiprocessing.shared_memory import SharedMemory
+from typing import List, Tuple
+
+from app.services.message_table import MessageTable
+
+
+# Column order in a segment (as in a parse cache entry): widest first, so
+# every column starts aligned to its item size
+COLUMNS = (("timestamps", "q", 0), ("offsets", "q", 1), ("sender_ids", "i", 0), ("kinds", "B", 0))
+
+
+class SharedTableRef:
+    """
+    Picklable stand-in for a MessageTable copied into a shared memory
+    segment: the segment name and sizes, plus the senders table. Sending
+    one to a worker costs a few hundred bytes however long the chat is.
+    """
+
+    def __init__(self, name: str, rows: int, text_size: int, senders: List[str]):
+        self.name = name
+        self.rows = rows
+        self.text_size = text_size
+        self.senders = senders
+
+    def attach(self) -> Tuple[SharedMemory, MessageTable]:
+        """
+        Map the segment (worker side) and return it with a table of
+        read-only memoryview columns over it. The views must be dropped
+        before the segment is closed.
+        """
+
+        segment = SharedMemory(name=self.name)
+        buffer = segment.buf.toreadonly()
+
+        columns = {}
+        position = 0
+
+        for column, typecode, extra in COLUMNS:
+            size = array(typecode).itemsize * (self.rows + extra)
+            columns[column] = buffer[position : position + size].cast(typecode)
+            position += size
+
+        table = MessageTable(
+            columns["timestamps"],
+            columns["sender_ids"],
+            columns["kinds"],
+            columns["offsets"],
+            buffer[position : position + self.text_size],
+            self.senders,
+        )
+
+        return segment, table
+
+
+class SharedTables:
+    """
+    Parent-side registry of tables shared with worker processes.
+
+    share() copies a table into a new segment the first time and after that
+    hands out the same segment, counting references; release() drops one,
+    and the last one closes and unlinks the segment. Nothing in this
+    process maps the segment beyond the copy, so closing never waits on
+    views.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        # id(table) -> [table, segment, ref, count]; the table is kept so
+        # its id can't be reused while the segment is live
+        self._entries = {}
+
+    def share(self, table: MessageTable) -> SharedTableRef:
+
+        with self._lock:
+            entry = self._entries.get(id(table))
+
+            if entry is None:
+                segment, ref = _copy_to_segment(table)
+                entry = self._entries[id(table)] = [table, segment, ref, 0]
+
+            entry[3] += 1
+            return entry[2]
+
+    def release(self, ref: SharedTableRef) -> None:
+
+        with self._lock:
+            for key, entry in self._entries.items():
+                if entry[2] is ref:
+                    break
+            else:
+                return
+
+            entry[3] -= 1
+            if entry[3] > 0:
+                return
+
+            del self._entries[key]
+
+        segment = entry[1]
+        segment.close()
+        segment.unlink()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _copy_to_segment(table: MessageTable) -> Tuple[SharedMemory, SharedTableRef]:
+
+    rows = len(table)
+
+    # Slices (windows) carry absolute offsets into a shared text blob
+    base = table.offsets[0]
+    text_size = table.offsets[rows] - base
+
+    offsets = table.offsets
+    if base:
+        offsets = array("q", [offset - base for offset in offsets])
+
+    sources = {
+        "timestamps": table.timestamps,
+        "offsets": offsets,
+        "sender_ids": table.sender_ids,
+        "kinds": table.kinds,
+    }
+
+    sizes = [array(typecode).itemsize * (rows + extra) for _, typecode, extra in COLUMNS]
+
+    # Zero-size segments aren't allowed
+    segment = SharedMemory(create=True, size=max(sum(sizes) + text_size, 1))
+
+    try:
+        buffer = segment.buf
+        position = 0
+
+        for (column, typecode, _), size in zip(COLUMNS, sizes):
+            source = sources[column]
+            if getattr(source, "typecode", getattr(source, "format", None)) != typecode:
+                source = array(typecode, source)
+
+            buffer[position : position + size] = memoryview(source).cast("B")
+            position += size
+
+        buffer[position : position + text_size] = memoryview(table.text)[base : base + text_size]
+        del buffer
+
+    except BaseException:
+        segment.close()
+        segment.unlink()
+        raise
+
+    ref = SharedTableRef(segment.name, rows, text_size, list(table.senders))
+
+    return segment, ref
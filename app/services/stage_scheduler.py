@@ -0,0 +1,138 @@
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+from app.services.cancellation import AnalysisCancelled
+
+
+class Stage:
+    """
+    One step of the analysis graph.
+
+    ``run`` is called with the values named in ``inputs`` (positionally, in
+    that order) and its return value is stored under ``output``.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        run: Callable,
+        inputs: Sequence[str] = (),
+        output: Optional[str] = None,
+    ):
+        self.name = name
+        self.run = run
+        self.inputs = tuple(inputs)
+        self.output = output or name
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, inputs={self.inputs!r})"
+
+
+def prune_stages(stages: List[Stage], targets: Iterable[str]) -> List[Stage]:
+    """
+    Keep only the stages needed to produce ``targets`` (declaration order is
+    preserved). Names no stage produces are assumed to be initial values.
+    """
+
+    producers = {stage.output: stage for stage in stages}
+    needed = set()
+    queue = list(targets)
+
+    while queue:
+        name = queue.pop()
+        stage = producers.get(name)
+
+        if stage is None or stage.name in needed:
+            continue
+
+        needed.add(stage.name)
+        queue.extend(stage.inputs)
+
+    return [stage for stage in stages if stage.name in needed]
+
+
+def fan_out(stages: List[Stage], key: str, variants: Sequence[str]) -> List[Stage]:
+    """
+    Copy every stage that depends (directly or not) on the initial value
+    ``key`` once per variant; a copy reads and writes "<name>@<variant>"
+    and ``key`` itself becomes "<key>@<variant>". Stages upstream of ``key``
+    stay shared, so they still run once.
+    """
+
+    dependent = {key}
+    grew = True
+
+    while grew:
+        grew = False
+        for stage in stages:
+            if stage.output not in dependent and dependent.intersection(stage.inputs):
+                dependent.add(stage.output)
+                grew = True
+
+    fanned = [stage for stage in stages if stage.output not in dependent]
+
+    for variant in variants:
+
+        def scoped(name):
+            return f"{name}@{variant}" if name in dependent else name
+
+        fanned.extend(
+            Stage(
+                f"{stage.name}@{variant}",
+                stage.run,
+                [scoped(name) for name in stage.inputs],
+                scoped(stage.output),
+            )
+            for stage in stages
+            if stage.output in dependent
+        )
+
+    return fanned
+
+
+def run_stages(
+    stages: List[Stage],
+    values: Dict,
+    cancel=None,
+    priority: Optional[Dict[str, int]] = None,
+) -> Dict:
+    """
+    Run ``stages`` as a dependency graph over ``values`` (the initial inputs)
+    and return every value, initial and computed.
+
+    Stages run one at a time, each once all of its inputs exist: in
+    declaration order, or by ``priority`` (stage name -> rank, lowest first)
+    among the ready ones, so a stage that has just become ready can
+    overtake lower-ranked ones that were waiting. They run serially on
+    purpose: the engines are GIL-bound Python and one stage (the message
+    scan) dominates, so threads don't overlap them and a process per stage
+    costs more in pickling than it saves. Big chats get their cores from
+    the map-reduced scan instead (AnalysisService.scan).
+
+    ``cancel`` (a CancelToken) is checked between stages: once it's set no
+    further stage starts, and AnalysisCancelled carries the values computed
+    so far.
+    """
+
+    values = dict(values)
+    pending = list(stages)
+
+    while pending:
+
+        ready = [stage for stage in pending if all(name in values for name in stage.inputs)]
+
+        if not ready:
+            raise ValueError(f"Stages with unsatisfiable inputs: {pending}")
+
+        if priority is not None:
+            stage = min(ready, key=lambda stage: priority.get(stage.name, len(priority)))
+        else:
+            stage = ready[0]
+
+        if cancel is not None and cancel.cancelled:
+            # Nothing new starts; what finished is kept
+            raise AnalysisCancelled(values)
+
+        pending.remove(stage)
+        values[stage.output] = stage.run(*[values[name] for name in stage.inputs])
+
+    return values
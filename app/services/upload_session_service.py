@@ -0,0 +1,235 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import uuid
+from typing import Dict, Optional, Tuple
+
+from app.services.archive_service import GZIP_MAGIC, ZIP_MAGIC, ZSTD_MAGIC
+from app.services.parser_service import WhatsAppParser
+
+
+class UploadSession:
+    """
+    One resumable upload.
+
+    Byte ranges are appended to a temp file in order. For plain-text
+    exports the complete lines received so far are parsed a range at a
+    time (next_range() / add_part(), in a worker process) while the rest is
+    still uploading, so by the time the last range lands the chat is
+    mostly parsed. Archives can't be parsed mid-stream and are parsed from
+    the temp file once finished.
+    """
+
+    def __init__(self, parser: WhatsAppParser, directory: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.parser = parser
+        self.received = 0
+        self.total = None
+        self.updated_at = time.monotonic()
+
+        fd, self.path = tempfile.mkstemp(prefix="upload-", suffix=".part", dir=directory)
+        self._file = os.fdopen(fd, "wb")
+        self._lock = threading.Lock()
+
+        # Held (on the event loop) while a range is being parsed, so ranges
+        # are parsed one at a time and in order
+        self.parse_lock = asyncio.Lock()
+
+        self.is_archive = None
+        self._head = b""
+        self._digest = hashlib.sha256()
+
+        self.date_order = None
+        self._parts = []
+        self._parsed = 0
+        self._line_end = 0
+        self._retry_from = 0
+
+    @property
+    def sha256(self) -> str:
+        """Parse-cache key of the bytes received so far."""
+        return self._digest.hexdigest()
+
+    def append(self, start: int, data: bytes, total: Optional[int] = None) -> int:
+        """
+        Append bytes starting at ``start``; returns the new received offset.
+
+        Re-sent bytes that were already stored are ignored, so a client can
+        blindly retry its last range. A gap raises ValueError.
+        """
+
+        with self._lock:
+
+            if start > self.received:
+                raise ValueError(f"Expected range starting at {self.received}")
+
+            data = data[self.received - start :]
+            if total is not None:
+                self.total = total
+
+            if data:
+                # Flushed, so a worker parsing the file by path sees it
+                self._file.write(data)
+                self._file.flush()
+                self._digest.update(data)
+
+                if self.is_archive is None:
+                    self._sniff(data)
+
+                line_break = data.rfind(b"\n")
+                if line_break != -1:
+                    self._line_end = self.received + line_break + 1
+
+                self.received += len(data)
+
+            self.updated_at = time.monotonic()
+            return self.received
+
+    def _sniff(self, data: bytes) -> None:
+
+        # Ranges can be a few bytes long: decide once the magic is all here
+        self._head = (self._head + data)[:4]
+
+        if len(self._head) == 4:
+            self.is_archive = self._head.startswith((ZIP_MAGIC, GZIP_MAGIC, ZSTD_MAGIC))
+
+    def next_range(self, final: bool = False) -> Optional[Tuple[int, int, Optional[str]]]:
+        """
+        (start, end, date_order) of the received plain text to parse next
+        with WhatsAppParser.parse_range(), or None if there's nothing to
+        parse yet. Mid-upload that's whole lines only; ``final`` takes the
+        rest of a finished upload.
+        """
+
+        with self._lock:
+
+            if self.is_archive is not False:
+                return None
+
+            end = self.received if final else self._line_end
+
+            if end <= self._parsed:
+                return None
+
+            if self.date_order is None and not final and end < self._retry_from:
+                # Day/month order still open: wait for more text before
+                # parsing the start of the chat again
+                return None
+
+            return self._parsed, end, self.date_order
+
+    def add_part(self, start: int, end: int, part: Dict, final: bool = False) -> None:
+        """Keep the parse_range() ``part`` of a next_range() range."""
+
+        with self._lock:
+
+            if start != self._parsed:
+                raise ValueError(f"Expected the range starting at {self._parsed}")
+
+            if part["date_order"] is None and self.date_order is None and not final:
+                # Parsed with a guessed day/month order -> parse it again
+                # later, once at least twice as much text is here
+                self._retry_from = 2 * end
+                return
+
+            self.date_order = self.date_order or part["date_order"]
+            self._parts.append(part)
+            self._parsed = end
+            self.updated_at = time.monotonic()
+
+    def finish(self) -> None:
+        """
+        Close the upload. Raises ValueError while bytes are still missing.
+
+        Plain text: parse the rest (next_range(final=True)), then result().
+        Archives (``is_archive``): parse the file at ``path``, e.g. in a
+        worker process.
+        """
+
+        with self._lock:
+
+            if self.total is not None and self.received != self.total:
+                raise ValueError(f"Upload incomplete: {self.received} of {self.total} bytes")
+
+            self._file.close()
+
+            if self.is_archive is None:
+                # Under four bytes in all: not an archive
+                self.is_archive = self._head.startswith((ZIP_MAGIC, GZIP_MAGIC, ZSTD_MAGIC))
+
+    def result(self) -> Dict:
+        """The parse of a finished plain-text upload, once every range is in."""
+
+        with self._lock:
+
+            if self._parsed != self.received:
+                raise ValueError(f"Parsed {self._parsed} of {self.received} bytes")
+
+            # Never settled -> the day-first default, as in ParseState.close()
+            return self.parser.merge_chunks(self._parts, self.date_order or "dmy", columnar=True)
+
+    def discard(self) -> None:
+
+        self._file.close()
+
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class UploadSessionStore:
+    """
+    In-process registry of resumable uploads.
+
+    Sessions live in this worker's memory, so resumable uploads need sticky
+    routing when the API runs more than one worker process.
+    """
+
+    # Idle sessions are dropped (with their temp file) after this long
+    TTL_SECONDS = 60 * 60
+
+    def __init__(self, parser: WhatsAppParser, directory: Optional[str] = None):
+        self.parser = parser
+        self.directory = directory
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def create(self) -> UploadSession:
+
+        self._expire()
+        session = UploadSession(self.parser, self.directory)
+
+        with self._lock:
+            self._sessions[session.id] = session
+
+        return session
+
+    def get(self, session_id: str) -> Optional[UploadSession]:
+        self._expire()
+        return self._sessions.get(session_id)
+
+    def discard(self, session_id: str) -> None:
+
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+
+        if session:
+            session.discard()
+
+    def _expire(self) -> None:
+
+        cutoff = time.monotonic() - self.TTL_SECONDS
+
+        with self._lock:
+            expired = [
+                session_id
+                for session_id, session in self._sessions.items()
+                if session.updated_at < cutoff
+            ]
+
+        for session_id in expired:
+            self.discard(session_id)
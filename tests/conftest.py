@@ -0,0 +1,6 @@
+import os
+
+# Settings are read at import time (app.core.config); the tests never open
+# a database connection, so any URL the engine accepts will do
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("GROQ_API_KEY", "test")
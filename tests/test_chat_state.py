@@ -0,0 +1,116 @@
+import io
+import json
+import zlib
+
+import pytest
+
+from app.services.analysis_pool import build_analysis_service
+from app.services.chat_state_service import chat_state_values, load_partials, resume_chat
+from app.services.parser_service import WhatsAppParser
+from tests.test_message_scan import build_chat
+
+
+LINES = build_chat().splitlines(keepends=True)
+
+
+class Record:
+    """The ChatState columns resume_chat() and chat_state_values() read."""
+
+    def __init__(self, values: dict):
+        self.__dict__.update(values)
+
+
+@pytest.fixture(scope="module")
+def parser():
+    return WhatsAppParser()
+
+
+@pytest.fixture(scope="module")
+def service():
+    return build_analysis_service()
+
+
+def export(lines) -> io.BytesIO:
+    return io.BytesIO("".join(lines).encode("utf-8"))
+
+
+def stored_state(parser, service, lines) -> dict:
+    """The state a first upload of ``lines`` leaves behind."""
+
+    parsed = parser.parse_file(export(lines), columnar=True)
+    return chat_state_values(parsed, service.scan(parsed))
+
+
+def full_analysis(parser, service, lines) -> dict:
+    return service.run(parser.parse_file(export(lines), columnar=True))
+
+
+@pytest.mark.parametrize("seekable", [False, True])
+@pytest.mark.parametrize("cut", [300, 1001, 1399])
+def test_resumed_analysis_equals_full_analysis(parser, service, seekable, cut):
+
+    state = stored_state(parser, service, LINES[:cut])
+
+    parsed, scan = resume_chat(state, export(LINES), parser, service, seekable)
+
+    assert parsed["meta"]["messages_added"] == len(LINES) - cut
+    assert service.run(parsed, scan=scan) == full_analysis(parser, service, LINES)
+
+
+def test_weekly_resumes_equal_full_analysis(parser, service):
+
+    state = stored_state(parser, service, LINES[:500])
+
+    for cut in (900, 1001, 1200, len(LINES)):
+        parsed, scan = resume_chat(state, export(LINES[:cut]), parser, service)
+        state = chat_state_values(parsed, scan, Record(state))
+
+    assert service.run(parsed, scan=scan) == full_analysis(parser, service, LINES)
+
+
+def test_cut_inside_a_minute_counts_the_messages_already_seen(parser, service):
+
+    # Two messages share the minute the first export ends on
+    lines = [
+        "01/02/2024, 10:00 am - Asha: one\n",
+        "01/02/2024, 10:01 am - Ben: two\n",
+        "01/02/2024, 10:01 am - Asha: three\n",
+        "01/02/2024, 10:01 am - Ben: four\n",
+        "01/02/2024, 10:05 am - Asha: five\n",
+    ]
+
+    state = stored_state(parser, service, lines[:3])
+    assert state["messages_at_last_timestamp"] == 2
+
+    parsed, scan = resume_chat(state, export(lines), parser, service)
+
+    assert parsed["meta"]["messages_added"] == 2
+    assert service.run(parsed, scan=scan) == full_analysis(parser, service, lines)
+
+
+def test_stored_reply_delays_stay_bounded(parser, service):
+
+    # Replies here come a few fixed gaps apart, thousands of times over
+    state = stored_state(parser, service, LINES)
+    metrics = load_partials(state["partials"], service)["metrics"]
+
+    for counts in metrics.participant_metrics.values():
+        delays = counts["reply_delays"]
+        assert len(delays) < delays.total()
+        assert all(5 <= delay < 86400 for delay in delays)
+
+
+@pytest.mark.parametrize(
+    "partials",
+    [
+        # Version 1 kept every reply delay in a list
+        zlib.compress(json.dumps({"version": 1, "scan": {}}).encode("utf-8")),
+        b"not zlib",
+    ],
+)
+def test_unreadable_partials_need_a_full_parse(parser, service, partials):
+
+    state = stored_state(parser, service, LINES[:300])
+    state["partials"] = partials
+
+    assert resume_chat(state, export(LINES), parser, service) is None
@@ -0,0 +1,125 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.engines.engagement_engine import EngagementEngine
+from app.engines.linguistic_engine import LinguisticEngine
+from app.engines.message_scan import map_reduce_scan, scan_messages, split_by_time
+from app.engines.metrics_engine import MetricsEngine
+from app.engines.trend_engine import TrendEngine
+from app.services.message_table import MessageTable
+from app.services.parser_service import WhatsAppParser
+
+
+ENGINES = {
+    "metrics": MetricsEngine(),
+    "engagement": EngagementEngine(),
+    "linguistics": LinguisticEngine(),
+    "trends": TrendEngine(),
+}
+
+
+def build_chat() -> str:
+    """
+    A month of busy days, a two-month silence, then another burst: most
+    equal time chunks over it hold no messages at all.
+    """
+
+    senders = ["Asha", "Ben", "Chëń", "देव"]
+    texts = [
+        "haha that's great 😂",
+        "why would you do that?",
+        "ok",
+        "<Media omitted>",
+        "see https://example.com",
+        "I think we should go tomorrow, honestly it's fine",
+        "This message was deleted",
+        "LOL no way!!",
+    ]
+
+    lines = []
+    index = 0
+
+    for start, days in ((datetime(2024, 1, 3, 8), 30), (datetime(2024, 4, 20, 9), 5)):
+        for day in range(days):
+            timestamp = start + timedelta(days=day)
+
+            for _ in range(40):
+                # Quick replies, then the odd long pause
+                timestamp += timedelta(minutes=3 if index % 11 else 200)
+                stamp = f"{timestamp:%d/%m/%Y}, {timestamp:%I:%M} {timestamp:%p}".lower()
+                sender = senders[(index * 7) % len(senders) if index % 5 else 0]
+                lines.append(f"{stamp} - {sender}: {texts[index % len(texts)]}")
+                index += 1
+
+    return "\n".join(lines) + "\n"
+
+
+@pytest.fixture(scope="module", params=[True, False], ids=["table", "list"])
+def parsed(request):
+    return WhatsAppParser().parse(build_chat(), columnar=request.param)
+
+
+def finalized(accumulators: dict) -> dict:
+    return {name: ENGINES[name].finalize(accumulator) for name, accumulator in accumulators.items()}
+
+
+def single_scan(parsed: dict) -> dict:
+
+    accumulators = {name: engine.accumulator() for name, engine in ENGINES.items()}
+    scan_messages(parsed, accumulators.values())
+
+    return finalized(accumulators)
+
+
+def factories() -> dict:
+    return {name: engine.accumulator for name, engine in ENGINES.items()}
+
+
+def test_most_time_chunks_are_empty(parsed):
+
+    parts = split_by_time(parsed["messages"], 20)
+
+    assert 1 < len(parts) < 20
+    assert sum(len(part) for part in parts) == len(parsed["messages"])
+
+
+@pytest.mark.parametrize("chunks", [1, 2, 3, 7, 20, 500])
+def test_map_reduce_equals_single_scan(parsed, chunks):
+
+    merged = map_reduce_scan(parsed, factories(), chunks)
+
+    assert finalized(merged) == single_scan(parsed)
+
+
+def test_map_reduce_on_executor_equals_single_scan(parsed):
+
+    with ThreadPoolExecutor(3) as executor:
+        merged = map_reduce_scan(parsed, factories(), 7, executor)
+
+    assert finalized(merged) == single_scan(parsed)
+
+
+@pytest.mark.parametrize("name", list(ENGINES))
+def test_merging_an_empty_chunk_changes_nothing(parsed, name):
+
+    engine = ENGINES[name]
+    expected = single_scan(parsed)[name]
+
+    scanned = engine.accumulator()
+    scan_messages(parsed, [scanned])
+    assert engine.finalize(scanned.merge(engine.accumulator())) == expected
+
+    scanned = engine.accumulator()
+    scan_messages(parsed, [scanned])
+    assert engine.finalize(engine.accumulator().merge(scanned)) == expected
+
+
+def test_map_reduce_of_an_empty_chat(parsed):
+
+    messages = parsed["messages"]
+    messages = messages.slice(0, 0) if isinstance(messages, MessageTable) else []
+    empty = {**parsed, "messages": messages}
+
+    assert finalized(map_reduce_scan(empty, factories(), 4)) == single_scan(empty)
@@ -0,0 +1,69 @@
+import io
+
+import pytest
+
+from app.services.parser_service import WhatsAppParser
+from tests.test_parser_chunking import build_chat, rows
+
+
+CHAT_LINES = build_chat(400).splitlines(keepends=True)
+
+
+def export(lines) -> io.BytesIO:
+    return io.BytesIO("".join(lines).encode("utf-8"))
+
+
+def clock_jump(lines, start: int, end: int, to: int):
+    """Lines with [start, end) moved to before ``to``, as after a clock jump."""
+    moved = lines[start:end]
+    rest = lines[:start] + lines[end:]
+    to -= len(moved)
+    return rest[:to] + moved + rest[to:]
+
+
+@pytest.fixture(scope="module")
+def parser():
+    return WhatsAppParser()
+
+
+@pytest.fixture(scope="module")
+def expected(parser):
+    return parser.parse("".join(CHAT_LINES), columnar=True)
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_overlapping_exports_merge_to_the_whole_chat(parser, expected, columnar):
+
+    first = export(CHAT_LINES[:250])
+    second = export(CHAT_LINES[150:])
+
+    merged = parser.parse_merged([first, second], columnar=columnar)
+
+    assert rows(merged) == rows(expected)
+    assert merged["senders"] == expected["senders"]
+    assert merged["meta"]["exports_merged"] == 2
+    assert merged["meta"]["duplicates_dropped"] == len(parser.parse("".join(CHAT_LINES[150:250]))["messages"])
+
+
+def test_out_of_order_export_is_deduplicated(parser, expected):
+
+    # The second export's clock jumped: a block of the overlap comes late
+    first = export(CHAT_LINES[:250])
+    second = export(clock_jump(CHAT_LINES[100:], 60, 120, 250))
+
+    merged = parser.parse_merged([first, second], columnar=True)
+
+    assert rows(merged) == rows(expected)
+    assert merged["meta"]["duplicates_dropped"] == len(parser.parse("".join(CHAT_LINES[100:250]))["messages"])
+
+
+def test_three_exports_with_repeats_inside_one(parser):
+
+    lines = CHAT_LINES[:40]
+    # One export really has the same message twice in a minute: kept twice
+    doubled = lines[:10] + [lines[9]] + lines[10:]
+
+    merged = parser.parse_merged([export(lines), export(doubled), export(lines[20:])])
+    alone = parser.parse("".join(doubled))
+
+    assert rows(merged) == rows(alone)
@@ -0,0 +1,147 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.services.message_table import MessageTable
+from app.services.parser_service import ParseState, WhatsAppParser
+
+
+def build_chat(count: int = 300) -> str:
+    """
+    Android export with multi-byte text (2-, 3- and 4-byte UTF-8),
+    multi-line messages, placeholders and system lines. It starts on the
+    12th, so day/month order stays ambiguous for the first messages.
+    """
+
+    senders = ["Asha", "Ben", "Chëń", "देव"]
+    texts = [
+        "hello there 😀",
+        "naïve café déjà vu",
+        "क्या हाल है? 🙏🏽",
+        "<Media omitted>",
+        "This message was deleted",
+        "see https://example.com",
+        "line one\nline two ✨\nline three",
+        "Missed voice call",
+        "Video call, see you at 5",
+        "Nice <This message was edited>",
+    ]
+
+    timestamp = datetime(2024, 1, 12, 22, 0)
+    lines = []
+
+    for index in range(count):
+        timestamp += timedelta(minutes=index % 3)
+        stamp = f"{timestamp:%d/%m/%y}, {timestamp:%I:%M} {timestamp:%p}".lstrip("0").lower()
+
+        if index % 37 == 5:
+            lines.append(f"{stamp} - Asha added Ben")
+            continue
+
+        sender = senders[index % len(senders)]
+        lines.append(f"{stamp} - {sender}: {texts[index % len(texts)]} #{index}")
+
+    return "\n".join(lines) + "\n"
+
+
+CHAT = build_chat().encode("utf-8")
+
+
+def rows(parsed: dict) -> list:
+
+    messages = parsed["messages"]
+    if isinstance(messages, MessageTable):
+        messages = list(messages)
+
+    return [(msg.timestamp, msg.sender, msg.sender_id, msg.text, msg.kind) for msg in messages]
+
+
+def assert_same_parse(actual: dict, expected: dict) -> None:
+    assert rows(actual) == rows(expected)
+    assert actual["senders"] == expected["senders"]
+    assert actual["participants"] == expected["participants"]
+    assert actual["meta"] == expected["meta"]
+
+
+@pytest.fixture(scope="module")
+def parser():
+    return WhatsAppParser()
+
+
+@pytest.fixture(scope="module")
+def chat_path(tmp_path_factory):
+
+    path = tmp_path_factory.mktemp("chats") / "chat.txt"
+    path.write_bytes(CHAT)
+
+    return str(path)
+
+
+@pytest.fixture(scope="module")
+def expected(parser):
+    return parser.parse_file(io.BytesIO(CHAT))
+
+
+def test_chat_has_multibyte_text():
+    # Small chunk sizes below only split characters if there are any
+    assert len(CHAT) > len(CHAT.decode("utf-8"))
+    assert "😀".encode("utf-8") in CHAT
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 7, 13, 64, 1000, 4093])
+def test_parse_stream_matches_parse_file(parser, expected, chunk_size):
+
+    state = ParseState(parser)
+    messages = list(parser.parse_stream(io.BytesIO(CHAT), state, chunk_size))
+
+    assert_same_parse(state.result(messages), expected)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 4093])
+def test_columnar_parse_stream_matches_parse_file(parser, expected, chunk_size):
+
+    parsed = parser.parse_file(io.BytesIO(CHAT), chunk_size=chunk_size, columnar=True)
+
+    assert isinstance(parsed["messages"], MessageTable)
+    assert_same_parse(parsed, expected)
+
+
+@pytest.mark.parametrize("workers", [2, 3, 5])
+@pytest.mark.parametrize("columnar", [False, True])
+def test_parse_parallel_matches_parse_file(expected, chat_path, workers, columnar):
+
+    parser = WhatsAppParser()
+    parser.PARALLEL_MIN_BYTES = 0
+
+    parsed = parser.parse_parallel(chat_path, workers=workers, columnar=columnar)
+
+    assert_same_parse(parsed, expected)
+
+
+@pytest.mark.parametrize("workers", [2, 7, 64])
+def test_parse_parallel_on_executor_matches_parse_file(expected, chat_path, workers):
+
+    # The route hands parse_parallel the analysis pool's workers this way
+    parser = WhatsAppParser()
+    parser.PARALLEL_MIN_BYTES = 0
+
+    with ThreadPoolExecutor(2) as executor:
+        parsed = parser.parse_parallel(
+            chat_path, workers=workers, columnar=True, executor=executor
+        )
+
+    assert_same_parse(parsed, expected)
+
+
+class UnusedExecutor:
+    def map(self, *args):
+        raise AssertionError("small files are parsed serially")
+
+
+def test_parse_parallel_parses_small_files_serially(expected, chat_path):
+
+    parsed = WhatsAppParser().parse_parallel(chat_path, workers=4, executor=UnusedExecutor())
+
+    assert_same_parse(parsed, expected)
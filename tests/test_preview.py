@@ -0,0 +1,203 @@
+import random
+import re
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.services import preview_service
+from app.services.analysis_pool import build_analysis_service
+from app.services.parser_service import WhatsAppParser
+from app.services.preview_service import preview_file, preview_scan
+
+
+BUDGET = 1000
+
+
+def build_chat(count: int, seed: int = 1) -> str:
+    """
+    Android export of ``count`` messages: busy and quiet days, a sender who
+    only ever posts bursts (so never replies), multi-line messages and
+    system lines.
+    """
+
+    rnd = random.Random(seed)
+    senders = ["Asha", "Ben", "Chëń", "देव"]
+    texts = ["ok", "haha 😂", "why would you?", "line one\nline two", "<Media omitted>", "see you at 5!"]
+
+    timestamp = datetime(2023, 1, 14, 9, 0)
+    lines = []
+    stamp = None
+
+    while len(lines) < count:
+        if stamp and rnd.random() < 0.002:
+            # Same minute as the message before: too quick to count as a reply
+            lines.extend(f"{stamp} - Zed: burst {index}" for index in range(3))
+            continue
+
+        timestamp += timedelta(minutes=rnd.choice([0, 1, 2, 5, 30, 600]))
+        stamp = f"{timestamp:%d/%m/%y}, {timestamp:%I:%M} {timestamp:%p}".lstrip("0").lower()
+
+        if rnd.random() < 0.01:
+            lines.append(f"{stamp} - Asha added Ben")
+            stamp = None
+        else:
+            lines.append(f"{stamp} - {rnd.choice(senders)}: {rnd.choice(texts)}")
+
+    return "\n".join(lines) + "\n"
+
+
+@pytest.fixture(scope="module")
+def parser():
+    return WhatsAppParser()
+
+
+@pytest.fixture(scope="module")
+def service():
+    return build_analysis_service()
+
+
+@pytest.fixture(scope="module")
+def chat_path(tmp_path_factory):
+
+    path = tmp_path_factory.mktemp("chats") / "chat.txt"
+    path.write_text(build_chat(40000), encoding="utf-8")
+
+    return str(path)
+
+
+@pytest.fixture(scope="module")
+def exact(parser, service, chat_path):
+
+    with open(chat_path, "rb") as f:
+        parsed = parser.parse_file(f, columnar=True)
+
+    return parsed, service.run(parsed)
+
+
+def participant_metrics(service, scan: dict) -> dict:
+    return service.metrics_engine.finalize(scan["metrics"])["participant_metrics"]
+
+
+def parsed_bytes(monkeypatch, parser) -> list:
+    """Byte counts of every parse_range() call; streaming parses fail."""
+
+    calls = []
+    parse_range = parser.parse_range
+
+    def counting(path, start, end, date_order=None):
+        calls.append(end - start)
+        return parse_range(path, start, end, date_order)
+
+    def streaming(*args, **kwargs):
+        raise AssertionError("a large chat was parsed whole")
+
+    monkeypatch.setattr(parser, "parse_range", counting)
+    monkeypatch.setattr(parser, "parse_stream", streaming)
+
+    return calls
+
+
+def test_large_export_is_read_in_bounded_segments(monkeypatch, parser, service, tmp_path):
+
+    parsed = []
+
+    for count in (40000, 160000):
+        path = tmp_path / f"chat-{count}.txt"
+        path.write_text(build_chat(count), encoding="utf-8")
+
+        calls = parsed_bytes(monkeypatch, parser)
+        preview_file(str(path), parser, service, BUDGET, seed=1)
+        monkeypatch.undo()
+
+        parsed.append(sum(calls))
+
+    # Four times the chat, about the same bytes parsed
+    assert parsed[1] < 1.2 * parsed[0]
+    assert parsed[0] < path.stat().st_size / 10
+
+
+def test_frame_estimates_match_the_exact_analysis(parser, service, chat_path, exact):
+
+    parsed, expected = exact
+    sample, scan, report = preview_file(chat_path, parser, service, BUDGET, seed=1)
+
+    assert report["segments"] is not None
+    assert report["sample_size"] <= BUDGET
+    assert "trends" in report["approximate"]
+
+    result = service.run(sample, scan=scan)
+
+    assert result["chat_metrics"]["total_messages"] == pytest.approx(len(parsed["messages"]), rel=0.05)
+    assert result["chat_metrics"]["time_span_days"] == expected["chat_metrics"]["time_span_days"]
+
+    estimated = participant_metrics(service, scan)
+    counted = participant_metrics(service, service.scan(parsed))
+
+    for name in ("Asha", "Ben", "Chëń", "देव"):
+        assert estimated[name]["message_count"] == pytest.approx(counted[name]["message_count"], rel=0.15)
+        # Delays are real gaps to the message before, not gaps in the sample
+        assert estimated[name]["reply_delays"]
+        assert set(estimated[name]["reply_delays"]) <= set(counted[name]["reply_delays"])
+
+    assert result["trends"]["average_daily_activity"] == pytest.approx(
+        expected["trends"]["average_daily_activity"], rel=0.15
+    )
+    assert result["trends"]["night_activity_ratio"] == pytest.approx(
+        expected["trends"]["night_activity_ratio"], abs=0.05
+    )
+
+
+def test_cached_parse_is_previewed_from_row_segments(service, exact, monkeypatch):
+
+    parsed, expected = exact
+
+    def exact_trends(*args):
+        raise AssertionError("trends counted over the whole table")
+
+    monkeypatch.setattr(preview_service, "_exact_trends", exact_trends)
+
+    sample, scan, report = preview_scan(parsed, service, BUDGET, seed=1)
+    result = service.run(sample, scan=scan)
+
+    # Stratum sizes are rounded one by one
+    assert report["population"] == pytest.approx(len(parsed["messages"]), rel=0.001)
+    assert result["trends"]["average_daily_activity"] == pytest.approx(
+        expected["trends"]["average_daily_activity"], rel=0.15
+    )
+
+
+def test_window_is_bisected_for(parser, service, chat_path, exact):
+
+    parsed, _ = exact
+    window = (
+        parsed["messages"].timestamps[len(parsed["messages"]) // 4],
+        parsed["messages"].timestamps[len(parsed["messages"]) // 4 * 3],
+    )
+    inside = service.window(parsed, *window)["messages"]
+
+    sample, _, report = preview_file(chat_path, parser, service, BUDGET, window=window, seed=1)
+
+    assert report["population"] == pytest.approx(len(inside), rel=0.05)
+    assert all(window[0] <= timestamp < window[1] for timestamp in sample["messages"].timestamps)
+
+
+def test_month_first_order_found_past_the_probe(parser, service, tmp_path):
+
+    # m/d/yy with a first month whose days all stay at or below 12
+    chat = build_chat(40000)
+    chat = re.sub(r"^(\d{1,2})/(\d{2})/(\d{2})", r"\2/\1/\3", chat, flags=re.MULTILINE)
+    path = tmp_path / "chat.txt"
+    path.write_text(chat, encoding="utf-8")
+
+    sample, _, _ = preview_file(str(path), parser, service, BUDGET, seed=1)
+
+    assert sample["meta"]["date_order"] == "mdy"
+
+
+def test_sender_who_never_replies_gets_through_the_engines(service, exact):
+
+    # Zed only posts bursts, so has no reply delays and no median reply time
+    parsed, expected = exact
+
+    assert participant_metrics(service, service.scan(parsed))["Zed"]["median_reply_time"] is None
+    assert "Zed" in expected["behavior"]
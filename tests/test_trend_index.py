@@ -0,0 +1,71 @@
+from datetime import datetime
+
+import pytest
+
+from app.services.analysis_pool import build_analysis_service
+from app.services.message_table import to_epoch
+from app.services.parser_service import WhatsAppParser
+from tests.test_message_scan import build_chat
+
+
+HOUR = 3600
+
+WINDOWS = [
+    (None, None),
+    (None, to_epoch(datetime(2024, 1, 10))),
+    (to_epoch(datetime(2024, 1, 10, 13)), to_epoch(datetime(2024, 1, 20, 7))),
+    # Starts in the silence, ends mid-burst
+    (to_epoch(datetime(2024, 3, 1)), to_epoch(datetime(2024, 4, 22, 15))),
+    (to_epoch(datetime(2024, 1, 5, 9)), to_epoch(datetime(2024, 1, 5, 10))),
+    (to_epoch(datetime(2024, 2, 20)), to_epoch(datetime(2024, 3, 20))),
+    (to_epoch(datetime(2024, 4, 21)), None),
+]
+
+
+@pytest.fixture(scope="module")
+def service():
+    return build_analysis_service()
+
+
+@pytest.fixture(scope="module", params=[True, False], ids=["table", "list"])
+def parsed(request):
+    return WhatsAppParser().parse(build_chat(), columnar=request.param)
+
+
+@pytest.fixture(scope="module")
+def index(service, parsed):
+    return service.trend_engine.index(parsed["messages"])
+
+
+@pytest.mark.parametrize("start, end", WINDOWS)
+def test_indexed_window_trends_match_a_scan(service, parsed, index, start, end):
+
+    window = service.window(parsed, start, end)
+    expected = service.trend_engine.run(window)
+
+    assert index.covers(start, end)
+    got = service.trend_engine.finalize(index.accumulator(start, end))
+
+    assert got == expected
+    # First-seen order carries into the result dicts
+    assert list(got["hourly_distribution"]) == list(expected["hourly_distribution"])
+    assert list(got["daily_counts"]) == list(expected["daily_counts"])
+
+
+@pytest.mark.parametrize("start, end", WINDOWS)
+def test_indexed_window_matches_the_full_analysis(service, parsed, index, start, end):
+
+    window = service.window(parsed, start, end)
+
+    indexed = service.run_universes(window, ["mcu"], trend_index=index)
+    scanned = service.run_universes(window, ["mcu"])
+
+    assert indexed == scanned
+
+
+def test_index_size_follows_buckets_not_messages(parsed, index):
+
+    buckets = {(msg.sender, to_epoch(msg.timestamp) // HOUR) for msg in parsed["messages"]}
+    kept = sum(len(rows) for rows in index.sender_first_rows.values())
+
+    assert kept == len(buckets) < len(parsed["messages"])
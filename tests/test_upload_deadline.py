@@ -0,0 +1,140 @@
+import asyncio
+import io
+import time
+
+import pytest
+from fastapi import BackgroundTasks, Request, Response, UploadFile
+
+from app.api.routes import analysis as routes
+from app.services.parse_cache import ParseCache
+from tests.test_preview import build_chat
+
+
+MESSAGES = 150000
+DEADLINE_MS = 200
+
+# Hashing and spooling the upload come before the first deadline check
+SLACK = 1.0
+
+
+class Session:
+    """In-memory stand-in for the request's and the jobs' DB sessions."""
+
+    records = {}
+
+    def query(self, *args):
+        return self
+
+    def filter(self, *args):
+        return self
+
+    def first(self):
+        return None
+
+    def add(self, record):
+        self.records[record.id] = record
+
+    def get(self, model, record_id):
+        return self.records.get(record_id)
+
+    def execute(self, statement):
+        pass
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(scope="module")
+def chat():
+    return build_chat(MESSAGES).encode("utf-8")
+
+
+@pytest.fixture(autouse=True)
+def app_state(monkeypatch, tmp_path):
+
+    async def users(payload):
+        return {name: "summary" for name in payload}
+
+    async def group(payload):
+        return "summary"
+
+    monkeypatch.setattr(routes, "SessionLocal", Session)
+    monkeypatch.setattr(routes, "parse_cache", ParseCache(str(tmp_path)))
+    monkeypatch.setattr(routes.ai_service, "generate_user_summaries", users)
+    monkeypatch.setattr(routes.ai_service, "generate_group_summary", group)
+
+    yield
+    Session.records.clear()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def pool():
+    yield routes.analysis_pool
+    routes.analysis_pool.shutdown()
+
+
+async def receive():
+    # A client that stays connected
+    await asyncio.Event().wait()
+
+
+async def upload(chat: bytes, deadline_ms=None, start=None) -> tuple:
+    """(response body, seconds until it was ready, its background tasks) of POST /upload."""
+
+    background_tasks = BackgroundTasks()
+    began = time.monotonic()
+
+    result = await routes.analyze_chat(
+        request=Request({"type": "http"}, receive),
+        response=Response(),
+        background_tasks=background_tasks,
+        file=UploadFile(io.BytesIO(chat), filename="chat.txt"),
+        universe="mcu",
+        sections=None,
+        from_=start,
+        to=None,
+        mode="exact",
+        exact=False,
+        keep_partial=False,
+        x_deadline_ms=deadline_ms,
+        db=Session(),
+    )
+
+    return result, time.monotonic() - began, background_tasks
+
+
+@pytest.mark.parametrize("start", [None, "2023-02-01"], ids=["whole", "window"])
+def test_large_upload_answers_by_its_deadline(chat, start):
+
+    async def run():
+
+        result, elapsed, background_tasks = await upload(chat, DEADLINE_MS, start)
+
+        began = time.monotonic()
+        await background_tasks()
+
+        return result, elapsed, time.monotonic() - began
+
+    result, elapsed, finishing = asyncio.run(run())
+
+    # Parse and scan alone outlast the deadline: nothing but meta in time
+    assert elapsed < DEADLINE_MS / 1000 + SLACK < finishing
+    assert list(result) == ["meta"]
+    assert result["meta"]["skipped"][0] == "chat_metrics"
+    assert result["meta"]["skipped"][-1] == "ai_insights"
+
+    job = routes.analysis_jobs.get(result["meta"]["job"]["id"])
+    (record,) = Session.records.values()
+
+    assert job.status == "complete"
+    assert record.analysis is job.result
+    assert record.participants_count == len(job.result["meta"]["participants"])
+
+    # The job's analysis is the one the upload gets without a deadline
+    expected, _, background_tasks = asyncio.run(upload(chat, start=start))
+
+    assert not background_tasks.tasks
+    assert job.result == expected
@@ -0,0 +1,97 @@
+import gzip
+import re
+
+import pytest
+
+from app.services.parser_service import WhatsAppParser
+from app.services.upload_session_service import UploadSession
+from tests.test_parser_chunking import CHAT, assert_same_parse, build_chat
+
+
+@pytest.fixture
+def parser():
+    return WhatsAppParser()
+
+
+@pytest.fixture
+def session(parser, tmp_path):
+
+    session = UploadSession(parser, str(tmp_path))
+    yield session
+    session.discard()
+
+
+def parse_received(session: UploadSession, final: bool = False) -> None:
+
+    # What the route runs in the analysis pool
+    while True:
+        span = session.next_range(final)
+        if span is None:
+            return
+
+        part = session.parser.parse_range(session.path, *span)
+        session.add_part(span[0], span[1], part, final)
+
+
+def upload(session: UploadSession, data: bytes, range_size: int, parse: bool = True) -> None:
+
+    for start in range(0, len(data), range_size):
+        session.append(start, data[start : start + range_size], len(data))
+
+        if parse:
+            parse_received(session)
+
+    session.finish()
+
+
+@pytest.mark.parametrize("range_size", [1, 3, 100, 4093, len(CHAT)])
+def test_ranges_parsed_as_they_arrive_match_parse(parser, session, range_size):
+
+    upload(session, CHAT, range_size)
+    parse_received(session, final=True)
+
+    assert session.is_archive is False
+    assert_same_parse(session.result(), parser.parse(CHAT.decode("utf-8"), columnar=True))
+
+
+def test_ranges_left_for_finalize_match_parse(parser, session):
+
+    # Pool busy for every PUT: finalize parses it all
+    upload(session, CHAT, 512, parse=False)
+    parse_received(session, final=True)
+
+    assert_same_parse(session.result(), parser.parse(CHAT.decode("utf-8"), columnar=True))
+
+
+def test_month_first_order_found_after_ambiguous_start(parser, session):
+
+    # Rewritten as m/d/yy; nothing before the 13th settles the order
+    chat = re.sub(r"^(\d{1,2})/01/24", r"1/\1/24", build_chat(600), flags=re.MULTILINE)
+    chat = chat.encode("utf-8")
+
+    upload(session, chat, 200)
+    parse_received(session, final=True)
+
+    parsed = session.result()
+
+    assert parsed["meta"]["date_order"] == "mdy"
+    assert_same_parse(parsed, parser.parse(chat.decode("utf-8"), columnar=True))
+
+
+def test_archive_sniffed_across_short_first_ranges(session):
+
+    archive = gzip.compress(CHAT)
+
+    upload(session, archive, 1)
+
+    assert session.is_archive is True
+    assert session.next_range(final=True) is None
+
+
+def test_text_shorter_than_archive_magic(session):
+
+    upload(session, b"hi", 1)
+    parse_received(session, final=True)
+
+    assert session.is_archive is False
+    assert len(session.result()["messages"]) == 0